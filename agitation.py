@@ -0,0 +1,235 @@
+# =============================================================================
+# agitation.py - Wave agitation time series statistics (exceedance, downtime)
+# =============================================================================
+
+import csv
+import hashlib
+import json
+import os
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from config import Config
+from images import content_digest
+
+SERIES_FILE_TYPES = ["csv", "txt"]
+
+# Noms de colonnes reconnus dans les exports des calculs d'agitation
+POINT_COLUMNS = ("point", "poste", "berth", "station")
+HS_COLUMNS = ("hs", "hm0", "hauteur")
+TP_COLUMNS = ("tp", "tpeak", "periode", "période")
+
+HS_BINS = np.arange(0.0, 5.0 + 0.05, 0.05)  # classes de Hs (m)
+TP_BINS = np.arange(0.0, 25.0 + 0.5, 0.5)   # classes de Tp (s)
+
+
+def _cache_dir() -> str:
+    path = os.path.join(Config.CACHE_DIR, "agitation")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _find_column(columns, candidates):
+    for col in columns:
+        if col.strip().lower() in candidates:
+            return col
+    return None
+
+
+def _read_series(path: str):
+    """Lit une série Hs/Tp par blocs et retourne (point, hs, tp) pour chaque bloc"""
+    with open(path, newline="", encoding="utf-8", errors="ignore") as f:
+        sample = f.read(4096)
+    try:
+        sep = csv.Sniffer().sniff(sample, delimiters=",;\t ").delimiter
+    except csv.Error:
+        sep = ","
+    default_point = os.path.splitext(os.path.basename(path))[0]
+
+    reader = pd.read_csv(path, sep=sep, chunksize=Config.AGITATION_CHUNK_ROWS, skipinitialspace=True)
+    for chunk in reader:
+        hs_col = _find_column(chunk.columns, HS_COLUMNS)
+        tp_col = _find_column(chunk.columns, TP_COLUMNS)
+        if hs_col is None or tp_col is None:
+            raise ValueError(f"Colonnes Hs/Tp introuvables dans {os.path.basename(path)}")
+        point_col = _find_column(chunk.columns, POINT_COLUMNS)
+        points = chunk[point_col].astype(str).to_numpy() if point_col else np.full(len(chunk), default_point)
+        hs = pd.to_numeric(chunk[hs_col], errors="coerce").to_numpy(dtype=np.float64)
+        tp = pd.to_numeric(chunk[tp_col], errors="coerce").to_numpy(dtype=np.float64)
+        valid = ~(np.isnan(hs) | np.isnan(tp))
+        yield points[valid], hs[valid], tp[valid]
+
+
+class _Accumulator:
+    """Compteurs par point d'amarrage, mis à jour bloc par bloc"""
+
+    def __init__(self, thresholds: np.ndarray):
+        self.thresholds = thresholds
+        self.points: Dict[str, int] = {}
+        self.samples = np.zeros(0, dtype=np.int64)
+        self.exceed = np.zeros((0, len(thresholds)), dtype=np.int64)
+        self.hs_hist = np.zeros((0, len(HS_BINS) + 1), dtype=np.int64)
+        self.joint = np.zeros((0, len(HS_BINS) + 1, len(TP_BINS) + 1), dtype=np.int64)
+
+    def _codes(self, points: np.ndarray) -> np.ndarray:
+        names, inverse = np.unique(points, return_inverse=True)
+        mapping = np.array([self.points.setdefault(name, len(self.points)) for name in names], dtype=np.int64)
+        grow = len(self.points) - len(self.samples)
+        if grow > 0:
+            self.samples = np.pad(self.samples, (0, grow))
+            self.exceed = np.pad(self.exceed, ((0, grow), (0, 0)))
+            self.hs_hist = np.pad(self.hs_hist, ((0, grow), (0, 0)))
+            self.joint = np.pad(self.joint, ((0, grow), (0, 0), (0, 0)))
+        return mapping[inverse]
+
+    def add(self, points: np.ndarray, hs: np.ndarray, tp: np.ndarray):
+        if not len(hs):
+            return
+        codes = self._codes(points)
+        n = len(self.points)
+        self.samples += np.bincount(codes, minlength=n)
+
+        # Dépassements : une colonne par seuil, comptée par point
+        above = hs[:, None] > self.thresholds[None, :]
+        for j in range(len(self.thresholds)):
+            self.exceed[:, j] += np.bincount(codes, weights=above[:, j], minlength=n).astype(np.int64)
+
+        hs_bin = np.digitize(hs, HS_BINS)
+        tp_bin = np.digitize(tp, TP_BINS)
+        nh, nt = self.joint.shape[1], self.joint.shape[2]
+        self.hs_hist += np.bincount(codes * nh + hs_bin, minlength=n * nh).reshape(n, nh)
+        self.joint += np.bincount((codes * nh + hs_bin) * nt + tp_bin, minlength=n * nh * nt).reshape(n, nh, nt)
+
+
+def _input_key(paths: List[str], seuils: Dict[str, float]) -> str:
+    # Empreinte tirée du nom dans l'upload store, sinon mise en cache (taille, date) :
+    # les séries ne sont pas relues à chaque réexécution du formulaire
+    digest = hashlib.sha256()
+    for path in sorted(paths):
+        digest.update(content_digest(path).encode())
+    digest.update(json.dumps(seuils, sort_keys=True).encode())
+    digest.update(np.concatenate([HS_BINS, TP_BINS]).tobytes())
+    return digest.hexdigest()[:20]
+
+
+def compute_agitation_statistics(paths: List[str], seuils: Dict[str, float]) -> dict:
+    """
+    Calcule, en flux, les probabilités de dépassement de Hs, les taux d'indisponibilité
+    par poste et par classe de navire (seuil Hs max) et la distribution jointe Hs/Tp.
+    Le résultat est mis en cache selon le contenu des fichiers et les seuils.
+    """
+    key = _input_key(paths, seuils)
+    result_path = os.path.join(_cache_dir(), f"{key}.json")
+    if os.path.exists(result_path):
+        with open(result_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    classes = list(seuils)
+    acc = _Accumulator(np.array([float(seuils[c]) for c in classes], dtype=np.float64))
+    for path in paths:
+        for points, hs, tp in _read_series(path):
+            acc.add(points, hs, tp)
+    if not acc.points:
+        raise ValueError("Aucune donnée Hs/Tp exploitable")
+
+    names = sorted(acc.points, key=acc.points.get)
+    samples = acc.samples.astype(np.float64)
+    downtime = 100 * acc.exceed / samples[:, None]
+
+    # Probabilité de dépassement P(Hs > borne inférieure de classe)
+    cumul = acc.hs_hist[:, ::-1].cumsum(axis=1)[:, ::-1]
+    exceedance = cumul[:, 1:] / samples[:, None]
+
+    joint_path = os.path.join(_cache_dir(), f"{key}_jointe.npz")
+    np.savez_compressed(joint_path, points=np.array(names), joint=acc.joint, hs_bins=HS_BINS, tp_bins=TP_BINS)
+
+    result = {
+        "points": [
+            {"point": name, "nb_echantillons": int(acc.samples[i])} for i, name in enumerate(names)
+        ],
+        "indisponibilite": [
+            {
+                "point": name,
+                "classe": classe,
+                "hs_max": float(seuils[classe]),
+                "indisponibilite_pct": round(float(downtime[i, j]), 2),
+            }
+            for i, name in enumerate(names)
+            for j, classe in enumerate(classes)
+        ],
+        "indisponibilite_par_classe": [
+            {
+                "classe": classe,
+                "hs_max": float(seuils[classe]),
+                "indisponibilite_moyenne_pct": round(float(downtime[:, j].mean()), 2),
+                "indisponibilite_max_pct": round(float(downtime[:, j].max()), 2),
+            }
+            for j, classe in enumerate(classes)
+        ],
+        "depassement": {
+            "hs": HS_BINS.tolist(),
+            "probabilites": {name: exceedance[i].round(6).tolist() for i, name in enumerate(names)},
+        },
+        "distribution_jointe": joint_path,
+    }
+    result["figures"] = _render_figures(result, acc, names, key)
+
+    with open(result_path, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False)
+    return result
+
+
+def _render_figures(result: dict, acc: _Accumulator, names: List[str], key: str) -> List[dict]:
+    """Courbes de dépassement, indisponibilité par poste et distribution jointe"""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    figures = []
+
+    fig, ax = plt.subplots(figsize=(8, 5), dpi=150)
+    for name in names:
+        ax.semilogy(HS_BINS, np.maximum(result["depassement"]["probabilites"][name], 1e-6), label=name)
+    for classe, seuil in zip(result["indisponibilite_par_classe"], acc.thresholds):
+        ax.axvline(seuil, linestyle="--", linewidth=0.8, color="grey")
+        ax.text(seuil, 1.0, classe["classe"], rotation=90, va="top", fontsize=7)
+    ax.set_xlabel("Hs (m)")
+    ax.set_ylabel("Probabilité de dépassement")
+    ax.legend(fontsize=7)
+    fig.tight_layout()
+    path = os.path.join(_cache_dir(), f"{key}_depassement.png")
+    fig.savefig(path)
+    plt.close(fig)
+    figures.append({"chemin": path, "legende": "Probabilités de dépassement de Hs par poste"})
+
+    downtime = np.array([r["indisponibilite_pct"] for r in result["indisponibilite"]]).reshape(len(names), -1)
+    fig, ax = plt.subplots(figsize=(8, 5), dpi=150)
+    width = 0.8 / max(downtime.shape[1], 1)
+    for j, classe in enumerate(result["indisponibilite_par_classe"]):
+        ax.bar(np.arange(len(names)) + j * width, downtime[:, j], width, label=classe["classe"])
+    ax.set_xticks(np.arange(len(names)) + width * (downtime.shape[1] - 1) / 2)
+    ax.set_xticklabels(names, rotation=45, ha="right", fontsize=7)
+    ax.set_ylabel("Indisponibilité (%)")
+    ax.legend(fontsize=7)
+    fig.tight_layout()
+    path = os.path.join(_cache_dir(), f"{key}_indisponibilite.png")
+    fig.savefig(path)
+    plt.close(fig)
+    figures.append({"chemin": path, "legende": "Indisponibilité par poste et par classe de navire"})
+
+    joint = acc.joint.sum(axis=0)[1:-1, 1:-1]
+    total = joint.sum()
+    fig, ax = plt.subplots(figsize=(8, 5), dpi=150)
+    image = ax.pcolormesh(TP_BINS, HS_BINS, 100 * joint / total if total else joint, cmap="Blues", shading="flat")
+    fig.colorbar(image, ax=ax, label="Occurrence (%)")
+    ax.set_xlabel("Tp (s)")
+    ax.set_ylabel("Hs (m)")
+    fig.tight_layout()
+    path = os.path.join(_cache_dir(), f"{key}_jointe.png")
+    fig.savefig(path)
+    plt.close(fig)
+    figures.append({"chemin": path, "legende": "Distribution jointe Hs/Tp (tous postes)"})
+
+    return figures
@@ -0,0 +1,349 @@
+# =============================================================================
+# bathymetry.py - Bathymetric grid ingestion and under-keel clearance
+# =============================================================================
+
+import json
+import math
+import mmap
+import os
+import re
+from functools import lru_cache
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from config import Config
+from utils import file_sha256
+
+# Fichiers de sondes (x y z) et grilles déjà maillées
+XYZ_EXTENSIONS = [".xyz", ".txt", ".csv"]
+GRID_EXTENSIONS = [".asc", ".npy"]
+BATHY_FILE_TYPES = [ext.lstrip(".") for ext in XYZ_EXTENSIONS + GRID_EXTENSIONS]
+
+ROW_CHUNK = 1024  # lignes de grille traitées par bloc
+# Séparateurs acceptés (virgule, point-virgule, tabulation, fins de ligne) ramenés à l'espace
+_SEPARATORS = bytes.maketrans(b",;\t\r\n", b"     ")
+
+
+def _cache_dir() -> str:
+    path = os.path.join(Config.CACHE_DIR, "bathymetrie")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _iter_text_chunks(path: str, start: int = 0) -> Iterator[bytes]:
+    """Lit un fichier texte par blocs mappés en mémoire, coupés sur une fin de ligne"""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size <= start:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            pos, size = start, len(mm)
+            while pos < size:
+                end = min(pos + Config.BATHY_CHUNK_BYTES, size)
+                if end < size:
+                    newline = mm.rfind(b"\n", pos, end)
+                    end = newline + 1 if newline > pos else mm.find(b"\n", end) + 1 or size
+                yield mm[pos:end]
+                pos = end
+
+
+def _parse_numbers(block: bytes) -> np.ndarray:
+    """
+    Convertit un bloc texte (séparateurs espace, virgule ou point-virgule) en tableau,
+    sans passer par une liste de chaînes Python : une copie du bloc, puis le tableau
+    """
+    return np.fromstring(block.translate(_SEPARATORS), dtype=np.float64, sep=" ")
+
+
+def _xyz_layout(path: str) -> Tuple[int, int]:
+    """Retourne (octet de début des données, nombre de colonnes)"""
+    offset = 0
+    with open(path, "rb") as f:
+        for line in f:
+            fields = line.decode("ascii", errors="ignore").replace(",", " ").replace(";", " ").split()
+            try:
+                [float(v) for v in fields]
+            except ValueError:
+                offset += len(line)  # ligne d'en-tête
+                continue
+            if len(fields) >= 3:
+                return offset, len(fields)
+            offset += len(line)
+    raise ValueError("Aucune sonde x y z trouvée dans le fichier")
+
+
+def _iter_soundings(path: str) -> Iterator[np.ndarray]:
+    """Itère sur les sondes d'un fichier XYZ par blocs de (n, 3)"""
+    offset, ncols = _xyz_layout(path)
+    for block in _iter_text_chunks(path, offset):
+        values = _parse_numbers(block)
+        if values.size:
+            yield values[: values.size - values.size % ncols].reshape(-1, ncols)[:, :3]
+
+
+def _grid_xyz(path: str, grid_path: str, cell_size: Optional[float], negative_depths: bool) -> dict:
+    """Maille un fichier de sondes en deux passes, sans le charger entièrement"""
+    # Passe 1 : emprise et nombre de sondes
+    xmin = ymin = math.inf
+    xmax = ymax = -math.inf
+    count = 0
+    for block in _iter_soundings(path):
+        xmin, xmax = min(xmin, block[:, 0].min()), max(xmax, block[:, 0].max())
+        ymin, ymax = min(ymin, block[:, 1].min()), max(ymax, block[:, 1].max())
+        count += len(block)
+    if not count:
+        raise ValueError("Aucune sonde x y z trouvée dans le fichier")
+
+    width, height = max(xmax - xmin, 1e-9), max(ymax - ymin, 1e-9)
+    if not cell_size:
+        cell_size = math.sqrt(width * height / count)
+    # Plafonner la taille de grille en élargissant les mailles si besoin
+    cell_size = max(cell_size, math.sqrt(width * height / Config.BATHY_MAX_CELLS))
+    ncols = int(width // cell_size) + 1
+    nrows = int(height // cell_size) + 1
+
+    # Passe 2 : accumulation sur disque (somme et nombre de sondes par maille)
+    sums_path, counts_path = grid_path + ".sum.npy", grid_path + ".count.npy"
+    sums = np.lib.format.open_memmap(sums_path, mode="w+", dtype=np.float64, shape=(nrows * ncols,))
+    counts = np.lib.format.open_memmap(counts_path, mode="w+", dtype=np.uint32, shape=(nrows * ncols,))
+    for block in _iter_soundings(path):
+        ix = np.minimum(((block[:, 0] - xmin) / cell_size).astype(np.int64), ncols - 1)
+        iy = np.minimum(((ymax - block[:, 1]) / cell_size).astype(np.int64), nrows - 1)  # ligne 0 = nord
+        cells, inverse = np.unique(iy * ncols + ix, return_inverse=True)
+        sums[cells] += np.bincount(inverse, weights=block[:, 2])
+        counts[cells] += np.bincount(inverse).astype(np.uint32)
+
+    grid = np.lib.format.open_memmap(grid_path, mode="w+", dtype=np.float32, shape=(nrows, ncols))
+    sign = -1.0 if negative_depths else 1.0
+    for row in range(0, nrows, ROW_CHUNK):
+        stop = min(row + ROW_CHUNK, nrows)
+        s, c = sums[row * ncols: stop * ncols], counts[row * ncols: stop * ncols]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            grid[row:stop] = (sign * s / c).reshape(stop - row, ncols)
+    grid.flush()
+    del sums, counts, grid
+    os.remove(sums_path)
+    os.remove(counts_path)
+
+    return {
+        "x_min": float(xmin), "y_max": float(ymax),
+        "pas": float(cell_size), "nb_sondes": int(count),
+    }
+
+
+def _grid_ascii(path: str, grid_path: str, negative_depths: bool) -> dict:
+    """Convertit une grille ESRI ASCII (.asc) en tableau mappé sur disque"""
+    header = {}
+    offset = 0
+    with open(path, "rb") as f:
+        for line in f:
+            fields = line.decode("ascii", errors="ignore").split()
+            if len(fields) != 2 or not re.match(r"[A-Za-z_]", fields[0]):
+                break
+            header[fields[0].lower()] = float(fields[1])
+            offset += len(line)
+
+    ncols, nrows = int(header["ncols"]), int(header["nrows"])
+    cell_size = header["cellsize"]
+    nodata = header.get("nodata_value")
+    x_min = header.get("xllcorner", header.get("xllcenter", 0.0))
+    y_min = header.get("yllcorner", header.get("yllcenter", 0.0))
+
+    grid = np.lib.format.open_memmap(grid_path, mode="w+", dtype=np.float32, shape=(nrows, ncols))
+    flat = grid.reshape(-1)
+    sign = -1.0 if negative_depths else 1.0
+    pos = 0
+    for block in _iter_text_chunks(path, offset):
+        values = _parse_numbers(block)[: flat.size - pos]
+        if nodata is not None:
+            values[values == nodata] = np.nan
+        flat[pos: pos + values.size] = sign * values
+        pos += values.size
+    grid.flush()
+    del grid, flat
+
+    return {
+        "x_min": float(x_min), "y_max": float(y_min + nrows * cell_size),
+        "pas": float(cell_size), "nb_sondes": pos,
+    }
+
+
+def _grid_stats(grid: np.ndarray) -> dict:
+    """Statistiques de profondeur calculées bloc par bloc"""
+    depth_min, depth_max, total, wet = math.inf, -math.inf, 0.0, 0
+    for row in range(0, grid.shape[0], ROW_CHUNK):
+        block = np.asarray(grid[row: row + ROW_CHUNK])
+        valid = block[~np.isnan(block)]
+        if valid.size:
+            depth_min = min(depth_min, float(valid.min()))
+            depth_max = max(depth_max, float(valid.max()))
+            total += float(valid.sum(dtype=np.float64))
+            wet += valid.size
+    return {
+        "profondeur_min": depth_min if wet else None,
+        "profondeur_max": depth_max if wet else None,
+        "profondeur_moyenne": total / wet if wet else None,
+        "nb_mailles_renseignees": wet,
+    }
+
+
+def load_bathymetry_grid(path: str, cell_size: Optional[float] = None, negative_depths: bool = False) -> dict:
+    """
+    Maille un fichier bathymétrique (sondes XYZ ou grille .asc/.npy) et met le résultat
+    en cache sur disque. Retourne les métadonnées de la grille (chemin, emprise, stats).
+    Les profondeurs sont stockées positives vers le bas.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in XYZ_EXTENSIONS + GRID_EXTENSIONS:
+        raise ValueError(f"Format bathymétrique non supporté : {ext}")
+
+    key = f"{file_sha256(path)[:20]}_{cell_size or 'auto'}_{int(negative_depths)}"
+    meta_path = os.path.join(_cache_dir(), f"{key}.json")
+    if os.path.exists(meta_path):
+        with open(meta_path, encoding="utf-8") as f:
+            return json.load(f)
+
+    grid_path = os.path.join(_cache_dir(), f"{key}.npy")
+    if ext == ".npy":
+        source = np.load(path, mmap_mode="r")
+        if source.ndim != 2:
+            raise ValueError("La grille .npy doit être un tableau 2D")
+        grid = np.lib.format.open_memmap(grid_path, mode="w+", dtype=np.float32, shape=source.shape)
+        sign = -1.0 if negative_depths else 1.0
+        for row in range(0, source.shape[0], ROW_CHUNK):
+            grid[row: row + ROW_CHUNK] = sign * source[row: row + ROW_CHUNK]
+        grid.flush()
+        del grid, source
+        geo = {"x_min": 0.0, "y_max": 0.0, "pas": float(cell_size or 1.0), "nb_sondes": None}
+    elif ext == ".asc":
+        geo = _grid_ascii(path, grid_path, negative_depths)
+    else:
+        geo = _grid_xyz(path, grid_path, cell_size, negative_depths)
+
+    grid = open_grid({"grille": grid_path})
+    meta = {
+        "source": os.path.basename(path),
+        "grille": grid_path,
+        "lignes": int(grid.shape[0]),
+        "colonnes": int(grid.shape[1]),
+        **geo,
+        **_grid_stats(grid),
+    }
+    del grid
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+    return meta
+
+
+def open_grid(meta: dict) -> np.ndarray:
+    """Ouvre la grille en cache en lecture seule, sans la charger en mémoire"""
+    return np.load(meta["grille"], mmap_mode="r")
+
+
+def parse_tide_height(maree) -> float:
+    """Extrait la hauteur de marée (m) du champ libre 'Marée' des conditions"""
+    if isinstance(maree, (int, float)):
+        return float(maree)
+    match = re.search(r"[-+]?\d+(?:[.,]\d+)?", str(maree or ""))
+    return float(match.group().replace(",", ".")) if match else 0.0
+
+
+def zone_window(meta: dict, zone: Optional[dict]) -> Optional[Tuple[int, int, int, int]]:
+    """Lignes et colonnes (début, fin) de la grille couvertes par une zone {x_min, x_max, y_min, y_max}"""
+    if not zone:
+        return None
+    pas = meta["pas"]
+    col0 = max(0, int((min(zone["x_min"], zone["x_max"]) - meta["x_min"]) // pas))
+    col1 = min(meta["colonnes"], int((max(zone["x_min"], zone["x_max"]) - meta["x_min"]) // pas) + 1)
+    row0 = max(0, int((meta["y_max"] - max(zone["y_min"], zone["y_max"])) // pas))
+    row1 = min(meta["lignes"], int((meta["y_max"] - min(zone["y_min"], zone["y_max"])) // pas) + 1)
+    return row0, max(row0, row1), col0, max(col0, col1)
+
+
+@lru_cache(maxsize=32)
+def _ukc_counts(grid_path: str, required_depths: Tuple[float, ...],
+                window: Optional[Tuple[int, int, int, int]] = None) -> Tuple[int, Tuple[int, ...], Optional[float]]:
+    """Mailles renseignées, mailles sous chaque profondeur requise et profondeur min (dans la fenêtre)"""
+    grid = np.load(grid_path, mmap_mode="r")
+    row0, row1, col0, col1 = window or (0, grid.shape[0], 0, grid.shape[1])
+    thresholds = np.asarray(required_depths, dtype=np.float64)
+    shallow = np.zeros(len(thresholds), dtype=np.int64)
+    wet, depth_min = 0, None
+    for row in range(row0, row1, ROW_CHUNK):
+        block = np.asarray(grid[row: min(row + ROW_CHUNK, row1), col0:col1])
+        valid = np.sort(block[~np.isnan(block)])
+        if valid.size:
+            depth_min = float(valid[0]) if depth_min is None else min(depth_min, float(valid[0]))
+        wet += valid.size
+        shallow += np.searchsorted(valid, thresholds, side="left")
+    return wet, tuple(int(n) for n in shallow), depth_min
+
+
+def compute_under_keel_clearance(meta: dict, navires: List[dict], maree=0.0,
+                                 marge_pct: float = None) -> List[dict]:
+    """
+    Calcule le pied de pilote de chaque navire sur la grille bathymétrique :
+    profondeur + marée - tirant d'eau max (avant/arrière), comparé à une marge requise.
+    La conformité n'est jugée que sur la zone d'intérêt (meta["zone"], chenal ou
+    zone d'évolution) : sur toute la grille, bancs et rives fausseraient le verdict.
+    """
+    if not meta or not meta.get("grille") or not os.path.exists(meta["grille"]):
+        return []
+    marge_pct = Config.UKC_MARGE_PCT if marge_pct is None else marge_pct
+    tide = parse_tide_height(maree)
+
+    drafts = [max(float(n.get("tirant_eau_av") or 0), float(n.get("tirant_eau_ar") or 0)) for n in navires]
+    required = [draft * (1 + marge_pct) - tide for draft in drafts]
+    zone = meta.get("zone")
+    wet, shallow, depth_min = _ukc_counts(meta["grille"], tuple(required), zone_window(meta, zone))
+
+    results = []
+    for navire, draft, required_depth, n_shallow in zip(navires, drafts, required, shallow):
+        ukc_min = depth_min + tide - draft if depth_min is not None else None
+        results.append({
+            "navire": navire.get("nom", ""),
+            "tirant_eau_max": draft,
+            "maree": tide,
+            "profondeur_min": depth_min,
+            "ukc_min": round(ukc_min, 2) if ukc_min is not None else None,
+            "ukc_requis": round(draft * marge_pct, 2),
+            "profondeur_requise": round(required_depth, 2),
+            "mailles_insuffisantes_pct": round(100 * n_shallow / wet, 2) if wet else 0.0,
+            # Sans zone d'intérêt, seul le pourcentage est indicatif
+            "conforme": (wet > 0 and n_shallow == 0) if zone else None,
+        })
+    return results
+
+
+def render_depth_map(meta: dict, required_depth: Optional[float] = None) -> str:
+    """Produit une carte des profondeurs sous-échantillonnée (PNG) et retourne son chemin"""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    suffix = f"_{required_depth:.2f}" if required_depth is not None else ""
+    out_path = os.path.splitext(meta["grille"])[0] + f"_carte{suffix}.png"
+    if os.path.exists(out_path):
+        return out_path
+
+    grid = open_grid(meta)
+    step = max(1, math.ceil(max(grid.shape) / Config.BATHY_PREVIEW_PX))
+    preview = np.asarray(grid[::step, ::step])
+    extent = [
+        meta["x_min"], meta["x_min"] + meta["colonnes"] * meta["pas"],
+        meta["y_max"] - meta["lignes"] * meta["pas"], meta["y_max"],
+    ]
+
+    fig, ax = plt.subplots(figsize=(8, 6), dpi=150)
+    image = ax.imshow(preview, cmap="viridis_r", extent=extent, interpolation="nearest")
+    fig.colorbar(image, ax=ax, label="Profondeur (m)")
+    if required_depth is not None:
+        ax.contour(preview, levels=[required_depth], colors="red", linewidths=0.8,
+                   extent=extent, origin="upper")
+    ax.set_title(f"Bathymétrie - {meta.get('source', '')}")
+    ax.set_xlabel("X (m)")
+    ax.set_ylabel("Y (m)")
+    fig.tight_layout()
+    fig.savefig(out_path)
+    plt.close(fig)
+    return out_path
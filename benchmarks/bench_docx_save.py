@@ -0,0 +1,71 @@
+# =============================================================================
+# bench_docx_save.py - Save time and size: doc.save() vs save_document()
+# =============================================================================
+#
+# Usage : python benchmarks/bench_docx_save.py [nb_images] [niveau_compression]
+# Construit un document de 150 images (PNG et JPEG) et compare l'enregistrement
+# python-docx standard avec l'enregistrement qui stocke les médias sans recompression.
+
+import os
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from docx import Document
+from docx.shared import Mm
+from PIL import Image
+
+from docx_package import save_document
+
+
+def build_document(nb_images: int, workdir: str) -> Document:
+    rng = np.random.default_rng(0)
+    doc = Document()
+    for i in range(nb_images):
+        # Planche type : aplats de couleur et bruit, comme une capture de simulateur
+        base = rng.integers(0, 255, (60, 80, 3), dtype=np.uint8)
+        img = Image.fromarray(base).resize((1200, 900), Image.NEAREST)
+        noise = rng.integers(0, 24, (900, 1200, 3), dtype=np.uint8)
+        img = Image.fromarray(np.asarray(img) + noise)
+        path = os.path.join(workdir, f"planche_{i}.{'png' if i % 2 else 'jpg'}")
+        img.save(path, quality=85)
+        doc.add_paragraph(f"Simulation {i + 1} : manœuvre d'accostage, vent 25 nœuds.")
+        doc.add_picture(path, width=Mm(140))
+    return doc
+
+
+def timed(save, repeat: int = 3):
+    best, size = None, 0
+    for _ in range(repeat):
+        buffer = BytesIO()
+        start = time.perf_counter()
+        save(buffer)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+        size = len(buffer.getvalue())
+    return best, size
+
+
+def main():
+    nb_images = int(sys.argv[1]) if len(sys.argv) > 1 else 150
+    level = int(sys.argv[2]) if len(sys.argv) > 2 else None
+
+    with tempfile.TemporaryDirectory() as workdir:
+        doc = build_document(nb_images, workdir)
+        base_time, base_size = timed(doc.save)
+        new_time, new_size = timed(lambda target: save_document(doc, target, level))
+
+    print(f"Document de {nb_images} images")
+    print(f"{'méthode':<28}{'temps (s)':>12}{'taille (Mo)':>14}")
+    print(f"{'doc.save()':<28}{base_time:>12.3f}{base_size / 1e6:>14.2f}")
+    print(f"{'save_document()':<28}{new_time:>12.3f}{new_size / 1e6:>14.2f}")
+    print(f"Gain de temps : {100 * (1 - new_time / base_time):.0f} %, "
+          f"écart de taille : {100 * (new_size / base_size - 1):+.2f} %")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+# =============================================================================
+# bench_sharded_render.py - Render time and memory: single pass vs sharded loops
+# =============================================================================
+#
+# Usage : python benchmarks/bench_sharded_render.py [nb_simulations ...]
+# Rend le template de l'entreprise avec N simulations (une planche par essai) et N/4
+# scénarios d'urgence, en un seul passage puis avec les boucles rendues par lots
+# (ShardedDocxTemplate). Chaque mesure tourne dans un processus neuf ; le temps CPU et
+# la mémoire indiqués sont ceux du processus principal (le gain de temps réel dépend du
+# nombre de cœurs disponibles). Les textes des deux documents sont comparés.
+# Chaque mesure tourne dans son propre dossier temporaire : les caches (cache partagé de
+# rendu compris) y sont créés vides, rien n'est écrit dans le dépôt.
+
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from io import BytesIO
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+TEMPLATE = os.path.join(ROOT, "templates", "report_template.docx")
+
+
+def skeleton(tree):
+    """Rapport vide ayant la forme attendue par le template (listes vides, textes vides)"""
+    from template_index import LOOP_ITEM
+
+    if not tree:
+        return ""
+    if LOOP_ITEM in tree:
+        return []
+    return {key: skeleton(sub) for key, sub in tree.items()}
+
+
+def build_report(nb_simulations: int, workdir: str) -> dict:
+    import numpy as np
+    from PIL import Image
+
+    from template_index import template_usage
+
+    rng = np.random.default_rng(0)
+    planches = []
+    for i in range(20):
+        path = os.path.join(workdir, f"planche_{i}.png")
+        img = Image.fromarray(rng.integers(0, 255, (45, 60, 3), dtype=np.uint8)).resize((1200, 900), Image.NEAREST)
+        img.save(path)
+        planches.append(path)
+
+    data = skeleton(template_usage(TEMPLATE)["_arbre"])
+    data["simulations"] = {
+        "simulations": [
+            {"id": f"S{i + 1}", "navire": f"Navire {i % 6}", "manoeuvre": "Accostage tribord",
+             "conditions_env": {"vent": f"{10 + i % 25} nœuds"},
+             "resultat": "Réussite" if i % 4 else "Échec",
+             "commentaire_pilote": f"Remorqueur avant sollicité à 80 % (essai {i + 1})" if i % 2 else "",
+             "images": {"planche": planches[i % len(planches)]}}
+            for i in range(nb_simulations)
+        ],
+        "scenarios_urgence": {
+            "scenarios": [
+                {"evenement": f"Perte de propulsion {i + 1}", "analyse": "Mouillage d'urgence efficace",
+                 "figure": planches[(i + 7) % len(planches)]}
+                for i in range(nb_simulations // 4)
+            ],
+        },
+    }
+    return data
+
+
+def render(report_path: str, parallel: bool) -> None:
+    """(processus de mesure) rend le rapport et affiche temps, pic mémoire et texte"""
+    from docx import Document
+    from docxtpl import DocxTemplate
+
+    from docx_package import save_document
+    from sharded_render import ShardedDocxTemplate, render_pool
+    from word_export import ImageRegistry, replace_all_images
+
+    with open(report_path, encoding="utf-8") as f:
+        context = json.load(f)
+    if parallel:
+        # Processus de rendu démarrés à l'avance, comme dans l'application après la première génération
+        for future in [render_pool().submit(int, 1) for _ in range(8)]:
+            future.result()
+
+    start, cpu_start = time.perf_counter(), time.process_time()
+    registry = ImageRegistry()
+    doc = ShardedDocxTemplate(TEMPLATE, min_items=0) if parallel else DocxTemplate(TEMPLATE)
+    doc.registry = registry
+    context = replace_all_images(context, doc, registry=registry)
+    doc.render(context)
+    buffer = BytesIO()
+    save_document(doc, buffer)
+    elapsed, cpu = time.perf_counter() - start, time.process_time() - cpu_start
+
+    text = "\n".join(p.text for p in Document(BytesIO(buffer.getvalue())).paragraphs)
+    print(json.dumps({
+        "temps": elapsed,
+        "cpu": cpu,
+        "memoire": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "taille": len(buffer.getvalue()),
+        "texte": text,
+    }))
+
+
+def measure(report_path: str, parallel: bool) -> dict:
+    # Dossier de travail neuf : Config.CACHE_DIR, SHARED_CACHE_DIR... (relatifs) y pointent,
+    # aucun rendu n'est servi par le cache d'une mesure précédente
+    cwd = tempfile.mkdtemp(dir=os.path.dirname(report_path))
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), "--render", report_path, str(int(parallel))],
+                         capture_output=True, text=True, check=True, cwd=cwd)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [100, 400]
+    print(f"{'simulations':<14}{'mode':<12}{'temps (s)':>12}{'CPU princ. (s)':>16}"
+          f"{'pic mémoire (Mo)':>18}{'taille (Mo)':>14}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for nb in sizes:
+            report_path = os.path.join(workdir, f"rapport_{nb}.json")
+            with open(report_path, "w", encoding="utf-8") as f:
+                json.dump(build_report(nb, workdir), f)
+            results = {}
+            for parallel, label in ((False, "classique"), (True, "par lots")):
+                results[label] = measure(report_path, parallel)
+                r = results[label]
+                print(f"{nb:<14}{label:<12}{r['temps']:>12.2f}{r['cpu']:>16.2f}{r['memoire'] / 1e6:>18.0f}{r['taille'] / 1e6:>14.2f}")
+            identical = results["classique"]["texte"] == results["par lots"]["texte"]
+            print(f"{'':<14}texte identique : {'oui' if identical else 'NON'}")
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["--render"]:
+        render(sys.argv[2], sys.argv[3] == "1")
+    else:
+        main()
@@ -7,14 +7,166 @@ import os
 class Config:
     UPLOAD_DIR = "uploads"
     OUTPUT_DIR = "exports"
+    CACHE_DIR = "cache"
+    DRAFTS_DB = os.path.join("brouillons", "brouillons.sqlite3")
+    REVISIONS_DB = os.path.join("brouillons", "revisions.sqlite3")  # empreintes des révisions exportées
+    UPLOAD_INDEX = os.path.join(UPLOAD_DIR, "index.sqlite3")
     
-    # Required fields for validation
-    REQUIRED_FIELDS = [
-        "titre", "projet", "code_projet", "client", 
-        "type_doc", "numero_doc", "annee_doc"
+    # Validation rules: (path in the report, label, rule)
+    # Rules: "rempli" (non-empty value), "non_vide" (non-empty list),
+    # "un_rempli" (list with at least one filled item), "annee" (4-digit year)
+    # "[]" in a path applies the rule to every item of the list
+    VALIDATION_RULES = [
+        ("metadonnees.titre", "Titre du rapport", "rempli"),
+        ("metadonnees.projet", "Nom du projet", "rempli"),
+        ("metadonnees.code_projet", "Code projet", "rempli"),
+        ("metadonnees.client", "Client", "rempli"),
+        ("metadonnees.type", "Type de document", "rempli"),
+        ("metadonnees.numero", "Numéro de document", "rempli"),
+        ("metadonnees.annee", "Année", "rempli"),
+        ("metadonnees.annee", "Année", "annee"),
+        ("introduction.guidelines", "Éléments de l'introduction", "rempli"),
+        ("introduction.objectifs", "Objectifs de l'étude", "rempli"),
+        ("donnees_navires.navires.navires", "Navires projetés", "non_vide"),
+        ("donnees_navires.navires.navires[].nom", "Nom du navire", "rempli"),
+        ("simulations.simulations", "Simulations", "non_vide"),
+        ("synthese_redigee", "Synthèse rédigée", "rempli"),
+        ("conclusion", "Conclusion", "rempli"),
+        ("recommandations", "Recommandations", "un_rempli"),
     ]
     
+    # Tab of the form where each report section is filled
+    SECTION_TABS = {
+        "metadonnees": "📁 Métadonnées",
+        "introduction": "✍️ Introduction",
+        "donnees_entree": "📊 Données d'entrée",
+        "donnees_navires": "🚢 Navires",
+        "simulations": "🌀 Simulations",
+        "analyse_synthese": "📈 Analyse",
+        "synthese_redigee": "📝 Conclusion",
+        "conclusion": "📝 Conclusion",
+        "recommandations": "📝 Conclusion",
+        "figures": "📎 Annexes",
+        "tableaux": "📎 Annexes",
+    }
+    
+    # Brouillons : préfixes des clés de session (widgets, listes) par section du rapport
+    DRAFT_SECTIONS = {
+        "metadonnees": ("meta_", "rev_", "revisions"),
+        "introduction": ("intro_",),
+        "donnees_entree": ("phase_", "phases", "masse_", "balisage_", "bathy_", "conditions_", "agitation_"),
+        "donnees_navires": ("nav_", "navires", "rem_", "remorqueurs"),
+        "simulations": ("sim_", "simulations", "scen_", "scenarios", "evenement_", "analyse_scenario_"),
+        "analyse_synthese": ("analyse_",),
+        "conclusion": ("conclusion_",),
+        "annexes": ("annexes_", "table_file_", "tableaux"),
+    }
+    # Clés dérivées ou non réaffectables (data_editor) exclues des brouillons
+    DRAFT_EXCLUDED_KEYS = ("agitation_seuils", "bathy_grid_meta", "bathy_grid_signature")
+    
+    # Stockage des fichiers chargés
+    UPLOAD_QUOTA_NAMESPACE = 5 * 1024 ** 3   # quota par brouillon / session (octets)
+    UPLOAD_QUOTA_TOTAL = 50 * 1024 ** 3      # quota global ; au-delà, éviction LRU des fichiers non référencés
+    UPLOAD_SESSION_TTL = 24 * 3600           # une session sans brouillon garde ses fichiers ce délai (s)
+    
+    # Fichiers volumineux reçus hors du navigateur (ingest.py) : mémoire constante
+    DROP_DIR = "depot"                       # dossier de dépôt surveillé (partage réseau, copie locale)
+    INGEST_STABLE_SECONDS = 5                # un fichier déposé non modifié depuis ce délai est complet
+    INGEST_MAX_BYTES = UPLOAD_QUOTA_NAMESPACE  # taille max d'un fichier déposé ou envoyé par morceaux (tient dans un projet)
+    INGEST_CHUNK_MAX_BYTES = 64 * 1024 ** 2  # taille max d'un morceau d'envoi
+    INGEST_UPLOAD_TTL = 7 * 24 * 3600        # envois inachevés supprimés après ce délai (s)
+    
+    # Catalogue des navires et remorqueurs, commun à tous les projets
+    CATALOG_DB = os.path.join("catalogue", "catalogue.sqlite3")
+    CATALOG_NAMESPACE = "catalogue"          # espace de l'upload store des images du catalogue (jamais évincé)
+    
+    # Images
+    IMAGE_TYPES = ["png", "jpg", "jpeg", "tif", "tiff", "bmp", "gif"]
+    IMAGE_MAX_DECODE_PIXELS = 300_000_000    # au-delà, l'image est refusée (décodage trop coûteux)
+    IMAGE_MAX_PIXELS = 16_000_000            # au-delà, l'image est réduite avant d'être embarquée
+    IMAGE_PREVIEW_PIXELS = 1_000_000         # aperçus dans les formulaires
+    IMAGE_INDEX_DB = os.path.join(CACHE_DIR, "images", "index.sqlite3")
+    IMAGE_INDEX_WORKERS = 2                  # analyses d'images en arrière-plan
+    IMAGE_INDEX_WAIT = 0.5                   # attente max de l'analyse avant d'afficher le formulaire (s)
+    
+    # Génération des rapports (toutes sessions confondues)
+    RENDER_MAX_CONCURRENT = 2                # générations simultanées
+    RENDER_MEMORY_BUDGET = 2 * 1024 ** 3     # octets d'images décodées réservables simultanément
+    RENDER_METRICS_LOG = os.path.join(CACHE_DIR, "metriques", "generations.jsonl")
+    
+    # Cache partagé entre répliques (shared_cache.py) : dérivés d'images, miniatures, templates, rendus
+    SHARED_CACHE_BACKEND = "dossier"         # "dossier" (répertoire partagé) ou "sqlite" (base commune)
+    SHARED_CACHE_DIR = os.path.join(CACHE_DIR, "partage")         # backend dossier : partage réseau commun
+    SHARED_CACHE_DB = os.path.join(CACHE_DIR, "partage.sqlite3")  # backend sqlite : base commune
+    SHARED_CACHE_LOCAL_DIR = os.path.join(CACHE_DIR, "partage_local")  # backend sqlite : copies locales
+    SHARED_CACHE_MAX_BYTES = 20 * 1024 ** 3  # au-delà, éviction des entrées les moins récemment utilisées
+    SHARED_CACHE_MIN_AGE = 600               # une entrée utilisée depuis moins longtemps n'est pas évincée (s)
+    SHARED_CACHE_SQLITE_MAX_ENTRY = 64 * 1024 ** 2  # entrées plus grosses gardées dans les copies locales
+    SHARED_CACHE_METRICS_INTERVAL = 30       # écriture des compteurs de la réplique dans le tier partagé (s)
+    
+    # Profil mémoire de l'export (option de diagnostic, memory_profile.py)
+    PROFILE_DIR = os.path.join(CACHE_DIR, "profils")
+    PROFILE_TOP_ALLOCATIONS = 15             # plus grosses allocations gardées par étape
+    PROFILE_FRAMES = 1                       # profondeur des piles enregistrées par tracemalloc
+    PROFILE_RSS_INTERVAL = 0.005             # échantillonnage de la mémoire résidente pendant le profil (s)
+    
+    # Rendu parallèle des grandes boucles du template (simulations, scénarios)
+    RENDER_SHARD_LISTS = ("simulations.simulations", "simulations.scenarios_urgence.scenarios")
+    RENDER_SHARD_MIN_ITEMS = 40              # en dessous, rendu classique en un seul passage
+    RENDER_SHARD_SIZE = 25                   # éléments rendus par sous-document
+    RENDER_SHARD_WORKERS = min(4, os.cpu_count() or 1)
+    
+    # Éditions générées ensemble (export multi-éditions) : template et options de rendu
+    EXPORT_VARIANTS = {
+        "Client": {"template": "templates/report_template.docx", "commentaires_pilote": False},
+        "Interne": {"template": "templates/report_template.docx", "commentaires_pilote": True},
+    }
+    
+    # Service de rendu local (render_service.py)
+    SERVICE_HOST = "127.0.0.1"
+    SERVICE_PORT = 8765
+    SERVICE_WORKERS = 2                      # processus de rendu gardés chauds
+    SERVICE_QUEUE_MAX = 8                    # requêtes en attente au-delà des processus ; ensuite 503
+    SERVICE_TIMEOUT = 300                    # délai max d'un rendu, attente comprise (s)
+    SERVICE_TEMPLATES_DIR = "templates"
+    SERVICE_DEFAULT_TEMPLATE = "report_template.docx"
+    SERVICE_NAMESPACE = "service"            # espace de l'upload store pour les fichiers reçus
+    SERVICE_MAX_FILE_BYTES = 512 * 1024 ** 2
+    SERVICE_MAX_REPORT_BYTES = 64 * 1024 ** 2
+    
+    # Mode surveillance (watch_render.py)
+    WATCH_DEBOUNCE = 0.3                     # regroupement des modifications avant un nouveau rendu (s)
+    WATCH_POLL = 0.2                         # intervalle de scrutation des fichiers (s)
+    
+    # Version du schéma de rapport.json (import : migration des versions antérieures)
+    REPORT_SCHEMA_VERSION = 2
+    
+    # Aperçu JSON
+    JSON_PREVIEW_MAX_BYTES = 200_000  # taille max d'une page d'aperçu
+    
+    # Export DOCX
+    DOCX_COMPRESSLEVEL = 6            # niveau deflate des parties XML (1 = rapide, 9 = compact)
+    TEMPLATE_CACHE_SIZE = 16          # parties de template nettoyées / compilées gardées par processus
+    
+    # Bathymétrie
+    BATHY_MAX_CELLS = 50_000_000      # taille max de la grille (cellules)
+    BATHY_CHUNK_BYTES = 4 * 1024 * 1024   # taille des blocs lus dans les fichiers XYZ
+    BATHY_PREVIEW_PX = 1200           # résolution max de la carte des profondeurs
+    UKC_MARGE_PCT = 0.10              # pied de pilote requis (fraction du tirant d'eau)
+    
+    # Étude d'agitation
+    AGITATION_CHUNK_ROWS = 500_000    # lignes lues par bloc dans les séries Hs/Tp
+    AGITATION_SEUILS = {              # Hs max opérationnel (m) par classe de navire
+        "Porte-conteneurs": 0.5,
+        "Vraquier": 0.8,
+        "Pétrolier": 1.0,
+        "Ro-Ro / Ferry": 0.4,
+    }
+    
     @classmethod
     def setup_directories(cls):
         os.makedirs(cls.UPLOAD_DIR, exist_ok=True)
         os.makedirs(cls.OUTPUT_DIR, exist_ok=True)
+        os.makedirs(cls.CACHE_DIR, exist_ok=True)
+        os.makedirs(os.path.dirname(cls.DRAFTS_DB), exist_ok=True)
+        os.makedirs(os.path.dirname(cls.CATALOG_DB), exist_ok=True)
@@ -0,0 +1,244 @@
+# =============================================================================
+# docx_package.py - Post-processing of the generated DOCX package (media, size)
+# =============================================================================
+
+import hashlib
+import os
+import re
+import zipfile
+from io import BytesIO
+from typing import Dict, List, Optional, Tuple
+
+from docx.opc.pkgwriter import _ContentTypesItem
+from docxtpl import DocxTemplate
+
+from config import Config
+from utils import file_sha256
+
+MEDIA_PREFIX = "word/media/"
+CONTENT_TYPES = "[Content_Types].xml"
+
+# Médias déjà compressés : les re-deflater coûte du CPU pour un gain quasi nul
+STORED_EXTENSIONS = (".png", ".jpg", ".jpeg", ".jpe", ".gif", ".emz", ".wmz", ".wdp")
+
+# Paliers de réduction (échelle, qualité JPEG), du plus léger au plus agressif
+SHRINK_STEPS = [(1.0, 85), (0.75, 75), (0.5, 65), (0.35, 55), (0.25, 45)]
+
+
+def read_package(source) -> Dict[str, bytes]:
+    """Lit toutes les entrées d'un DOCX (chemin, bytes ou fichier) en conservant l'ordre"""
+    if isinstance(source, bytes):
+        source = BytesIO(source)
+    with zipfile.ZipFile(source) as z:
+        return {name: z.read(name) for name in z.namelist()}
+
+
+def _compress_type(name: str) -> int:
+    return zipfile.ZIP_STORED if name.lower().endswith(STORED_EXTENSIONS) else zipfile.ZIP_DEFLATED
+
+
+def write_package(entries: Dict[str, bytes], target, compresslevel: Optional[int] = None) -> None:
+    """
+    Écrit les entrées dans un nouveau DOCX : les médias déjà compressés sont stockés
+    tels quels, seules les parties XML sont deflatées (niveau réglable)
+    """
+    level = Config.DOCX_COMPRESSLEVEL if compresslevel is None else compresslevel
+    with zipfile.ZipFile(target, "w", zipfile.ZIP_DEFLATED, compresslevel=level) as z:
+        for name, data in entries.items():
+            z.writestr(name, data, compress_type=_compress_type(name))
+
+
+def document_entries(doc) -> Dict[str, bytes]:
+    """Sérialise les parties d'un document python-docx (ou DocxTemplate rendu) en entrées zip"""
+    package = getattr(doc, "docx", doc).part.package
+    splice = getattr(doc, "splice_part", None)  # ShardedDocxTemplate : lots rendus à part
+    parts = list(package.iter_parts())
+    for part in parts:
+        part.before_marshal()
+
+    entries = {
+        CONTENT_TYPES: _ContentTypesItem.from_parts(parts).blob,
+        "_rels/.rels": package.rels.xml,
+    }
+    for part in parts:
+        entries[part.partname.membername] = splice(part, part.blob) if splice else part.blob
+        if len(part.rels):
+            entries[part.partname.rels_uri.membername] = part.rels.xml
+    return entries
+
+
+def save_document(doc, target, compresslevel: Optional[int] = None) -> None:
+    """
+    Remplace doc.save() : même paquet, mais sans re-deflater les images PNG/JPEG.
+    Accepte un DocxTemplate (pré/post-traitements docxtpl conservés) ou un Document.
+    """
+    is_template = isinstance(doc, DocxTemplate)
+    if is_template:
+        doc.pre_processing()
+    write_package(document_entries(doc), target, compresslevel)
+    if is_template:
+        doc.post_processing(target)
+        doc.is_saved = True
+
+
+def package_bytes(entries: Dict[str, bytes], compresslevel: Optional[int] = None) -> bytes:
+    buffer = BytesIO()
+    write_package(entries, buffer, compresslevel)
+    return buffer.getvalue()
+
+
+def media_names(entries: Dict[str, bytes]) -> List[str]:
+    return [name for name in entries if name.startswith(MEDIA_PREFIX)]
+
+
+def _rename_media(entries: Dict[str, bytes], renames: Dict[str, str]) -> Dict[str, bytes]:
+    """Renomme des médias et met à jour les relations qui les ciblent"""
+    if not renames:
+        return entries
+    targets = {old[len("word/"):]: new[len("word/"):] for old, new in renames.items()}
+    pattern = re.compile(r'Target="(%s)"' % "|".join(re.escape(t) for t in targets))
+
+    result = {}
+    for name, data in entries.items():
+        if name in renames:
+            if renames[name] not in result:
+                result[renames[name]] = data
+            continue
+        if name.endswith(".rels"):
+            data = pattern.sub(lambda m: f'Target="{targets[m.group(1)]}"', data.decode("utf-8")).encode("utf-8")
+        elif name == CONTENT_TYPES:
+            # Les overrides des parties renommées ou supprimées n'ont plus lieu d'être
+            xml = data.decode("utf-8")
+            for old in renames:
+                xml = re.sub(r'<Override PartName="/%s"[^>]*/>' % re.escape(old), "", xml)
+            data = xml.encode("utf-8")
+        result[name] = data
+    return result
+
+
+def _ensure_default_content_type(entries: Dict[str, bytes], ext: str, content_type: str) -> None:
+    xml = entries[CONTENT_TYPES].decode("utf-8")
+    if re.search(r'<Default Extension="%s"' % re.escape(ext), xml, re.I):
+        return
+    default = f'<Default Extension="{ext}" ContentType="{content_type}"/>'
+    entries[CONTENT_TYPES] = xml.replace("</Types>", default + "</Types>").encode("utf-8")
+
+
+def dedupe_media(entries: Dict[str, bytes]) -> Tuple[Dict[str, bytes], int]:
+    """Fusionne les médias de contenu identique ; retourne (entrées, nb de doublons retirés)"""
+    seen: Dict[str, str] = {}
+    renames = {}
+    for name in media_names(entries):
+        digest = hashlib.sha256(entries[name]).hexdigest()
+        if digest in seen:
+            renames[name] = seen[digest]
+        else:
+            seen[digest] = name
+    return _rename_media(entries, renames), len(renames)
+
+
+def _shrink_image(data: bytes, scale: float, quality: int) -> Tuple[bytes, str]:
+    """Réduit une image ; retourne (données, extension). Les images opaques passent en JPEG."""
+    from PIL import Image
+
+    with Image.open(BytesIO(data)) as img:
+        has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+        # Taille cible tirée des dimensions d'origine : draft() réduit déjà img.size
+        size = (max(1, int(img.width * scale)), max(1, int(img.height * scale)))
+        if img.format == "JPEG" and scale < 1:
+            img.draft("RGB", size)
+        work = img.convert("RGBA" if has_alpha else "RGB")
+        if work.size != size:
+            work = work.resize(size, Image.LANCZOS)
+
+        out = BytesIO()
+        if has_alpha:
+            work.save(out, "PNG", optimize=True)
+            return out.getvalue(), "png"
+        work.save(out, "JPEG", quality=quality, optimize=True)
+        return out.getvalue(), "jpeg"
+
+
+def shrink_media(entries: Dict[str, bytes], scale: float, quality: int) -> Tuple[Dict[str, bytes], Dict[str, str]]:
+    """
+    Recompresse tous les médias (à partir des originaux) avec l'échelle et la qualité données.
+    Retourne les nouvelles entrées et la correspondance ancien nom -> nouveau nom.
+    """
+    entries = dict(entries)
+    renames = {}
+    for name in media_names(entries):
+        try:
+            data, ext = _shrink_image(entries[name], scale, quality)
+        except Exception:
+            continue  # média non image (emf, wmf...) ou illisible : laissé tel quel
+        if len(data) >= len(entries[name]):
+            continue
+        new_name = os.path.splitext(name)[0] + "." + ext
+        if new_name != name and new_name in entries:
+            new_name = os.path.splitext(name)[0] + "_r." + ext
+        entries[name] = data
+        if new_name != name:
+            renames[name] = new_name
+    entries = _rename_media(entries, renames)
+    if any(new.endswith(".jpeg") for new in renames.values()):
+        _ensure_default_content_type(entries, "jpeg", "image/jpeg")
+    return entries, renames
+
+
+def media_sections(entries: Dict[str, bytes], sources: Dict[str, set]) -> Dict[str, str]:
+    """
+    Associe chaque média du paquet à la section du rapport dont il provient,
+    en comparant son contenu aux fichiers images utilisés dans le contexte.
+    """
+    by_hash = {}
+    for path, sections in sources.items():
+        try:
+            by_hash[file_sha256(path)] = ", ".join(sorted(sections))
+        except OSError:
+            continue
+    return {
+        name: by_hash.get(hashlib.sha256(entries[name]).hexdigest(), "template")
+        for name in media_names(entries)
+    }
+
+
+def media_weight_by_section(entries: Dict[str, bytes], sections: Dict[str, str]) -> Dict[str, int]:
+    weights: Dict[str, int] = {}
+    for name in media_names(entries):
+        section = sections.get(name, "template")
+        weights[section] = weights.get(section, 0) + len(entries[name])
+    return dict(sorted(weights.items(), key=lambda item: -item[1]))
+
+
+def fit_to_budget(docx_data: bytes, max_bytes: int, sources: Optional[Dict[str, set]] = None) -> Tuple[bytes, dict]:
+    """
+    Ramène un DOCX déjà rendu sous une taille maximale en dédupliquant les médias puis en
+    réduisant progressivement la résolution et la qualité des images. Le texte du template
+    n'est pas re-rendu : seules les entrées word/media/ sont réécrites.
+    """
+    original, removed = dedupe_media(read_package(docx_data))
+    original_sections = media_sections(original, sources or {})
+
+    entries, data, sections = original, package_bytes(original), original_sections
+    applied = None
+    iterations = 0
+    for scale, quality in SHRINK_STEPS:
+        if len(data) <= max_bytes:
+            break
+        iterations += 1
+        entries, renames = shrink_media(original, scale, quality)
+        data = package_bytes(entries)
+        applied = {"echelle": scale, "qualite": quality}
+        sections = {renames.get(name, name): section for name, section in original_sections.items()}
+
+    report = {
+        "taille_initiale": len(docx_data),
+        "taille_finale": len(data),
+        "taille_max": max_bytes,
+        "budget_respecte": len(data) <= max_bytes,
+        "doublons_retires": removed,
+        "iterations": iterations,
+        "reduction": applied,
+        "poids_medias_par_section": media_weight_by_section(entries, sections),
+    }
+    return data, report
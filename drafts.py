@@ -0,0 +1,287 @@
+# =============================================================================
+# drafts.py - Autosave of report drafts in a local SQLite store
+# =============================================================================
+
+import datetime
+import hashlib
+import json
+import os
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+import streamlit as st
+from streamlit.runtime.uploaded_file_manager import UploadedFile
+
+from config import Config
+from upload_store import rename_namespace, touch, usage_report
+from utils import upload_namespace
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS brouillons (
+    id TEXT PRIMARY KEY,
+    titre TEXT,
+    cree_le REAL,
+    modifie_le REAL
+);
+CREATE TABLE IF NOT EXISTS sections (
+    brouillon_id TEXT,
+    section TEXT,
+    empreinte TEXT,
+    donnees TEXT,
+    modifie_le REAL,
+    PRIMARY KEY (brouillon_id, section)
+);
+"""
+
+
+class DraftStore:
+    """Brouillons de rapport : une ligne par section, réécrite seulement si elle change"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or Config.DRAFTS_DB
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    def list_drafts(self) -> List[dict]:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT id, titre, modifie_le FROM brouillons ORDER BY modifie_le DESC").fetchall()
+        return [{"id": row[0], "titre": row[1], "modifie_le": row[2]} for row in rows]
+
+    def exists(self, draft_id: str) -> bool:
+        with self._connect() as conn:
+            return conn.execute("SELECT 1 FROM brouillons WHERE id = ?", (draft_id,)).fetchone() is not None
+
+    def create(self, titre: str) -> str:
+        draft_id = uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute("INSERT INTO brouillons VALUES (?, ?, ?, ?)", (draft_id, titre, now, now))
+        return draft_id
+
+    def load_section(self, draft_id: str, section: str) -> Optional[Tuple[str, dict]]:
+        """(empreinte, valeurs) d'une section, ou None si elle n'a jamais été enregistrée"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT empreinte, donnees FROM sections WHERE brouillon_id = ? AND section = ?",
+                (draft_id, section)
+            ).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def save_sections(self, draft_id: str, titre: str, changed: Dict[str, Tuple[str, str]]) -> None:
+        """Écrit, en une transaction, les sections modifiées : {section: (empreinte, json)}"""
+        now = time.time()
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO sections VALUES (?, ?, ?, ?, ?)",
+                [(draft_id, section, digest, data, now) for section, (digest, data) in changed.items()]
+            )
+            conn.execute("UPDATE brouillons SET titre = ?, modifie_le = ? WHERE id = ?", (titre, now, draft_id))
+
+    def delete(self, draft_id: str) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM sections WHERE brouillon_id = ?", (draft_id,))
+            conn.execute("DELETE FROM brouillons WHERE id = ?", (draft_id,))
+
+
+def _prefix_section(key: str) -> Optional[str]:
+    """Section dont un préfixe correspond à la clé (le plus long l'emporte)"""
+    best, best_len = None, 0
+    for section, prefixes in Config.DRAFT_SECTIONS.items():
+        for prefix in prefixes:
+            if key.startswith(prefix) and len(prefix) > best_len:
+                best, best_len = section, len(prefix)
+    return best
+
+
+def section_of(key: str) -> Optional[str]:
+    """Section du rapport d'une clé de session, ou None si elle n'est pas enregistrée"""
+    if key.startswith("_") or key in Config.DRAFT_EXCLUDED_KEYS:
+        return None
+    return _prefix_section(key)
+
+
+def _persistable(value) -> bool:
+    # Les uploaders ne peuvent pas être réaffectés : seuls leurs chemins "<clé>_path" sont gardés
+    if value is None or value == []:
+        return False
+    if isinstance(value, UploadedFile):
+        return False
+    if isinstance(value, list) and any(isinstance(v, UploadedFile) for v in value):
+        return False
+    return True
+
+
+def _encode(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return {"__date__": value.isoformat()}
+    if isinstance(value, list):
+        return [_encode(v) for v in value]
+    if isinstance(value, dict):
+        return {k: _encode(v) for k, v in value.items()}
+    return value
+
+
+def _decode(value):
+    if isinstance(value, dict):
+        if "__date__" in value:
+            return datetime.date.fromisoformat(value["__date__"][:10])
+        return {k: _decode(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_decode(v) for v in value]
+    return value
+
+
+def snapshot_sections() -> Dict[str, dict]:
+    """Valeurs des widgets et listes de la session, regroupées par section"""
+    snapshot = {section: {} for section in Config.DRAFT_SECTIONS}
+    for key, value in st.session_state.items():
+        section = section_of(key)
+        if section and _persistable(value):
+            snapshot[section][key] = _encode(value)
+    return snapshot
+
+
+def clear_report_state() -> None:
+    for key in list(st.session_state.keys()):
+        if _prefix_section(key) or key in ("_uploads_seen", "_draft_hashes", "_draft_pending"):
+            del st.session_state[key]
+
+
+def open_draft(draft_id: str) -> None:
+    """Ouvre un brouillon : les sections seront restaurées à leur premier affichage"""
+    clear_report_state()
+    st.session_state.draft_id = draft_id
+    st.session_state._draft_pending = set(Config.DRAFT_SECTIONS)
+    st.session_state._draft_hashes = {}
+    st.query_params["brouillon"] = draft_id
+
+
+def new_draft() -> None:
+    clear_report_state()
+    st.session_state.draft_id = None
+    st.query_params.pop("brouillon", None)
+
+
+def init_drafts() -> None:
+    """Au démarrage d'une session, reprend le brouillon indiqué dans l'URL (rafraîchissement)"""
+    if "draft_id" in st.session_state:
+        return
+    draft_id = st.query_params.get("brouillon")
+    if draft_id and DraftStore().exists(draft_id):
+        open_draft(draft_id)
+    else:
+        st.session_state.draft_id = None
+
+
+def restore_section(section: str) -> None:
+    """Restaure une section du brouillon ouvert, juste avant le rendu de ses widgets"""
+    pending = st.session_state.get("_draft_pending")
+    if not pending or section not in pending:
+        return
+    pending.discard(section)
+    loaded = DraftStore().load_section(st.session_state.draft_id, section)
+    if loaded is None:
+        return
+    digest, values = loaded
+    used = []
+    for key, value in values.items():
+        value = _decode(value)
+        if key.endswith("_path"):
+            # Fichiers de l'upload store supprimés entre-temps : ignorés
+            value = [f for f in value if os.path.exists(f["chemin"])]
+            if not value:
+                continue
+            used.extend(f["chemin"] for f in value)
+        st.session_state[key] = value
+    touch(used, st.session_state.draft_id)
+    st.session_state._draft_hashes[section] = digest
+
+
+def autosave(titre: str) -> Optional[List[str]]:
+    """
+    Enregistre les sections modifiées depuis la dernière sauvegarde (comparaison
+    d'empreintes). Le brouillon n'est créé qu'une fois le titre ou le projet saisi.
+    Retourne la liste des sections écrites, ou None sans brouillon (modifications non suivies).
+    """
+    state = st.session_state
+    store = DraftStore()
+    if not state.get("draft_id"):
+        if not titre:
+            return None
+        session_namespace = upload_namespace()
+        state.draft_id = store.create(titre)
+        rename_namespace(session_namespace, state.draft_id)
+        state._draft_hashes = {}
+        st.query_params["brouillon"] = state.draft_id
+
+    saved = state.setdefault("_draft_hashes", {})
+    pending = state.get("_draft_pending") or set()
+    changed = {}
+    for section, values in snapshot_sections().items():
+        if section in pending:
+            continue  # pas encore restaurée : ne pas écraser le brouillon
+        data = json.dumps(values, sort_keys=True, ensure_ascii=False)
+        digest = hashlib.sha1(data.encode("utf-8")).hexdigest()
+        if saved.get(section) != digest:
+            changed[section] = (digest, data)
+
+    if changed:
+        store.save_sections(state.draft_id, titre, changed)
+        saved.update({section: digest for section, (digest, _) in changed.items()})
+        state._draft_saved_at = time.time()
+    return list(changed)
+
+
+def render_drafts_sidebar() -> None:
+    """Barre latérale : brouillon actif, reprise d'un brouillon, nouveau rapport"""
+    with st.sidebar:
+        st.subheader("💾 Brouillons", divider=True)
+        drafts = DraftStore().list_drafts()
+        labels = {
+            d["id"]: f"{d['titre'] or 'Sans titre'} — {time.strftime('%d/%m/%Y %H:%M', time.localtime(d['modifie_le']))}"
+            for d in drafts
+        }
+
+        current = st.session_state.get("draft_id")
+        if current in labels:
+            st.caption(f"Brouillon actif : {labels[current]}")
+            saved_at = st.session_state.get("_draft_saved_at")
+            if saved_at:
+                st.caption(f"Enregistré automatiquement à {time.strftime('%H:%M:%S', time.localtime(saved_at))}")
+        else:
+            st.caption("Le brouillon est enregistré automatiquement dès la saisie du titre.")
+
+        if drafts:
+            choice = st.selectbox("Reprendre un brouillon", list(labels), format_func=labels.get, key="_draft_choice")
+            st.button("📂 Ouvrir", on_click=open_draft, args=(choice,))
+        st.button("🆕 Nouveau rapport", on_click=new_draft)
+        
+        with st.expander("🗄️ Espace disque"):
+            usage = usage_report()
+            st.caption(
+                f"{usage['nb_fichiers']} fichier(s), {usage['taille_totale'] / 1e6:.1f} Mo "
+                f"sur {usage['quota_total'] / 1e9:.0f} Go"
+            )
+            st.dataframe([
+                {
+                    "Projet": labels.get(e["espace"], "Session sans brouillon" if e["espace"].startswith("session-") else "Brouillon supprimé"),
+                    "Fichiers": e["nb_fichiers"],
+                    "Taille (Mo)": round(e["taille"] / 1e6, 1),
+                    "Quota (%)": round(100 * e["taille"] / usage["quota_espace"], 1),
+                }
+                for e in usage["espaces"]
+            ], use_container_width=True, hide_index=True)
@@ -0,0 +1,212 @@
+# =============================================================================
+# fleet_catalog.py - Local catalogue of ships and tugs reused across projects
+# =============================================================================
+
+import json
+import os
+import sqlite3
+import time
+import unicodedata
+from contextlib import contextmanager
+from typing import List, Optional
+
+import streamlit as st
+
+from config import Config
+from upload_store import UploadQuotaError, store_file
+from utils import upload_namespace
+
+CATEGORIES = ("navire", "remorqueur")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS unites (
+    categorie TEXT,
+    nom_cle TEXT,
+    nom TEXT,
+    type_cle TEXT,
+    type TEXT,
+    longueur REAL,
+    largeur REAL,
+    tirant_eau REAL,
+    traction REAL,
+    figure TEXT,
+    donnees TEXT,
+    modifie_le REAL,
+    PRIMARY KEY (categorie, nom_cle)
+);
+CREATE INDEX IF NOT EXISTS unites_type ON unites (categorie, type_cle, longueur);
+CREATE INDEX IF NOT EXISTS unites_longueur ON unites (categorie, longueur);
+"""
+
+# Champs du formulaire -> clés de session (suffixe _{i}), comme à l'import d'un rapport.json
+SHIP_TEXT_FIELDS = (("nom", "nom"), ("type", "type"), ("propulsion", "propulsion"),
+                    ("puissance", "puissance_machine"), ("remarque", "remarques"))
+SHIP_NUMBER_FIELDS = (("longueur", "longueur"), ("largeur", "largeur"), ("tir_av", "tirant_eau_av"),
+                      ("tir_ar", "tirant_eau_ar"), ("deplacement", "deplacement"))
+TUG_TEXT_FIELDS = (("nom", "nom"), ("type", "type"), ("remarque", "remarques"))
+TUG_NUMBER_FIELDS = (("longueur", "longueur"), ("lbp", "lbp"), ("largeur", "largeur"), ("tirant", "tirant_eau"),
+                     ("vitesse", "vitesse"), ("traction", "traction"))
+
+
+def normalize(text) -> str:
+    """Clé de recherche : minuscules, sans accents ni espaces superflus"""
+    text = unicodedata.normalize("NFKD", str(text or ""))
+    return " ".join("".join(c for c in text if not unicodedata.combining(c)).lower().split())
+
+
+def _number(value) -> float:
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class FleetCatalog:
+    """Navires et remorqueurs enregistrés une fois, recherchés par nom, type et dimensions"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or Config.CATALOG_DB
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    def save(self, categorie: str, unite: dict) -> None:
+        """
+        Enregistre (ou remplace, même nom) une unité ; son image rejoint l'upload store
+        sous l'espace du catalogue : un même contenu n'est stocké qu'une fois
+        """
+        if categorie not in CATEGORIES:
+            raise ValueError(f"Catégorie inconnue : {categorie}")
+        if not normalize(unite.get("nom")):
+            raise ValueError("Nom de l'unité manquant")
+        figure = unite.get("figure") or ""
+        if figure and os.path.isfile(figure):
+            figure = store_file(figure, Config.CATALOG_NAMESPACE)
+        unite = {**unite, "figure": figure}
+        tirant = unite.get("tirant_eau", max(_number(unite.get("tirant_eau_av")), _number(unite.get("tirant_eau_ar"))))
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO unites VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (categorie, normalize(unite["nom"]), unite["nom"], normalize(unite.get("type")), unite.get("type") or "",
+                 _number(unite.get("longueur")), _number(unite.get("largeur")), _number(tirant),
+                 _number(unite.get("traction")), figure, json.dumps(unite, ensure_ascii=False), time.time())
+            )
+
+    def delete(self, categorie: str, nom: str) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM unites WHERE categorie = ? AND nom_cle = ?", (categorie, normalize(nom)))
+
+    def types(self, categorie: str) -> List[str]:
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT MIN(type) FROM unites WHERE categorie = ? AND type_cle != '' GROUP BY type_cle ORDER BY type_cle",
+                (categorie,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def search(self, categorie: str, nom: str = "", type_: str = "", longueur_min: float = 0,
+               longueur_max: float = 0, limit: int = 200) -> List[dict]:
+        """Unités dont le nom commence par `nom`, filtrées par type et longueur"""
+        clauses, params = ["categorie = ?"], [categorie]
+        key = normalize(nom)
+        if key:
+            # Préfixe : plage sur la clé primaire (indexée, sans caractères spéciaux à échapper)
+            clauses.append("nom_cle >= ? AND nom_cle < ?")
+            params += [key, key + "\uffff"]
+        if type_:
+            clauses.append("type_cle = ?")
+            params.append(normalize(type_))
+        if longueur_min:
+            clauses.append("longueur >= ?")
+            params.append(longueur_min)
+        if longueur_max:
+            clauses.append("longueur <= ?")
+            params.append(longueur_max)
+        with self._connect() as conn:
+            rows = conn.execute(
+                f"SELECT donnees FROM unites WHERE {' AND '.join(clauses)} ORDER BY nom_cle LIMIT ?",
+                params + [limit]
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+
+def unit_state(categorie: str, index: int, unite: dict) -> dict:
+    """Clés de session pré-remplissant le formulaire n° index avec une unité du catalogue"""
+    prefix = "nav" if categorie == "navire" else "rem"
+    text_fields, number_fields = ((SHIP_TEXT_FIELDS, SHIP_NUMBER_FIELDS) if categorie == "navire"
+                                  else (TUG_TEXT_FIELDS, TUG_NUMBER_FIELDS))
+    state = {}
+    for key, field in text_fields:
+        state[f"{prefix}_{key}_{index}"] = str(unite.get(field) or "")
+    for key, field in number_fields:
+        state[f"{prefix}_{key}_{index}"] = _number(unite.get(field))
+    if categorie == "navire":
+        if unite.get("etat_de_charge"):
+            state[f"nav_etat_{index}"] = unite["etat_de_charge"]
+        state[f"nav_role_{index}"] = "actif" if unite.get("est_actif", True) else "passif"
+    figure = unite.get("figure")
+    if figure and os.path.isfile(figure):
+        try:
+            # Référence le fichier du catalogue pour le projet, sans le copier
+            path = store_file(figure, upload_namespace())
+            state[f"{prefix}_img_{index}_path"] = [{"nom": os.path.basename(path), "chemin": path}]
+        except UploadQuotaError as e:
+            st.warning(f"⚠️ Image de {unite.get('nom')} non reprise : {e}")
+    return state
+
+
+def _label(categorie: str, unite: dict) -> str:
+    dims = f"{_number(unite.get('longueur')):g} × {_number(unite.get('largeur')):g} m"
+    extra = f", {_number(unite.get('traction')):g} t" if categorie == "remorqueur" else ""
+    return f"{unite.get('nom')} — {unite.get('type') or 'type non précisé'}, {dims}{extra}"
+
+
+def render_catalog_picker(categorie: str, list_key: str) -> None:
+    """
+    Recherche dans le catalogue et ajout des unités choisies au formulaire
+    (list_key : liste de session des navires ou des remorqueurs)
+    """
+    catalog = FleetCatalog()
+    prefix = f"cat_{categorie}"
+    with st.expander(f"📚 Ajouter depuis le catalogue ({categorie}s)"):
+        col1, col2, col3, col4 = st.columns([3, 2, 1, 1])
+        nom = col1.text_input("Nom", key=f"{prefix}_nom", placeholder="Début du nom")
+        type_ = col2.selectbox("Type", [""] + catalog.types(categorie), key=f"{prefix}_type",
+                               format_func=lambda t: t or "Tous")
+        longueur_min = col3.number_input("L min (m)", min_value=0.0, step=10.0, key=f"{prefix}_lmin")
+        longueur_max = col4.number_input("L max (m)", min_value=0.0, step=10.0, key=f"{prefix}_lmax")
+
+        results = catalog.search(categorie, nom, type_, longueur_min, longueur_max)
+        by_label = {_label(categorie, unite): unite for unite in results}
+        choix = st.multiselect(f"{len(results)} unité(s) trouvée(s)", list(by_label), key=f"{prefix}_choix")
+        st.button(f"➕ Ajouter {len(choix)} unité(s)", key=f"{prefix}_ajouter", disabled=not choix,
+                  on_click=_add_units, args=(categorie, list_key, [by_label[label] for label in choix]))
+
+
+def _add_units(categorie: str, list_key: str, unites: List[dict]) -> None:
+    """(callback) Ajoute les unités avant le rendu des formulaires, dont les champs sont pré-remplis"""
+    units = st.session_state.setdefault(list_key, [])
+    for unite in unites:
+        st.session_state.update(unit_state(categorie, len(units), unite))
+        units.append({})
+    st.session_state[f"cat_{categorie}_choix"] = []
+
+
+def render_save_button(categorie: str, unite: dict, key: str) -> None:
+    """Bouton d'enregistrement d'une unité saisie dans le catalogue partagé entre projets"""
+    if st.button("💾 Enregistrer au catalogue", key=key, disabled=not normalize(unite.get("nom"))):
+        try:
+            FleetCatalog().save(categorie, unite)
+            st.toast(f"✅ {unite['nom']} enregistré au catalogue")
+        except (ValueError, UploadQuotaError) as e:
+            st.error(f"⚠️ {e}")
@@ -3,43 +3,55 @@
 # =============================================================================
 
 import streamlit as st
+import pandas as pd
 from typing import Dict, Any
 from utils import *
+from bathymetry import BATHY_FILE_TYPES, load_bathymetry_grid, render_depth_map
+from agitation import SERIES_FILE_TYPES, compute_agitation_statistics
+from fleet_catalog import render_catalog_picker, render_save_button
+from ingest import render_ingest_picker
+
+ETATS_CHARGE = ["chargé", "sur lest"]
+EVENEMENTS_URGENCE = [
+    "Panne moteur", "Perte gouvernail", "Défaillance remorqueur",
+    "Conditions extrêmes", "Manœuvre d'urgence", "Arrêt d'urgence"
+]
 
 class MetadataForm:
     @staticmethod
     def render() -> Dict[str, Any]:
         st.subheader("📁 Métadonnées du rapport", divider=True)
         
-        titre = st.text_input("Titre du rapport *")
-        projet = st.text_input("Nom du projet *")
-        code_projet = st.text_input("Code projet *")
+        titre = st.text_input("Titre du rapport *", key="meta_titre")
+        projet = st.text_input("Nom du projet *", key="meta_projet")
+        code_projet = st.text_input("Code projet *", key="meta_code_projet")
         type_etude = st.selectbox(
             "Type d'étude",
             ("initiale", "complémentaire", "provisoire"),
             accept_new_options=True,
-            placeholder="Veuillez sélectionner le type d'étude"
+            placeholder="Veuillez sélectionner le type d'étude",
+            key="meta_type_etude"
         )
         
         # Main image
-        main_image = st.file_uploader("Image principale", type=["png", "jpg", "jpeg"])
-        image_path = save_uploaded_file(main_image) if main_image else ""
+        main_image = st.file_uploader("Image principale", type=Config.IMAGE_TYPES, key="meta_image")
+        image_path = uploaded_file_path("meta_image", main_image)
         if image_path:
-            st.image(image_path, width=200)
+            show_image(image_path, width=200)
         
         st.subheader("Informations du client", divider=True)
-        client = st.text_input("Client *")
+        client = st.text_input("Client *", key="meta_client")
         
         # Logo
-        logo = st.file_uploader("Logo du client", type=["png", "jpg", "jpeg"])
-        logo_path = save_uploaded_file(logo) if logo else ""
+        logo = st.file_uploader("Logo du client", type=Config.IMAGE_TYPES, key="meta_logo")
+        logo_path = uploaded_file_path("meta_logo", logo)
         if logo_path:
-            st.image(logo_path, width=200)
+            show_image(logo_path, width=200)
         
         st.subheader("Informations du document", divider=True)
-        type_doc = st.text_input("Type de document *")
-        numero_doc = st.text_input("Numéro de document *")
-        annee_doc = st.text_input("Année *")
+        type_doc = st.text_input("Type de document *", key="meta_type_doc")
+        numero_doc = st.text_input("Numéro de document *", key="meta_numero_doc")
+        annee_doc = st.text_input("Année *", key="meta_annee_doc")
         
         # Revisions
         st.subheader("Révisions", divider=True)
@@ -96,8 +108,8 @@ class IntroductionForm:
     def render() -> Dict[str, str]:
         st.subheader("✍️ Introduction", divider=True)
         
-        guidelines = st.text_area("Éléments à inclure dans l'introduction *")
-        objectifs = st.text_area("Objectifs de l'étude *")
+        guidelines = st.text_area("Éléments à inclure dans l'introduction *", key="intro_guidelines")
+        objectifs = st.text_area("Objectifs de l'étude *", key="intro_objectifs")
         
         return {
             "guidelines": guidelines,
@@ -152,7 +164,7 @@ class DataInputForm:
             with st.expander(f"Phase {i+1}"):
                 nom = st.text_input(f"Nom phase {i+1} *", key=f"phase_nom_{i}")
                 description = st.text_area(f"Description", key=f"phase_desc_{i}")
-                figures = handle_file_upload_with_legend("Figures", ["png", "jpg"], f"phase_fig_{i}")
+                figures = handle_file_upload_with_legend("Figures", Config.IMAGE_TYPES, f"phase_fig_{i}")
                 
                 phases.append({
                     "nom": nom,
@@ -161,8 +173,8 @@ class DataInputForm:
                 })
 
         commentaire = ""
-        if st.checkbox("➕ Ajouter un commentaire sur le plan de masse"):
-            commentaire = st.text_area("Commentaire plan de masse")
+        if st.checkbox("➕ Ajouter un commentaire sur le plan de masse", key="masse_commentaire_actif"):
+            commentaire = st.text_area("Commentaire plan de masse", key="masse_commentaire")
         
         return {
             "phases": phases,
@@ -171,11 +183,11 @@ class DataInputForm:
     
     @staticmethod
     def _render_balisage():
-        figures = handle_file_upload_with_legend("Planches de balisage", ["png", "jpg"], "balisage_fig")
+        figures = handle_file_upload_with_legend("Planches de balisage", Config.IMAGE_TYPES, "balisage_fig")
         
         commentaire = ""
-        if st.checkbox("➕ Ajouter un commentaire sur les plans de balisage"):
-            commentaire = st.text_area("Commentaire sur les planches de balisage")
+        if st.checkbox("➕ Ajouter un commentaire sur les plans de balisage", key="balisage_commentaire_actif"):
+            commentaire = st.text_area("Commentaire sur les planches de balisage", key="balisage_commentaire")
 
         return {
             "actif": True,
@@ -185,33 +197,95 @@ class DataInputForm:
     
     @staticmethod
     def _render_bathymetry():
-        source = st.text_input("Source bathymétrie *")
-        date = st.text_input("Date *")
-        notes = st.text_area("Notes profondeur *")
-        figures = handle_file_upload_with_legend("Figures bathymétrie", ["png", "jpg"], "bathy_fig")
+        source = st.text_input("Source bathymétrie *", key="bathy_source")
+        date = st.text_input("Date *", key="bathy_date")
+        notes = st.text_area("Notes profondeur *", key="bathy_notes")
+        figures = handle_file_upload_with_legend("Figures bathymétrie", Config.IMAGE_TYPES, "bathy_fig")
+        
+        grille = DataInputForm._render_bathymetry_grid()
+        if grille.get("carte"):
+            figures.append({"chemin": grille["carte"], "legende": f"Carte des profondeurs - {grille['source']}"})
         
         commentaire = ""
-        if st.checkbox("➕ Ajouter un commentaire sur la bathymétrie"):
-            commentaire = st.text_area("Commentaire bathymétrie")
+        if st.checkbox("➕ Ajouter un commentaire sur la bathymétrie", key="bathy_commentaire_actif"):
+            commentaire = st.text_area("Commentaire bathymétrie", key="bathy_commentaire")
         
         return {
             "source": source,
             "date": date,
             "notes_profondeur": notes,
             "figures": figures,
+            "grille": grille,
             "commentaire": commentaire
         }
     
+    @staticmethod
+    def _render_bathymetry_grid():
+        grid_file = st.file_uploader(
+            "Fichier de sondes ou grille (.xyz, .csv, .txt, .asc, .npy)",
+            type=BATHY_FILE_TYPES,
+            key="bathy_grid"
+        )
+        render_ingest_picker("bathy_grid", BATHY_FILE_TYPES)
+        path = uploaded_file_path("bathy_grid", grid_file)
+        if not path:
+            return {}
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            pas = st.number_input("Pas de grille (m, 0 = automatique)", min_value=0.0, step=1.0, key="bathy_pas")
+        with col2:
+            negatives = st.checkbox("Valeurs négatives sous le zéro (altitudes)", key="bathy_negatives")
+        
+        # Ne re-mailler que si le fichier ou les paramètres changent
+        signature = (path, pas, negatives)
+        if st.session_state.get("bathy_grid_signature") != signature:
+            try:
+                with st.spinner("Maillage de la bathymétrie..."):
+                    meta = load_bathymetry_grid(path, cell_size=pas or None, negative_depths=negatives)
+                    meta["carte"] = render_depth_map(meta)
+            except Exception as e:
+                st.error(f"⚠️ Fichier bathymétrique illisible : {e}")
+                return {}
+            st.session_state.bathy_grid_meta = meta
+            st.session_state.bathy_grid_signature = signature
+        
+        meta = st.session_state.bathy_grid_meta
+        st.caption(f"Grille {meta['lignes']} × {meta['colonnes']} (pas {meta['pas']:.2f} m)")
+        if meta["profondeur_min"] is not None:
+            st.caption(f"Profondeur {meta['profondeur_min']:.2f} à {meta['profondeur_max']:.2f} m")
+        st.image(meta["carte"], caption="Carte des profondeurs", width=400)
+        
+        # Conformité du pied de pilote jugée sur le chenal / la zone d'évolution seulement
+        zone = None
+        if st.checkbox("🎯 Restreindre le pied de pilote à une zone d'intérêt (chenal, zone d'évolution)",
+                       key="bathy_zone_actif"):
+            x_max = meta["x_min"] + meta["colonnes"] * meta["pas"]
+            y_min = meta["y_max"] - meta["lignes"] * meta["pas"]
+            col1, col2, col3, col4 = st.columns(4)
+            with col1:
+                zx_min = st.number_input("X min (m)", value=float(meta["x_min"]), key="bathy_zone_x_min")
+            with col2:
+                zx_max = st.number_input("X max (m)", value=float(x_max), key="bathy_zone_x_max")
+            with col3:
+                zy_min = st.number_input("Y min (m)", value=float(y_min), key="bathy_zone_y_min")
+            with col4:
+                zy_max = st.number_input("Y max (m)", value=float(meta["y_max"]), key="bathy_zone_y_max")
+            zone = {"x_min": zx_min, "x_max": zx_max, "y_min": zy_min, "y_max": zy_max}
+        else:
+            st.caption("Sans zone d'intérêt, seul le pourcentage de mailles insuffisantes est indiqué.")
+        return dict(meta, zone=zone)
+    
     @staticmethod
     def _render_conditions():
         # Simplified conditions
-        vent = st.text_input("Conditions de vent")
-        houle = st.text_input("Conditions de houle")
-        maree = st.text_input("Marée")
+        vent = st.text_input("Conditions de vent", key="conditions_vent")
+        houle = st.text_input("Conditions de houle", key="conditions_houle")
+        maree = st.text_input("Marée", key="conditions_maree")
 
         commentaire = ""
-        if st.checkbox("➕ Ajouter un commentaire sur les conditions environnementales"):
-            commentaire = st.text_area("Commentaire sur les conditions environnementales")
+        if st.checkbox("➕ Ajouter un commentaire sur les conditions environnementales", key="conditions_commentaire_actif"):
+            commentaire = st.text_area("Commentaire sur les conditions environnementales", key="conditions_commentaire")
         
         return {
             "vent": [vent] if vent else [],
@@ -222,10 +296,10 @@ class DataInputForm:
     
     @staticmethod
     def _render_agitation():
-        if not st.checkbox("Inclure étude d'agitation"):
+        if not st.checkbox("Inclure étude d'agitation", key="agitation_actif"):
             return {"actif": False}
         
-        figures = handle_file_upload_with_legend("Planches d'agitation", ["png", "jpg"], "agitation_fig")
+        figures = handle_file_upload_with_legend("Planches d'agitation", Config.IMAGE_TYPES, "agitation_fig")
         
         tableaux = []
         table_files = st.file_uploader(
@@ -234,35 +308,76 @@ class DataInputForm:
             accept_multiple_files=True,
             key="agitation_tables"
         )
-        for file in table_files:
-            path = os.path.join("uploads", file.name)
-            with open(path, "wb") as f:
-                f.write(file.getbuffer())
-            tableaux.append(path)
+        for file in uploaded_files("agitation_tables", table_files):
+            tableaux.append(file["chemin"])
+        
+        statistiques = DataInputForm._render_agitation_series()
+        figures.extend(statistiques.get("figures", []))
                 
         commentaire = ""
-        if st.checkbox("➕ Ajouter un commentaire sur l'étude d'agitation"):
-            commentaire = st.text_area("Commentaire sur les planches d’agitation")
+        if st.checkbox("➕ Ajouter un commentaire sur l'étude d'agitation", key="agitation_commentaire_actif"):
+            commentaire = st.text_area("Commentaire sur les planches d’agitation", key="agitation_commentaire")
 
         return {
             "actif": True,
             "figures": figures,
             "tableaux": tableaux,
+            "statistiques": statistiques,
             "commentaire": commentaire
         }
+    
+    @staticmethod
+    def _render_agitation_series():
+        series_files = st.file_uploader(
+            "Séries temporelles Hs/Tp par poste (.csv)",
+            type=SERIES_FILE_TYPES,
+            accept_multiple_files=True,
+            key="agitation_series"
+        )
+        render_ingest_picker("agitation_series", SERIES_FILE_TYPES, multiple=True)
+        series_paths = [file["chemin"] for file in uploaded_files("agitation_series", series_files)]
+        if not series_paths:
+            return {}
+        
+        st.caption("Seuils opérationnels par classe de navire")
+        seuils_table = st.data_editor(
+            pd.DataFrame({"classe": list(Config.AGITATION_SEUILS), "hs_max": list(Config.AGITATION_SEUILS.values())}),
+            num_rows="dynamic",
+            key="agitation_seuils"
+        )
+        seuils = {
+            row["classe"]: float(row["hs_max"])
+            for row in seuils_table.dropna().to_dict("records") if row["classe"]
+        }
+        if not seuils:
+            return {}
+        
+        try:
+            with st.spinner("Calcul des statistiques d'agitation..."):
+                statistiques = compute_agitation_statistics(series_paths, seuils)
+        except Exception as e:
+            st.error(f"⚠️ Séries d'agitation illisibles : {e}")
+            return {}
+        
+        st.dataframe(statistiques["indisponibilite_par_classe"], use_container_width=True)
+        with st.expander("Indisponibilité par poste"):
+            st.dataframe(statistiques["indisponibilite"], use_container_width=True)
+        for fig in statistiques["figures"]:
+            st.image(fig["chemin"], caption=fig["legende"], width=400)
+        return statistiques
 
 class ShipsForm:
     @staticmethod
     def render() -> Dict[str, Any]:        
         navires = ShipsForm._render_ships()
         commentaire_navires = ""
-        if st.checkbox("➕ Ajouter un commentaire sur les navires"):
-            commentaire_navires = st.text_area("Commentaire navires")
+        if st.checkbox("➕ Ajouter un commentaire sur les navires", key="nav_commentaire_actif"):
+            commentaire_navires = st.text_area("Commentaire navires", key="nav_commentaire")
         
         remorqueurs = ShipsForm._render_tugboats()
         commentaire_remorqueurs = ""
-        if st.checkbox("➕ Ajouter un commentaire sur les remorqueurs"):
-            commentaire_remorqueurs = st.text_area("Commentaire remorqueurs")
+        if st.checkbox("➕ Ajouter un commentaire sur les remorqueurs", key="rem_commentaire_actif"):
+            commentaire_remorqueurs = st.text_area("Commentaire remorqueurs", key="rem_commentaire")
         
         return {
             "navires": {
@@ -283,6 +398,7 @@ class ShipsForm:
         
         if st.button("➕ Ajouter un navire"):
             st.session_state.navires.append({})
+        render_catalog_picker("navire", "navires")
         
         navires = []
         for i in range(len(st.session_state.navires)):
@@ -292,7 +408,7 @@ class ShipsForm:
                 with col1:
                     nom = st.text_input("Nom du navire", key=f"nav_nom_{i}")
                     type_nav = st.text_input("Type", key=f"nav_type_{i}")
-                    etat_charge = st.selectbox("État de charge", ["chargé", "sur lest"], key=f"nav_etat_{i}")
+                    etat_charge = st.selectbox("État de charge", ETATS_CHARGE, key=f"nav_etat_{i}")
                     longueur = st.number_input("Longueur (m)", key=f"nav_longueur_{i}", step=0.5)
                     largeur = st.number_input("Largeur (m)", key=f"nav_largeur_{i}", step=0.5)
                     tirant_av = st.number_input("Tirant d’eau avant (m)", key=f"nav_tir_av_{i}", step=0.5)
@@ -305,13 +421,10 @@ class ShipsForm:
                     est_actif = st.selectbox("Ce navire est-il :", ["actif", "passif"], key=f"nav_role_{i}")
                     remarque = st.text_area("Remarques", key=f"nav_remarque_{i}")
 
-                    image = st.file_uploader("Image (facultative)", type=["png", "jpg"], key=f"nav_img_{i}")
-                    img_path = ""
-                    if image:
-                        img_path = os.path.join("uploads", image.name)
-                        with open(img_path, "wb") as f:
-                            f.write(image.getbuffer())
-                        st.image(img_path, caption="Profil navire", width=200)
+                    image = st.file_uploader("Image (facultative)", type=Config.IMAGE_TYPES, key=f"nav_img_{i}")
+                    img_path = uploaded_file_path(f"nav_img_{i}", image)
+                    if img_path:
+                        show_image(img_path, caption="Profil navire", width=200)
 
                 navires.append({
                     "nom": nom,
@@ -328,6 +441,7 @@ class ShipsForm:
                     "figure": img_path,
                     "est_actif": est_actif == "actif"
                 })
+                render_save_button("navire", navires[-1], key=f"catalogue_nav_{i}")
         
         return navires
     
@@ -339,6 +453,7 @@ class ShipsForm:
         
         if st.button("➕ Ajouter un remorqueur"):
             st.session_state.remorqueurs.append({})
+        render_catalog_picker("remorqueur", "remorqueurs")
         
         remorqueurs = []
         for i in range(len(st.session_state.remorqueurs)):
@@ -357,13 +472,10 @@ class ShipsForm:
                 vitesse = st.number_input("Vitesse max (nœuds)", key=f"rem_vitesse_{i}", step=0.5)
                 traction = st.number_input("Capacité de traction (tonnes)", key=f"rem_traction_{i}", step=0.5)
                 remarque = st.text_area("Remarques", key=f"rem_remarque_{i}")
-                image = st.file_uploader("Image (facultative)", type=["png", "jpg"], key=f"rem_img_{i}")
-                img_path = ""
-                if image:
-                    img_path = os.path.join("uploads", image.name)
-                    with open(img_path, "wb") as f:
-                        f.write(image.getbuffer())
-                    st.image(img_path, caption="Profil remorqueur", width=200)
+                image = st.file_uploader("Image (facultative)", type=Config.IMAGE_TYPES, key=f"rem_img_{i}")
+                img_path = uploaded_file_path(f"rem_img_{i}", image)
+                if img_path:
+                    show_image(img_path, caption="Profil remorqueur", width=200)
 
             remorqueurs.append({
                 "nom": nom,
@@ -377,6 +489,8 @@ class ShipsForm:
                 "remarques": remarque,
                 "figure": img_path
             })
+            with col2:
+                render_save_button("remorqueur", remorqueurs[-1], key=f"catalogue_rem_{i}")
         
         return remorqueurs
 
@@ -403,8 +517,8 @@ class SimulationsForm_:
                     reussite = st.checkbox("✔️ Manœuvre réussie ?", key=f"sim_success_{i}")
                 
                 with col2:
-                    image = st.file_uploader("Image", type=["png", "jpg"], key=f"sim_img_{i}")
-                    img_path = save_uploaded_file(image) if image else ""
+                    image = st.file_uploader("Image", type=Config.IMAGE_TYPES, key=f"sim_img_{i}")
+                    img_path = uploaded_file_path(f"sim_img_{i}", image)
                     commentaire = st.text_area("Commentaire", key=f"sim_comment_{i}")
                 
                 simulations.append({
@@ -458,8 +572,8 @@ class SimulationsForm:
                     reussite = st.checkbox("✔️ Manœuvre réussie ?", key=f"sim_success_{i}")
                 
                 with col2:
-                    image = st.file_uploader("Image", type=["png", "jpg"], key=f"sim_img_{i}")
-                    img_path = save_uploaded_file(image) if image else ""
+                    image = st.file_uploader("Image", type=Config.IMAGE_TYPES, key=f"sim_img_{i}")
+                    img_path = uploaded_file_path(f"sim_img_{i}", image)
                     commentaire = st.text_area("Commentaire du pilote", key=f"sim_comment_{i}")
                 
                 simulations.append({
@@ -485,10 +599,6 @@ class SimulationsForm:
             st.session_state.scenarios.append({})
         
         scenarios = []
-        evenements_possibles = [
-            "Panne moteur", "Perte gouvernail", "Défaillance remorqueur",
-            "Conditions extrêmes", "Manœuvre d'urgence", "Arrêt d'urgence"
-        ]
 
         for i in range(len(st.session_state.scenarios)):
              with st.expander(f"Scénario d'urgence {i+1}"):
@@ -497,12 +607,12 @@ class SimulationsForm:
                 with col1:
                     evenement = st.selectbox(
                         f"Événement simulé",
-                        evenements_possibles,
+                        EVENEMENTS_URGENCE,
                         key=f"evenement_{i}"
                     )
                 with col2:
-                    image = st.file_uploader("Image", type=["png", "jpg"], key=f"sim_img_{i}")
-                    img_path = save_uploaded_file(image) if image else ""
+                    image = st.file_uploader("Image", type=Config.IMAGE_TYPES, key=f"scen_img_{i}")
+                    img_path = uploaded_file_path(f"scen_img_{i}", image)
                 
                 analyse = st.text_area("Analyse du scénario", key=f"analyse_scenario_{i}")
                 scenarios.append({
@@ -511,8 +621,8 @@ class SimulationsForm:
                     "figure": img_path
                 })
         commentaire = ""
-        if st.checkbox("➕ Ajouter un commentaire sur les scénarios d'urgence"):
-            commentaire = st.text_area("Commentaire sur les scénarios d'urgence")
+        if st.checkbox("➕ Ajouter un commentaire sur les scénarios d'urgence", key="scen_commentaire_actif"):
+            commentaire = st.text_area("Commentaire sur les scénarios d'urgence", key="scen_commentaire")
 
         return scenarios, commentaire
 
@@ -528,13 +638,13 @@ class AnalysisForm:
         st.metric("Nombre d'essais", nb_essais)
         st.metric("Taux de réussite", f"{taux_reussite:.1%}")
         
-        conditions_critiques = st.text_area("Conditions critiques").split("\n")
+        conditions_critiques = st.text_area("Conditions critiques", key="analyse_conditions").split("\n")
 
-        distances = st.text_input("Distances trajectoires")
+        distances = st.text_input("Distances trajectoires", key="analyse_distances")
         
         commentaire = ""
-        if st.checkbox("➕ Ajouter un commentaire d'analyse"):
-            commentaire = st.text_area("Commentaire analyse")
+        if st.checkbox("➕ Ajouter un commentaire d'analyse", key="analyse_commentaire_actif"):
+            commentaire = st.text_area("Commentaire analyse", key="analyse_commentaire")
 
         return {
             "nombre_essais": nb_essais,
@@ -549,9 +659,9 @@ class ConclusionForm:
     def render() -> Dict[str, Any]:
         st.subheader("📝 Conclusion", divider=True)
         
-        synthese = st.text_area("Synthèse rédigée *")
-        conclusion = st.text_area("Conclusion *")
-        recommandations_text = st.text_area("Recommandations (une par ligne) *")
+        synthese = st.text_area("Synthèse rédigée *", key="conclusion_synthese")
+        conclusion = st.text_area("Conclusion *", key="conclusion_texte")
+        recommandations_text = st.text_area("Recommandations (une par ligne) *", key="conclusion_recommandations")
         recommandations = [r.strip() for r in recommandations_text.split("\n") if r.strip()]
         
         return {
@@ -568,7 +678,7 @@ class AnnexesForm:
         if "figures" not in st.session_state:
             st.session_state.figures = []
         
-        figures = handle_file_upload_with_legend("Figures", ["png", "jpg"], f"annexes_fig")
+        figures = handle_file_upload_with_legend("Figures", Config.IMAGE_TYPES, f"annexes_fig")
         
         # === Tableaux dynamiques ===
         if "tableaux" not in st.session_state:
@@ -580,11 +690,8 @@ class AnnexesForm:
         tableaux = []
         for i in range(len(st.session_state.tableaux)):
             table_file = st.file_uploader(f"Fichier tableau {i+1}", type=["xlsx", "csv"], key=f"table_file_{i}")
-            table_path = ""
-            if table_file:
-                table_path = os.path.join("uploads", table_file.name)
-                with open(table_path, "wb") as f:
-                    f.write(table_file.getbuffer())
+            table_path = uploaded_file_path(f"table_file_{i}", table_file)
+            if table_path:
                 tableaux.append(table_path)
         
         return {
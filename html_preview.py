@@ -0,0 +1,290 @@
+# =============================================================================
+# html_preview.py - Lightweight HTML preview built from the template context
+# =============================================================================
+
+import base64
+import hashlib
+import json
+import os
+import re
+from collections import OrderedDict
+from html import escape
+from typing import Callable, Dict
+
+from shared_cache import cached_file
+
+THUMB_SIZE = (240, 180)
+
+PREVIEW_CSS = """
+<style>
+body { font-family: Calibri, Arial, sans-serif; font-size: 14px; color: #222; margin: 0 12px; }
+h1 { font-size: 22px; border-bottom: 2px solid #1f4e79; color: #1f4e79; }
+h2 { font-size: 18px; color: #1f4e79; margin-top: 28px; }
+h3 { font-size: 15px; margin-bottom: 4px; }
+table { border-collapse: collapse; margin: 6px 0; }
+td, th { border: 1px solid #bbb; padding: 2px 6px; font-size: 12px; text-align: left; }
+figure { display: inline-block; margin: 4px 8px 4px 0; text-align: center; }
+.thumb { background-size: contain; background-repeat: no-repeat; margin: auto; }
+figcaption { font-size: 11px; color: #555; max-width: 240px; }
+.vide { color: #b00; font-style: italic; }
+.reussite { color: #080; } .echec { color: #b00; }
+</style>
+"""
+
+# Fragments HTML par section, indexés par empreinte du contenu de la section
+_FRAGMENTS: "OrderedDict[str, str]" = OrderedDict()
+_MAX_FRAGMENTS = 256
+# Miniatures déjà encodées, indexées par (chemin, taille, date de modification) ;
+# chaque miniature est déclarée une seule fois en CSS et référencée par sa classe
+_THUMBS: Dict[tuple, str] = {}
+_THUMB_CSS: Dict[str, str] = {}
+
+
+def _text(value) -> str:
+    if value is None or value == "" or value == []:
+        return '<span class="vide">(non renseigné)</span>'
+    return escape(str(value)).replace("\n", "<br>")
+
+
+def thumbnail_class(path: str) -> str:
+    """
+    Classe CSS de la miniature JPEG de l'image (générée une fois, gardée dans le cache partagé),
+    ou "" si l'image est absente ou illisible
+    """
+    if not path or not os.path.exists(path):
+        return ""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if key in _THUMBS:
+        return _THUMBS[key]
+
+    from PIL import Image
+    from images import content_digest, decode_reduced
+
+    def produce(tmp_path):
+        img = decode_reduced(path, 4 * THUMB_SIZE[0] * THUMB_SIZE[1])
+        img.thumbnail(THUMB_SIZE)
+        img.convert("RGB").save(tmp_path, "JPEG", quality=70)
+
+    # Nommée par le contenu de l'image : partagée entre répliques (cache partagé)
+    digest = content_digest(path)
+    thumb_id = digest[:12]
+    try:
+        thumb_path = cached_file("miniatures", f"{digest[:20]}_{THUMB_SIZE[0]}x{THUMB_SIZE[1]}", ".jpg", produce)
+    except Exception:
+        return ""
+    with open(thumb_path, "rb") as f:
+        data = f.read()
+    with Image.open(thumb_path) as thumb:
+        width, height = thumb.size
+    uri = "data:image/jpeg;base64," + base64.b64encode(data).decode("ascii")
+    _THUMB_CSS[thumb_id] = f".t{thumb_id} {{ background-image: url({uri}); width: {width}px; height: {height}px; }}"
+    _THUMBS[key] = f"t{thumb_id}"
+    return _THUMBS[key]
+
+
+def _figure(path: str, legende: str = "") -> str:
+    css_class = thumbnail_class(path)
+    if not css_class:
+        return f'<figure><span class="vide">[Image non disponible : {escape(os.path.basename(path or ""))}]</span></figure>'
+    return f'<figure><div class="thumb {css_class}"></div><figcaption>{escape(legende or "")}</figcaption></figure>'
+
+
+def _figures(figures) -> str:
+    return "".join(_figure(fig.get("chemin", ""), fig.get("legende", "")) for fig in figures or [])
+
+
+def _table(rows, columns) -> str:
+    head = "".join(f"<th>{escape(label)}</th>" for _, label in columns)
+    body = "".join(
+        "<tr>" + "".join(f"<td>{_text(row.get(key))}</td>" for key, _ in columns) + "</tr>"
+        for row in rows
+    )
+    return f"<table><tr>{head}</tr>{body}</table>"
+
+
+def _comment(data) -> str:
+    return f"<p><em>{_text(data.get('commentaire'))}</em></p>" if data.get("commentaire") else ""
+
+
+def _render_metadonnees(meta) -> str:
+    html = [f"<h1>{_text(meta.get('titre'))}</h1>"]
+    if meta.get("main_image"):
+        html.append(_figure(meta["main_image"]))
+    html.append(_table([meta], [
+        ("projet", "Projet"), ("code_projet", "Code projet"), ("client", "Client"),
+        ("type", "Type"), ("numero", "Numéro"), ("annee", "Année"), ("type_etude", "Type d'étude"),
+    ]))
+    if meta.get("client_logo"):
+        html.append(_figure(meta["client_logo"], "Logo client"))
+    if meta.get("historique_revisions"):
+        html.append("<h3>Révisions</h3>")
+        html.append(_table(meta["historique_revisions"], [
+            ("version", "Version"), ("date", "Date"), ("description", "Description"),
+            ("auteur", "Auteur"), ("verificateur", "Vérificateur"), ("approbateur", "Approbateur"),
+        ]))
+    return "".join(html)
+
+
+def _render_introduction(intro) -> str:
+    return (
+        "<h2>1. Introduction</h2>"
+        f"<p>{_text(intro.get('guidelines'))}</p>"
+        f"<h3>Objectifs</h3><p>{_text(intro.get('objectifs'))}</p>"
+    )
+
+
+def _render_donnees_entree(data) -> str:
+    html = ["<h2>2. Données d'entrée</h2>"]
+    plan = data.get("plan_de_masse", {}).get("phases", {})
+    html.append("<h3>Plan de masse</h3>")
+    for phase in plan.get("phases", []):
+        html.append(f"<p><strong>{_text(phase.get('nom'))}</strong> - {_text(phase.get('description'))}</p>")
+        html.append(_figures(phase.get("figures")))
+    html.append(_comment(plan))
+
+    bathy = data.get("bathymetrie", {})
+    html.append("<h3>Bathymétrie</h3>")
+    html.append(f"<p>Source : {_text(bathy.get('source'))} ({_text(bathy.get('date'))})</p>")
+    html.append(f"<p>{_text(bathy.get('notes_profondeur'))}</p>")
+    html.append(_figures(bathy.get("figures")))
+    if bathy.get("pied_de_pilote"):
+        html.append(_table(bathy["pied_de_pilote"], [
+            ("navire", "Navire"), ("tirant_eau_max", "Tirant d'eau (m)"),
+            ("ukc_min", "Pied de pilote min (m)"), ("mailles_insuffisantes_pct", "Zone insuffisante (%)"),
+        ]))
+    html.append(_comment(bathy))
+
+    conditions = data.get("conditions_environnementales", {})
+    html.append("<h3>Conditions environnementales</h3><ul>")
+    for label, key in (("Vent", "vent"), ("Houle", "houle")):
+        for value in conditions.get(key, []):
+            html.append(f"<li>{label} : {_text(value)}</li>")
+    html.append(f"<li>Marée : {_text(conditions.get('maree'))}</li></ul>")
+    html.append(_comment(conditions))
+
+    agitation = data.get("etude_agitation", {})
+    if agitation.get("actif"):
+        html.append("<h3>Étude d'agitation</h3>")
+        html.append(_figures(agitation.get("figures")))
+        if agitation.get("statistiques"):
+            html.append(_table(agitation["statistiques"].get("indisponibilite_par_classe", []), [
+                ("classe", "Classe"), ("hs_max", "Hs max (m)"),
+                ("indisponibilite_moyenne_pct", "Indisponibilité moyenne (%)"),
+            ]))
+        html.append(_comment(agitation))
+    return "".join(html)
+
+
+def _render_donnees_navires(data) -> str:
+    html = ["<h2>3. Navires</h2>"]
+    navires = data.get("navires", {})
+    for navire in navires.get("navires", []):
+        html.append(f"<h3>{_text(navire.get('nom'))} ({'actif' if navire.get('est_actif') else 'passif'})</h3>")
+        html.append(_table([navire], [
+            ("type", "Type"), ("etat_de_charge", "État de charge"), ("longueur", "L (m)"),
+            ("largeur", "B (m)"), ("tirant_eau_av", "T av (m)"), ("tirant_eau_ar", "T ar (m)"),
+            ("deplacement", "Déplacement (t)"), ("propulsion", "Propulsion"),
+        ]))
+        if navire.get("figure"):
+            html.append(_figure(navire["figure"], "Profil navire"))
+    html.append(_comment(navires))
+
+    remorqueurs = data.get("remorqueurs", {})
+    if remorqueurs.get("remorqueurs"):
+        html.append("<h3>Remorqueurs</h3>")
+        html.append(_table(remorqueurs["remorqueurs"], [
+            ("nom", "Nom"), ("type", "Type"), ("longueur", "L (m)"), ("largeur", "B (m)"),
+            ("tirant_eau", "T (m)"), ("vitesse", "Vitesse (nd)"), ("traction", "Traction (t)"),
+        ]))
+    html.append(_comment(remorqueurs))
+    return "".join(html)
+
+
+def _render_simulations(data) -> str:
+    html = ["<h2>4. Simulations</h2>"]
+    for sim in data.get("simulations", []):
+        css = "reussite" if sim.get("resultat") == "Réussite" else "echec"
+        html.append(
+            f"<h3>Simulation {_text(sim.get('id'))} - {_text(sim.get('navire'))} : {_text(sim.get('manoeuvre'))}</h3>"
+            f"<p>Vent : {_text(sim.get('conditions_env', {}).get('vent'))} - "
+            f"<span class=\"{css}\">{_text(sim.get('resultat'))}</span></p>"
+        )
+        if sim.get("commentaire_pilote"):
+            html.append(f"<p><em>{_text(sim['commentaire_pilote'])}</em></p>")
+        if sim.get("images", {}).get("planche"):
+            html.append(_figure(sim["images"]["planche"], f"Planche simulation {sim.get('id')}"))
+
+    scenarios = data.get("scenarios_urgence", {})
+    if scenarios.get("scenarios"):
+        html.append("<h3>Scénarios d'urgence</h3>")
+        for scenario in scenarios["scenarios"]:
+            html.append(f"<p><strong>{_text(scenario.get('evenement'))}</strong> : {_text(scenario.get('analyse'))}</p>")
+            if scenario.get("figure"):
+                html.append(_figure(scenario["figure"]))
+        html.append(_comment(scenarios))
+    return "".join(html)
+
+
+def _render_analyse_synthese(data) -> str:
+    html = [
+        "<h2>5. Analyse</h2>",
+        f"<p>Nombre d'essais : {_text(data.get('nombre_essais'))} - "
+        f"taux de réussite : {_text(data.get('taux_reussite_pct', data.get('taux_reussite')))} %</p>",
+    ]
+    if data.get("conditions_critiques"):
+        html.append("<ul>" + "".join(f"<li>{_text(c)}</li>" for c in data["conditions_critiques"]) + "</ul>")
+    html.append(f"<p>Distances trajectoires : {_text(data.get('distances_trajectoires'))}</p>")
+    html.append(_comment(data))
+    return "".join(html)
+
+
+def _render_conclusion(data) -> str:
+    recommandations = "".join(f"<li>{_text(r)}</li>" for r in data.get("recommandations", []))
+    return (
+        "<h2>6. Synthèse et conclusion</h2>"
+        f"<p>{_text(data.get('synthese_redigee'))}</p>"
+        f"<p>{_text(data.get('conclusion'))}</p>"
+        f"<h3>Recommandations</h3><ul>{recommandations}</ul>"
+    )
+
+
+def _render_annexes(data) -> str:
+    html = ["<h2>Annexes</h2>", _figures(data.get("figures"))]
+    for table in data.get("tableaux", []):
+        html.append(f"<p>Tableau : {escape(os.path.basename(table))}</p>")
+    return "".join(html)
+
+
+# (nom de section, extraction depuis le contexte, rendu) dans l'ordre du rapport
+SECTIONS: list = [
+    ("metadonnees", lambda c: c.get("metadonnees", {}), _render_metadonnees),
+    ("introduction", lambda c: c.get("introduction", {}), _render_introduction),
+    ("donnees_entree", lambda c: c.get("donnees_entree", {}), _render_donnees_entree),
+    ("donnees_navires", lambda c: c.get("donnees_navires", {}), _render_donnees_navires),
+    ("simulations", lambda c: c.get("simulations", {}), _render_simulations),
+    ("analyse_synthese", lambda c: c.get("analyse_synthese", {}), _render_analyse_synthese),
+    ("conclusion", lambda c: {k: c.get(k) for k in ("synthese_redigee", "conclusion", "recommandations")}, _render_conclusion),
+    ("annexes", lambda c: {k: c.get(k) for k in ("figures", "tableaux")}, _render_annexes),
+]
+
+
+def _section_html(name: str, data, render: Callable) -> str:
+    """Fragment HTML d'une section, recalculé uniquement si son contenu a changé"""
+    payload = json.dumps(data, sort_keys=True, default=str, ensure_ascii=False)
+    key = name + ":" + hashlib.sha1(payload.encode("utf-8")).hexdigest()
+    if key in _FRAGMENTS:
+        _FRAGMENTS.move_to_end(key)
+        return _FRAGMENTS[key]
+    html = f'<section id="{name}">{render(data)}</section>'
+    _FRAGMENTS[key] = html
+    if len(_FRAGMENTS) > _MAX_FRAGMENTS:
+        _FRAGMENTS.popitem(last=False)
+    return html
+
+
+def build_html_preview(context: dict) -> str:
+    """Aperçu HTML complet du rapport à partir du contexte préparé pour le template"""
+    body = "".join(_section_html(name, extract(context), render) for name, extract, render in SECTIONS)
+    thumbs = "\n".join(_THUMB_CSS[thumb_id] for thumb_id in sorted(set(re.findall(r"thumb t([0-9a-f]{12})", body))))
+    return f"<html><head><meta charset='utf-8'>{PREVIEW_CSS}<style>{thumbs}</style></head><body>{body}</body></html>"
@@ -0,0 +1,177 @@
+# =============================================================================
+# image_index.py - Background analysis of uploaded images (metadata index)
+# =============================================================================
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+from PIL import Image
+
+from config import Config
+from images import check_pixel_budget, content_digest, image_header, preview_image, word_image
+from shared_cache import lookup_file, publish_json
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    digest TEXT PRIMARY KEY,
+    chemin TEXT,
+    decodable INTEGER,
+    erreur TEXT,
+    format TEXT,
+    mode TEXT,
+    largeur INTEGER,
+    hauteur INTEGER,
+    dpi_x REAL,
+    dpi_y REAL,
+    derive TEXT,
+    derive_largeur INTEGER,
+    derive_hauteur INTEGER,
+    apercu TEXT,
+    analyse_le REAL
+)
+"""
+COLUMNS = ("digest", "chemin", "decodable", "erreur", "format", "mode", "largeur", "hauteur",
+           "dpi_x", "dpi_y", "derive", "derive_largeur", "derive_hauteur", "apercu", "analyse_le")
+
+_EXECUTOR = ThreadPoolExecutor(max_workers=Config.IMAGE_INDEX_WORKERS, thread_name_prefix="image-index")
+_LOCK = threading.Lock()
+_PENDING: Dict[str, Future] = {}   # empreinte -> analyse en cours
+_CACHE: Dict[str, dict] = {}       # empreinte -> métadonnées
+
+
+@contextmanager
+def _connect():
+    os.makedirs(os.path.dirname(Config.IMAGE_INDEX_DB), exist_ok=True)
+    conn = sqlite3.connect(Config.IMAGE_INDEX_DB, timeout=10)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(SCHEMA)
+        yield conn
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _is_current(meta: dict) -> bool:
+    # Dérivés supprimés du cache : l'analyse est à refaire
+    return not meta["decodable"] or (os.path.exists(meta["derive"]) and os.path.exists(meta["apercu"]))
+
+
+def _save(meta: dict) -> None:
+    with _connect() as conn:
+        conn.execute(
+            f"INSERT OR REPLACE INTO images ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+            [meta[c] for c in COLUMNS]
+        )
+    _CACHE[meta["digest"]] = meta
+
+
+def _shared(digest: str) -> Optional[dict]:
+    """Analyse faite par une autre réplique (cache partagé), reprise dans l'index local"""
+    path = lookup_file("index_images", digest, ".json")
+    if path is None:
+        return None
+    try:
+        with open(path, encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not _is_current(meta):
+        return None
+    _save(meta)
+    return meta
+
+
+def _cached(digest: str) -> Optional[dict]:
+    meta = _CACHE.get(digest)
+    if meta is None:
+        with _connect() as conn:
+            row = conn.execute(f"SELECT {', '.join(COLUMNS)} FROM images WHERE digest = ?", (digest,)).fetchone()
+        if row is None:
+            return _shared(digest)
+        meta = dict(zip(COLUMNS, row))
+        meta["decodable"] = bool(meta["decodable"])
+    if not _is_current(meta):
+        return _shared(digest)
+    _CACHE[digest] = meta
+    return meta
+
+
+def analyse_image(path: str, digest: Optional[str] = None) -> dict:
+    """
+    Vérifie qu'une image se décode, relève dimensions, DPI, mode et empreinte,
+    et produit ses dérivés (version Word, aperçu). Le résultat est indexé.
+    """
+    digest = digest or content_digest(path)
+    meta = dict.fromkeys(COLUMNS)
+    meta.update({"digest": digest, "chemin": path, "decodable": False, "analyse_le": time.time()})
+    try:
+        with Image.open(path) as img:
+            dpi = img.info.get("dpi") or (None, None)
+            meta.update({
+                "format": img.format, "mode": img.mode,
+                "largeur": img.width, "hauteur": img.height,
+                "dpi_x": float(dpi[0]) if dpi[0] else None,
+                "dpi_y": float(dpi[1]) if dpi[1] else None,
+            })
+        check_pixel_budget(path)
+        derive = word_image(path)
+        if derive == path:
+            # Pas de conversion : décodage complet pour s'assurer que le fichier est sain
+            with Image.open(path) as img:
+                img.load()
+        width, height, _, _ = image_header(derive)
+        meta.update({
+            "decodable": True, "derive": derive,
+            "derive_largeur": width, "derive_hauteur": height,
+            "apercu": preview_image(path),
+        })
+    except Exception as e:
+        meta["erreur"] = str(e) or type(e).__name__
+
+    _save(meta)
+    if meta["decodable"]:
+        publish_json("index_images", digest, meta)
+    return meta
+
+
+def _run(path: str, digest: str) -> dict:
+    try:
+        return analyse_image(path, digest)
+    finally:
+        with _LOCK:
+            _PENDING.pop(digest, None)
+
+
+def submit(path: str) -> Future:
+    """Lance l'analyse en arrière-plan (une seule fois par contenu)"""
+    digest = content_digest(path)
+    meta = _cached(digest)
+    if meta is not None:
+        future = Future()
+        future.set_result(meta)
+        return future
+    with _LOCK:
+        if digest not in _PENDING:
+            _PENDING[digest] = _EXECUTOR.submit(_run, path, digest)
+        return _PENDING[digest]
+
+
+def lookup(path: str, wait: float = 0) -> Optional[dict]:
+    """Métadonnées indexées de l'image, ou None si l'analyse n'est pas terminée après `wait` secondes"""
+    future = submit(path)
+    try:
+        return future.result(timeout=wait)
+    except FutureTimeoutError:
+        return None
+
+
+def image_metadata(path: str) -> dict:
+    """Métadonnées de l'image, analysée sur-le-champ si elle n'est pas encore indexée"""
+    return submit(path).result()
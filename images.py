@@ -0,0 +1,134 @@
+# =============================================================================
+# images.py - Memory-bounded image measuring, decoding and conversion
+# =============================================================================
+
+import hashlib
+import math
+import os
+import threading
+from contextlib import nullcontext
+from functools import lru_cache
+from typing import Tuple
+
+from PIL import Image
+
+from config import Config
+from shared_cache import cached_file
+from upload_store import is_stored
+
+# Garde-fou de Pillow aligné sur le budget de l'application
+Image.MAX_IMAGE_PIXELS = Config.IMAGE_MAX_DECODE_PIXELS
+
+# Formats embarquables tels quels dans Word
+WORD_FORMATS = {"PNG", "JPEG", "GIF", "BMP"}
+IMAGE_EXTENSIONS = tuple("." + ext for ext in Config.IMAGE_TYPES)
+
+# Un seul décodage de grande image à la fois dans le processus
+_DECODE_LOCK = threading.Lock()
+
+
+class ImageTooLargeError(ValueError):
+    """Image dont le décodage dépasserait le budget de pixels"""
+
+
+def is_image_file(path) -> bool:
+    return isinstance(path, str) and path.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def image_header(path: str) -> Tuple[int, int, int, str]:
+    """(largeur, hauteur, canaux, format) lus dans l'en-tête seul ; le fichier est refermé aussitôt"""
+    with Image.open(path) as img:
+        return img.width, img.height, len(img.getbands()), img.format
+
+
+def check_pixel_budget(path: str) -> None:
+    width, height, _, _ = image_header(path)
+    if width * height > Config.IMAGE_MAX_DECODE_PIXELS:
+        raise ImageTooLargeError(
+            f"{width} × {height} px dépasse le budget de "
+            f"{Config.IMAGE_MAX_DECODE_PIXELS / 1e6:.0f} Mpx"
+        )
+
+
+@lru_cache(maxsize=1024)
+def _file_digest(path: str, size: int, mtime_ns: int) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def content_digest(path: str) -> str:
+    """Empreinte SHA-256 du contenu (mise en cache selon taille et date de modification)"""
+    # Les fichiers de l'upload store sont nommés par leur empreinte
+    if is_stored(path):
+        return os.path.splitext(os.path.basename(path))[0]
+    stat = os.stat(path)
+    return _file_digest(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+
+def _has_alpha(img: Image.Image) -> bool:
+    return img.mode in ("RGBA", "LA", "PA") or (img.mode == "P" and "transparency" in img.info)
+
+
+def decode_reduced(path: str, max_pixels: int) -> Image.Image:
+    """
+    Décode une image réduite à au plus max_pixels pixels. Les JPEG sont décodés
+    directement à échelle réduite (draft) ; les autres formats sont décodés une fois
+    puis réduits par facteur entier (reduce) avant un redimensionnement final.
+    """
+    width, height, _, _ = image_header(path)
+    if width * height > Config.IMAGE_MAX_DECODE_PIXELS:
+        check_pixel_budget(path)
+    scale = min(1.0, math.sqrt(max_pixels / (width * height)))
+    target = (max(1, int(width * scale)), max(1, int(height * scale)))
+
+    with _DECODE_LOCK if width * height > max_pixels else nullcontext():
+        with Image.open(path) as img:
+            alpha = _has_alpha(img)
+            if img.format == "JPEG" and scale < 1:
+                img.draft("RGB" if img.mode not in ("L", "RGB") else img.mode, target)
+            img.load()
+            work = img
+            if work.mode not in ("L", "LA", "RGB", "RGBA"):
+                work = work.convert("RGBA" if alpha else "RGB")
+            factor = min(work.width // target[0], work.height // target[1])
+            if factor >= 2:
+                work = work.reduce(factor)
+            if work.width * work.height > max_pixels:
+                work = work.resize(target, Image.LANCZOS)
+            return work.copy() if work is img else work
+
+
+def derived_image(path: str, max_pixels: int) -> str:
+    """
+    Chemin d'une version utilisable de l'image : le fichier lui-même s'il est dans un
+    format Word et sous le budget de pixels, sinon une conversion PNG/JPEG réduite,
+    produite une seule fois et gardée en cache selon le contenu du fichier.
+    """
+    width, height, _, fmt = image_header(path)
+    if fmt in WORD_FORMATS and width * height <= max_pixels:
+        return path
+
+    ext = "jpg" if fmt == "JPEG" else "png"
+
+    def produce(tmp_path):
+        img = decode_reduced(path, max_pixels)
+        if ext == "jpg":
+            img.convert("RGB").save(tmp_path, "JPEG", quality=90)
+        else:
+            img.save(tmp_path, "PNG")
+
+    # Cache partagé : une conversion faite par une réplique sert à toutes
+    return cached_file("images", f"{content_digest(path)[:20]}_{max_pixels}", f".{ext}", produce)
+
+
+def word_image(path: str) -> str:
+    """Version de l'image à embarquer dans le rapport Word"""
+    return derived_image(path, Config.IMAGE_MAX_PIXELS)
+
+
+def preview_image(path: str) -> str:
+    """Version légère de l'image pour l'aperçu dans les formulaires (tirée de la version Word)"""
+    return derived_image(word_image(path), Config.IMAGE_PREVIEW_PIXELS)
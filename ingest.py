@@ -0,0 +1,273 @@
+# =============================================================================
+# ingest.py - Ingestion of very large files without holding them in memory
+# =============================================================================
+#
+# Deux voies, à côté des uploaders Streamlit (qui gardent chaque fichier en mémoire) :
+#   - dossier de dépôt (Config.DROP_DIR) : le fichier, une fois stable, est déplacé
+#     dans l'upload store ;
+#   - envoi par morceaux, reprenable, via le service local (render_service.py) :
+#     POST /envois, PUT /envois/<id>?position=..., POST /envois/<id>/fin.
+# Dans les deux cas le fichier est haché par blocs et contrôlé (taille, empreinte),
+# et le formulaire ne reçoit que son chemin dans le store. Les quotas sont vérifiés
+# avant la réception ; un envoi terminé est rangé dans son propre espace de transit,
+# libéré quand le fichier est rattaché au projet.
+
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Sequence
+
+import streamlit as st
+
+from config import Config
+from images import ImageTooLargeError, check_pixel_budget, is_image_file
+from image_index import submit
+from upload_store import (INCOMING_DIR, UploadQuotaError, check_quota, release_namespace, store_file,
+                          store_moved_file)
+from utils import upload_namespace
+
+_UPLOAD_ID = re.compile(r"^[0-9a-f]{32}$")
+UPLOAD_NAMESPACE = "envoi_{}"  # espace de transit d'un envoi par morceaux, jusqu'au rattachement
+_LOCKS: Dict[str, threading.Lock] = {}
+_LOCKS_GUARD = threading.Lock()
+
+
+class UploadOffsetError(ValueError):
+    """Morceau reçu à une position différente de ce qui est déjà reçu (reprendre à `recu`)"""
+
+    def __init__(self, message: str, received: int):
+        super().__init__(message)
+        self.received = received
+
+
+def _incoming_dir() -> str:
+    path = os.path.join(Config.UPLOAD_DIR, INCOMING_DIR)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _finalize(path: str, name: str, namespace: str, expected_digest: Optional[str] = None,
+              expected_size: Optional[int] = None) -> dict:
+    """Déplace le fichier dans le store et lance l'analyse des images ; retourne {"nom", "chemin"}"""
+    stored = store_moved_file(path, namespace, expected_digest, expected_size, name)
+    if is_image_file(stored):
+        check_pixel_budget(stored)
+        submit(stored)
+    return {"nom": name, "chemin": stored}
+
+
+# --- Dossier de dépôt --------------------------------------------------------
+
+def list_drop_files(extensions: Sequence[str] = ()) -> List[dict]:
+    """Fichiers du dossier de dépôt prêts à être importés (non modifiés depuis INGEST_STABLE_SECONDS)"""
+    if not os.path.isdir(Config.DROP_DIR):
+        return []
+    now = time.time()
+    files = []
+    for entry in os.scandir(Config.DROP_DIR):
+        if not entry.is_file() or entry.name.startswith("."):
+            continue
+        ext = os.path.splitext(entry.name)[1].lower().lstrip(".")
+        if extensions and ext not in extensions:
+            continue
+        stat = entry.stat()
+        if now - stat.st_mtime >= Config.INGEST_STABLE_SECONDS:
+            files.append({"nom": entry.name, "taille": stat.st_size, "chemin": entry.path})
+    return sorted(files, key=lambda f: f["nom"])
+
+
+def ingest_drop_file(name: str, namespace: str) -> dict:
+    """Importe un fichier du dossier de dépôt dans le store (il quitte le dossier de dépôt)"""
+    path = os.path.join(Config.DROP_DIR, os.path.basename(name))
+    if not os.path.isfile(path):
+        raise ValueError(f"{name} n'est plus dans le dossier de dépôt")
+    size = os.path.getsize(path)
+    if size > Config.INGEST_MAX_BYTES:
+        raise ValueError(f"{name} : {size / 1e9:.1f} Go, maximum {Config.INGEST_MAX_BYTES / 1e9:.1f} Go")
+    if time.time() - os.path.getmtime(path) < Config.INGEST_STABLE_SECONDS:
+        raise ValueError(f"{name} est encore en cours de copie")
+    check_quota(size, namespace)  # avant de hacher plusieurs Go
+    return _finalize(path, os.path.basename(name), namespace)
+
+
+# --- Envoi par morceaux (reprenable) ------------------------------------------
+
+def _upload_paths(upload_id: str):
+    if not _UPLOAD_ID.match(upload_id or ""):
+        raise ValueError("Identifiant d'envoi invalide")
+    base = os.path.join(_incoming_dir(), upload_id)
+    return f"{base}.json", f"{base}.part"
+
+
+def _lock(upload_id: str) -> threading.Lock:
+    with _LOCKS_GUARD:
+        return _LOCKS.setdefault(upload_id, threading.Lock())
+
+
+def _read_meta(upload_id: str) -> dict:
+    meta_path, _ = _upload_paths(upload_id)
+    try:
+        with open(meta_path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise ValueError(f"Envoi inconnu ou expiré : {upload_id}")
+
+
+def _write_meta(upload_id: str, meta: dict) -> None:
+    meta_path, _ = _upload_paths(upload_id)
+    tmp_path = f"{meta_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp_path, meta_path)
+
+
+def _status(meta: dict, part_path: str) -> dict:
+    received = meta["taille"] if meta.get("chemin") else (os.path.getsize(part_path) if os.path.exists(part_path) else 0)
+    return {"id": meta["id"], "nom": meta["nom"], "taille": meta["taille"], "recu": received,
+            "termine": bool(meta.get("chemin")), "chemin": meta.get("chemin")}
+
+
+def purge_stale_uploads() -> int:
+    """Oublie les envois (inachevés ou terminés) plus anciens que INGEST_UPLOAD_TTL ; retourne leur nombre"""
+    limit = time.time() - Config.INGEST_UPLOAD_TTL
+    removed = 0
+    for entry in os.scandir(_incoming_dir()):
+        if entry.name.endswith((".json", ".part")) and entry.stat().st_mtime < limit:
+            os.remove(entry.path)
+            if entry.name.endswith(".json"):
+                release_namespace(UPLOAD_NAMESPACE.format(entry.name[:-len(".json")]))
+                removed += 1
+    return removed
+
+
+def start_upload(name: str, size: int, digest: Optional[str] = None) -> dict:
+    """
+    Ouvre un envoi par morceaux ; retourne son état (id, recu = 0). Les quotas sont
+    contrôlés dès l'annonce de la taille (UploadQuotaError), pas après la réception.
+    """
+    name = os.path.basename(name or "")
+    if not name:
+        raise ValueError("Nom de fichier manquant")
+    if not 0 < size <= Config.INGEST_MAX_BYTES:
+        raise ValueError(f"Taille annoncée invalide (1 octet à {Config.INGEST_MAX_BYTES / 1e9:.1f} Go)")
+    if digest is not None and not re.match(r"^[0-9a-f]{64}$", digest):
+        raise ValueError("Empreinte SHA-256 invalide")
+    purge_stale_uploads()
+    upload_id = uuid.uuid4().hex
+    namespace = UPLOAD_NAMESPACE.format(upload_id)
+    check_quota(size, namespace)
+    meta = {"id": upload_id, "nom": name, "taille": size, "empreinte": digest,
+            "espace": namespace, "cree_le": time.time()}
+    _write_meta(upload_id, meta)
+    open(_upload_paths(upload_id)[1], "wb").close()
+    return _status(meta, _upload_paths(upload_id)[1])
+
+
+def upload_status(upload_id: str) -> dict:
+    meta = _read_meta(upload_id)
+    return _status(meta, _upload_paths(upload_id)[1])
+
+
+def append_chunk(upload_id: str, offset: int, stream, length: int, chunk_size: int = 1024 * 1024) -> dict:
+    """
+    Ajoute un morceau lu par blocs depuis stream. offset doit être égal à ce qui est déjà
+    reçu (UploadOffsetError sinon, avec la position où reprendre).
+    """
+    if length > Config.INGEST_CHUNK_MAX_BYTES:
+        raise ValueError(f"Morceau trop volumineux (max {Config.INGEST_CHUNK_MAX_BYTES} octets)")
+    with _lock(upload_id):
+        meta = _read_meta(upload_id)
+        _, part_path = _upload_paths(upload_id)
+        if meta.get("chemin"):
+            raise ValueError("Envoi déjà terminé")
+        received = os.path.getsize(part_path)
+        if offset != received:
+            raise UploadOffsetError(f"Position {offset} attendue {received}", received)
+        if received + length > meta["taille"]:
+            raise ValueError(f"Morceau au-delà de la taille annoncée ({meta['taille']} octets)")
+        written = 0
+        with open(part_path, "ab") as f:
+            try:
+                while written < length:
+                    chunk = stream.read(min(chunk_size, length - written))
+                    if not chunk:
+                        break
+                    f.write(chunk)
+                    written += len(chunk)
+            finally:
+                if written < length:
+                    # Morceau interrompu : on revient à la dernière position complète
+                    f.truncate(received)
+        if written < length:
+            raise UploadOffsetError(f"Morceau incomplet ({written} / {length} octets)", received)
+        return _status(meta, part_path)
+
+
+def finish_upload(upload_id: str) -> dict:
+    """Vérifie l'envoi complet (taille, empreinte) et l'enregistre dans le store"""
+    with _lock(upload_id):
+        meta = _read_meta(upload_id)
+        _, part_path = _upload_paths(upload_id)
+        if not meta.get("chemin"):
+            received = os.path.getsize(part_path)
+            if received != meta["taille"]:
+                raise UploadOffsetError(f"Envoi incomplet ({received} / {meta['taille']} octets)", received)
+            meta["chemin"] = _finalize(part_path, meta["nom"], meta["espace"],
+                                       meta.get("empreinte"), meta["taille"])["chemin"]
+            _write_meta(upload_id, meta)
+        return _status(meta, part_path)
+
+
+def completed_upload(upload_id: str) -> dict:
+    """{"nom", "chemin"} d'un envoi terminé, à rattacher à un formulaire"""
+    status = upload_status(upload_id.strip())
+    if not status["termine"]:
+        raise ValueError(f"Envoi non terminé ({status['recu']} / {status['taille']} octets reçus)")
+    return {"nom": status["nom"], "chemin": status["chemin"]}
+
+
+# --- Formulaires ----------------------------------------------------------------
+
+def _ingest_callback(key: str, multiple: bool) -> None:
+    name = st.session_state.get(f"_depot_{key}")
+    upload_id = (st.session_state.get(f"_envoi_{key}") or "").strip()
+    try:
+        if upload_id:
+            handle = completed_upload(upload_id)
+            store_file(handle["chemin"], upload_namespace())  # rattache le fichier reçu au projet
+            release_namespace(UPLOAD_NAMESPACE.format(upload_id))
+        elif name:
+            handle = ingest_drop_file(name, upload_namespace())
+        else:
+            return
+    except (ValueError, OSError, UploadQuotaError, ImageTooLargeError) as e:
+        st.session_state[f"_ingest_erreur_{key}"] = str(e)
+        return
+    current = (st.session_state.get(f"{key}_path") or []) if multiple else []
+    st.session_state[f"{key}_path"] = [f for f in current if f["chemin"] != handle["chemin"]] + [handle]
+    st.session_state[f"_depot_{key}"] = ""
+    st.session_state[f"_envoi_{key}"] = ""
+
+
+def render_ingest_picker(key: str, extensions: Sequence[str], multiple: bool = False) -> None:
+    """
+    Alternative à l'uploader `key` pour les fichiers volumineux : fichier du dossier de
+    dépôt ou envoi par morceaux terminé. Le formulaire le retrouve sous "<key>_path".
+    """
+    with st.expander("📂 Fichier volumineux (dossier de dépôt ou envoi par morceaux)"):
+        st.caption(f"Copiez le fichier dans `{os.path.abspath(Config.DROP_DIR)}`, ou envoyez-le par morceaux "
+                   f"au service local (`POST /envois`) puis collez l'identifiant d'envoi. "
+                   f"Le fichier est importé sans passer par la mémoire du navigateur ni de l'application.")
+        files = list_drop_files(extensions)
+        sizes = {f["nom"]: f["taille"] for f in files}
+        col1, col2 = st.columns(2)
+        col1.selectbox("Fichier déposé", [""] + list(sizes), key=f"_depot_{key}",
+                       format_func=lambda n: f"{n} ({sizes[n] / 1e6:,.0f} Mo)" if n else "—")
+        col2.text_input("Identifiant d'envoi", key=f"_envoi_{key}")
+        st.button("📥 Utiliser ce fichier", key=f"_ingest_{key}", on_click=_ingest_callback, args=(key, multiple))
+        error = st.session_state.pop(f"_ingest_erreur_{key}", None)
+        if error:
+            st.error(f"⚠️ {error}")
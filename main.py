@@ -2,11 +2,20 @@
 # main_app.py - Main application
 # =============================================================================
 
+import copy
 import streamlit as st
+import streamlit.components.v1 as components
 from forms import *
 from utils import *
 from config import Config
-from word_export import export_word_ui
+from word_export import export_word_ui, prepare_context_for_template
+from html_preview import build_html_preview
+from validation import ReportValidator
+from drafts import init_drafts, render_drafts_sidebar, restore_section, autosave
+from report_import import render_import_sidebar
+from project_bundle import render_bundle_panel
+from revision_diff import render_revision_diff
+from bathymetry import compute_under_keel_clearance
 
 
 def main():
@@ -15,6 +24,11 @@ def main():
     
     st.title("📄 Générateur de Rapport de Manœuvrabilité")
     
+    # Brouillons : reprise après rafraîchissement, choix du brouillon
+    init_drafts()
+    render_drafts_sidebar()
+    render_import_sidebar()
+    
     # Create tabs
     tabs = st.tabs([
         "📁 Métadonnées",
@@ -32,49 +46,80 @@ def main():
     rapport = {}
     
     # Render forms
+    # Chaque section du brouillon est restaurée juste avant le rendu de ses widgets
     with tabs[0]:
+        restore_section("metadonnees")
         rapport["metadonnees"] = MetadataForm.render()
     
     with tabs[1]:
+        restore_section("introduction")
         rapport["introduction"] = IntroductionForm.render()
     
     with tabs[2]:
+        restore_section("donnees_entree")
         rapport["donnees_entree"] = DataInputForm.render()
     
     with tabs[3]:
+        restore_section("donnees_navires")
         rapport["donnees_navires"] = ShipsForm.render()
     
+    # Pied de pilote : croise la grille bathymétrique, les navires et la marée
+    bathymetrie = rapport["donnees_entree"]["bathymetrie"]
+    bathymetrie["pied_de_pilote"] = compute_under_keel_clearance(
+        bathymetrie.get("grille"),
+        rapport["donnees_navires"]["navires"]["navires"],
+        rapport["donnees_entree"]["conditions_environnementales"]["maree"]
+    )
+    
     with tabs[4]:
+        restore_section("simulations")
         rapport["simulations"] = SimulationsForm.render()
     
     with tabs[5]:
+        restore_section("analyse_synthese")
         simulations_data = rapport["simulations"]["simulations"] if "simulations" in rapport else []
         rapport["analyse_synthese"] = AnalysisForm.render(simulations_data)
+        
+        if bathymetrie["pied_de_pilote"]:
+            st.subheader("⚓ Pied de pilote", divider=True)
+            st.dataframe(bathymetrie["pied_de_pilote"], use_container_width=True)
     
     with tabs[6]:
+        restore_section("conclusion")
         conclusion_data = ConclusionForm.render()
         rapport.update(conclusion_data)
     with tabs[7]:
+        restore_section("annexes")
         annexes = AnnexesForm.render()
         rapport.update(annexes)
+    
+    # Sauvegarde automatique des seules sections modifiées
+    changed_sections = autosave(rapport["metadonnees"]["titre"] or rapport["metadonnees"]["projet"])
+    
     # Export tab
     with tabs[8]:
         st.subheader("🧾 Export", divider=True)
         
-        # Validation
-        is_valid = validate_report(rapport)
+        # Validation incrémentale : seules les sections modifiées (d'après l'enregistrement
+        # automatique du brouillon) sont revérifiées
+        if "validator" not in st.session_state:
+            st.session_state.validator = ReportValidator()
+        issues = st.session_state.validator.validate(rapport, changed_sections)
+        is_valid = not issues
         
         if is_valid:
             st.success("✅ Rapport prêt pour l'export")
             
-            # Download JSON
-            json_buffer = create_json_download(rapport)
+            # Download JSON : sérialisé seulement au clic
+            compact = st.checkbox("JSON compact", key="json_compact")
             st.download_button(
                 "📥 Télécharger JSON",
-                json_buffer,
+                lambda: create_json_download(rapport, compact),
                 file_name="rapport.json",
-                mime="application/json"
+                mime="application/json",
+                on_click="ignore"
             )
+            render_bundle_panel(rapport)
             
             # Show summary
             st.subheader("Résumé")
@@ -90,7 +135,12 @@ def main():
                 taux = rapport['analyse_synthese']['taux_reussite']
                 st.write(f"**Taux de réussite:** {taux:.1%}")
         else:
-            st.warning("⚠️ Veuillez remplir tous les champs obligatoires")
+            st.warning(f"⚠️ Veuillez remplir tous les champs obligatoires ({len(issues)} anomalie(s))")
+            for onglet in dict.fromkeys(issue["onglet"] for issue in issues):
+                st.markdown(f"**{onglet}**")
+                for issue in issues:
+                    if issue["onglet"] == onglet:
+                        st.markdown(f"- {issue['libelle']} (`{issue['champ']}`) : {issue['message']}")
             
         # Preview JSON
         if "show_json" not in st.session_state:
@@ -100,7 +150,21 @@ def main():
             st.session_state.show_json = not st.session_state.show_json
 
         if st.session_state.show_json:
-            st.json(rapport)
+            render_json_preview(rapport)
+        
+        # Aperçu HTML : même contexte que le template, miniatures au lieu des images
+        if "show_html" not in st.session_state:
+            st.session_state.show_html = False
+
+        if st.button("🖥️ Aperçu HTML"):
+            st.session_state.show_html = not st.session_state.show_html
+
+        if st.session_state.show_html:
+            context = prepare_context_for_template(copy.deepcopy(rapport))
+            components.html(build_html_preview(context), height=900, scrolling=True)
+        
+        # Changements depuis le dernier export (description de la nouvelle révision)
+        render_revision_diff(rapport)
         
         # Export DOCX
         export_word_ui(rapport)
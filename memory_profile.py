@@ -0,0 +1,246 @@
+# =============================================================================
+# memory_profile.py - Opt-in memory attribution for the export pipeline (tracemalloc, RSS)
+# =============================================================================
+
+import json
+import os
+import platform
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from config import Config
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# tracemalloc est global au processus : un seul export profilé à la fois
+_PROFILE_LOCK = threading.Lock()
+
+
+def _rss() -> Optional[int]:
+    """Mémoire résidente du processus (octets), lue dans /proc ; None si indisponible"""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class _RssSampler(threading.Thread):
+    """
+    Relève la mémoire résidente à intervalle régulier : les tampons de décodage de Pillow
+    (et autres allocations C) sont invisibles pour tracemalloc mais comptent dans le RSS
+    """
+
+    def __init__(self, interval: float):
+        super().__init__(daemon=True, name="profil-rss")
+        self.interval = interval
+        self.peak = _rss() or 0
+        self._stop_event = threading.Event()
+
+    def sample(self) -> int:
+        current = _rss() or 0
+        self.peak = max(self.peak, current)
+        return current
+
+    def reset_peak(self) -> int:
+        current = _rss() or 0
+        self.peak = current
+        return current
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            self.sample()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self.join()
+
+
+class _Stage:
+    __slots__ = ("record", "start_current", "peak", "snapshot", "started", "rss_start", "rss_peak")
+
+    def __init__(self, record: dict, start_current: int, snapshot, rss_start: int):
+        self.record = record
+        self.start_current = start_current
+        self.peak = start_current
+        self.snapshot = snapshot
+        self.started = time.perf_counter()
+        self.rss_start = rss_start
+        self.rss_peak = rss_start
+
+
+class MemoryProfiler:
+    """
+    Mesure, pour chaque étape de l'export (préparation du contexte, image par image,
+    rendu, enregistrement), le pic de mémoire Python et la mémoire retenue à la fin de
+    l'étape, ainsi que le pic et la variation de la mémoire résidente (RSS échantillonné,
+    qui inclut les tampons des images décodées). Les étapes principales gardent aussi
+    leurs plus grosses allocations (fichier source et ligne). Les étapes peuvent être
+    imbriquées : le pic d'une étape inclut celui des étapes qu'elle contient.
+    Un seul profil à la fois par processus : start() attend la fin d'un profil en cours.
+    """
+
+    def __init__(self, top: int = Config.PROFILE_TOP_ALLOCATIONS):
+        self.top = top
+        self.stages: List[dict] = []
+        self._stack: List[_Stage] = []
+        self._owns_tracing = False
+        self._sampler: Optional[_RssSampler] = None
+        self.started = None
+        self.peak_total = 0
+        self.rss_peak_total = 0
+
+    def _reset_peak(self) -> None:
+        """Remet à zéro le pic de tracemalloc en conservant le pic global de l'export"""
+        self.peak_total = max(self.peak_total, tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+
+    def start(self) -> None:
+        _PROFILE_LOCK.acquire()
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(Config.PROFILE_FRAMES)
+            self._owns_tracing = True
+        tracemalloc.reset_peak()
+        self.peak_total = 0
+        if _rss() is not None:
+            self._sampler = _RssSampler(Config.PROFILE_RSS_INTERVAL)
+            self._sampler.start()
+        self.started = datetime.now()
+
+    def stop(self) -> None:
+        try:
+            self.peak_total = max(self.peak_total, tracemalloc.get_traced_memory()[1])
+            if self._sampler is not None:
+                self._sampler.stop()
+                self.rss_peak_total = max(self.rss_peak_total, self._sampler.peak)
+                self._sampler = None
+            if self._owns_tracing:
+                tracemalloc.stop()
+                self._owns_tracing = False
+        finally:
+            _PROFILE_LOCK.release()
+
+    def _rss_enter(self) -> int:
+        """RSS au début d'une étape ; le pic relevé jusque-là revient à l'étape parente"""
+        if self._sampler is None:
+            return 0
+        self._sampler.sample()
+        if self._stack:
+            self._stack[-1].rss_peak = max(self._stack[-1].rss_peak, self._sampler.peak)
+        self.rss_peak_total = max(self.rss_peak_total, self._sampler.peak)
+        return self._sampler.reset_peak()
+
+    @contextmanager
+    def stage(self, name: str, section: Optional[str] = None, fichier: Optional[str] = None,
+              allocations: bool = False):
+        """allocations : prend des instantanés (coûteux) pour lister les plus grosses allocations"""
+        current, peak = tracemalloc.get_traced_memory()
+        if self._stack:
+            self._stack[-1].peak = max(self._stack[-1].peak, peak)
+        self._reset_peak()
+        rss_start = self._rss_enter()
+        record = {"etape": name, "section": section, "fichier": fichier, "niveau": len(self._stack)}
+        self.stages.append(record)
+        stage = _Stage(record, current, tracemalloc.take_snapshot() if allocations else None, rss_start)
+        self._stack.append(stage)
+        try:
+            yield record
+        finally:
+            self._stack.pop()
+            current, peak = tracemalloc.get_traced_memory()
+            stage.peak = max(stage.peak, peak)
+            record.update({
+                "duree_s": round(time.perf_counter() - stage.started, 3),
+                "pic_octets": stage.peak - stage.start_current,
+                "retenu_octets": current - stage.start_current,
+            })
+            if self._sampler is not None:
+                rss_end = self._sampler.sample()
+                stage.rss_peak = max(stage.rss_peak, self._sampler.peak)
+                record.update({
+                    "rss_pic_octets": stage.rss_peak - stage.rss_start,
+                    "rss_delta_octets": rss_end - stage.rss_start,
+                })
+            if stage.snapshot is not None:
+                record["allocations"] = self._top_allocations(stage.snapshot)
+            if self._stack:
+                self._stack[-1].peak = max(self._stack[-1].peak, stage.peak)
+                self._stack[-1].rss_peak = max(self._stack[-1].rss_peak, stage.rss_peak)
+            self._reset_peak()
+            if self._sampler is not None:
+                self.rss_peak_total = max(self.rss_peak_total, self._sampler.peak)
+                self._sampler.reset_peak()
+
+    def tag_sections(self, used_images: Dict[str, set]) -> None:
+        """Rattache aux sections du rapport les étapes mesurées par fichier seulement (embarquement)"""
+        for record in self.stages:
+            if record["section"] is None and record["fichier"] in used_images:
+                record["section"] = ", ".join(sorted(used_images[record["fichier"]]))
+
+    def _top_allocations(self, before) -> List[dict]:
+        """Plus grosses croissances de mémoire de l'étape, par ligne de code"""
+        ignore = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+        after = tracemalloc.take_snapshot().filter_traces(ignore)
+        stats = after.compare_to(before.filter_traces(ignore), "lineno")
+        return [
+            {
+                "source": f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                "octets": stat.size_diff,
+                "blocs": stat.count_diff,
+            }
+            for stat in stats[:self.top] if stat.size_diff > 0
+        ]
+
+    def _aggregate(self, key: str) -> Dict[str, dict]:
+        totals: Dict[str, dict] = {}
+        for record in self.stages:
+            if record.get(key) is None:
+                continue
+            entry = totals.setdefault(record[key], {"pic_max_octets": 0, "rss_pic_max_octets": 0,
+                                                    "retenu_octets": 0, "etapes": 0})
+            entry["pic_max_octets"] = max(entry["pic_max_octets"], record.get("pic_octets", 0))
+            entry["rss_pic_max_octets"] = max(entry["rss_pic_max_octets"], record.get("rss_pic_octets", 0))
+            entry["retenu_octets"] += record.get("retenu_octets", 0)
+            entry["etapes"] += 1
+        return dict(sorted(totals.items(), key=lambda item: -item[1]["pic_max_octets"]))
+
+    def report(self, **info) -> dict:
+        report = {
+            "horodatage": self.started.isoformat(timespec="seconds") if self.started else None,
+            "python": platform.python_version(),
+            "plateforme": platform.platform(),
+            "pid": os.getpid(),
+            "pic_total_octets": self.peak_total,
+            "rss_pic_octets": self.rss_peak_total or None,  # RSS échantillonné pendant le profil
+            "rss_max_octets": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 if resource else None,
+            **info,
+            "etapes": self.stages,
+            "par_section": self._aggregate("section"),
+            "par_fichier": self._aggregate("fichier"),
+        }
+        return report
+
+    def save(self, **info) -> str:
+        """Écrit le profil en JSON (à joindre aux tickets d'incident) ; retourne son chemin"""
+        os.makedirs(Config.PROFILE_DIR, exist_ok=True)
+        path = os.path.join(Config.PROFILE_DIR, f"profil_memoire_{datetime.now():%Y%m%d_%H%M%S}_{os.getpid()}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(**info), f, ensure_ascii=False, indent=2)
+        return path
+
+
+@contextmanager
+def profile_stage(profiler: Optional[MemoryProfiler], name: str, **kwargs):
+    """Étape mesurée si un profileur est actif, sans effet sinon"""
+    if profiler is None:
+        yield None
+    else:
+        with profiler.stage(name, **kwargs) as record:
+            yield record
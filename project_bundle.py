@@ -0,0 +1,245 @@
+# =============================================================================
+# project_bundle.py - Portable project bundle (report + content-addressed assets)
+# =============================================================================
+#
+# Un projet est un zip :
+#   manifest.json   format, date, fichiers (empreinte SHA-256, nom, taille, inclus ou non)
+#   rapport.json    le rapport, chemins de fichiers remplacés par fichiers/<empreinte><ext>
+#   fichiers/...    chaque contenu une seule fois, quel que soit le nombre de références
+#
+# Un projet différentiel omet les fichiers que le destinataire possède déjà (d'après son
+# inventaire ou le manifest d'un projet qu'il a reçu) ; à l'import, un fichier déjà
+# présent dans l'upload store n'est ni extrait ni relu.
+
+import json
+import os
+import re
+import zipfile
+from datetime import datetime
+from typing import Dict, Iterable, List, Tuple
+
+import streamlit as st
+
+from config import Config
+from docx_package import STORED_EXTENSIONS
+from upload_store import UploadQuotaError, is_stored, object_path, store_stream, stored_digests
+from utils import file_sha256, json_dumps, json_loads
+
+BUNDLE_FORMAT = "rapport-manoeuvrabilite-projet"
+BUNDLE_VERSION = 1
+MANIFEST = "manifest.json"
+REPORT_ENTRY = "rapport.json"
+FILES_DIR = "fichiers"
+INVENTORY_FORMAT = "rapport-manoeuvrabilite-inventaire"
+
+_DIGEST = re.compile(r"^[0-9a-f]{64}$")
+
+
+def _is_file_reference(value) -> bool:
+    """Chaîne du rapport désignant un fichier local (chemin, figure, planche, tableau...)"""
+    return (isinstance(value, str) and 0 < len(value) < 1024 and "\n" not in value
+            and os.path.splitext(value)[1] != "" and os.path.isfile(value))
+
+
+def _map_paths(data, mapping: Dict[str, str]):
+    if isinstance(data, dict):
+        return {k: _map_paths(v, mapping) for k, v in data.items()}
+    if isinstance(data, list):
+        return [_map_paths(item, mapping) for item in data]
+    if isinstance(data, str) and data in mapping:
+        return mapping[data]
+    return data
+
+
+def _collect(data, found: Dict[str, None]) -> None:
+    if isinstance(data, dict):
+        for value in data.values():
+            _collect(value, found)
+    elif isinstance(data, list):
+        for value in data:
+            _collect(value, found)
+    elif _is_file_reference(data):
+        found.setdefault(data)
+
+
+def _digest(path: str) -> str:
+    """Empreinte du contenu ; celle d'un fichier de l'upload store est son nom"""
+    if is_stored(path):
+        return os.path.splitext(os.path.basename(path))[0]
+    return file_sha256(path)
+
+
+def known_digests(raw) -> set:
+    """Empreintes déjà possédées par le destinataire : inventaire ou manifest d'un projet reçu"""
+    data = json_loads(raw)
+    if isinstance(data, dict) and data.get("format") == INVENTORY_FORMAT:
+        digests = data.get("empreintes") or []
+    elif isinstance(data, dict) and data.get("format") == BUNDLE_FORMAT:
+        digests = [f.get("empreinte") for f in data.get("fichiers") or [] if f.get("inclus", True)]
+    else:
+        raise ValueError("Ni un inventaire ni un manifest de projet")
+    return {d for d in digests if isinstance(d, str) and _DIGEST.match(d)}
+
+
+def local_inventory() -> bytes:
+    """Inventaire des fichiers de ce poste, à envoyer à l'expéditeur d'un projet différentiel"""
+    return json_dumps({
+        "format": INVENTORY_FORMAT,
+        "cree_le": datetime.now().isoformat(timespec="seconds"),
+        "empreintes": sorted(stored_digests()),
+    }, compact=True)
+
+
+def build_bundle(rapport: dict, output_path: str, known: Iterable[str] = ()) -> dict:
+    """
+    Écrit le projet (rapport + fichiers référencés) dans output_path.
+    known : empreintes que le destinataire possède déjà, listées sans être incluses.
+    Retourne les statistiques du projet.
+    """
+    known = set(known)
+    paths: Dict[str, None] = {}
+    _collect(rapport, paths)
+
+    files: Dict[str, dict] = {}      # empreinte -> entrée du manifest
+    mapping: Dict[str, str] = {}     # chemin local -> chemin dans le projet
+    for path in paths:
+        digest = _digest(path)
+        ext = os.path.splitext(path)[1].lower()
+        entry = files.setdefault(digest, {
+            "empreinte": digest,
+            "nom": os.path.basename(path),
+            "taille": os.path.getsize(path),
+            "archive": f"{FILES_DIR}/{digest}{ext}",
+            "inclus": digest not in known,
+            "source": path,
+        })
+        mapping[path] = entry["archive"]
+
+    manifest = {
+        "format": BUNDLE_FORMAT,
+        "version": BUNDLE_VERSION,
+        "cree_le": datetime.now().isoformat(timespec="seconds"),
+        "titre": (rapport.get("metadonnees") or {}).get("titre", ""),
+        "rapport": REPORT_ENTRY,
+        "fichiers": [{k: v for k, v in entry.items() if k != "source"} for entry in files.values()],
+    }
+
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    try:
+        with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED, allowZip64=True) as z:
+            z.writestr(MANIFEST, json.dumps(manifest, ensure_ascii=False, indent=2))
+            report = {**_map_paths(rapport, mapping), "_schema": Config.REPORT_SCHEMA_VERSION}
+            z.writestr(REPORT_ENTRY, json_dumps(report))
+            for entry in files.values():
+                if entry["inclus"]:
+                    compress = zipfile.ZIP_STORED if entry["archive"].endswith(STORED_EXTENSIONS) else zipfile.ZIP_DEFLATED
+                    z.write(entry["source"], entry["archive"], compress_type=compress)
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    included = [e for e in files.values() if e["inclus"]]
+    return {
+        "fichiers": len(files),
+        "inclus": len(included),
+        "omis": len(files) - len(included),
+        "octets_inclus": sum(e["taille"] for e in included),
+        "octets_omis": sum(e["taille"] for e in files.values() if not e["inclus"]),
+    }
+
+
+def unpack_bundle(source, namespace: str) -> Tuple[dict, List[str], dict]:
+    """
+    Lit un projet (chemin ou fichier) : les fichiers absents de l'upload store y sont
+    enregistrés (empreinte et taille vérifiées), les autres seulement référencés.
+    Retourne (rapport avec chemins locaux, avertissements, statistiques) ; lève ValueError
+    si l'archive n'est pas un projet valide.
+    """
+    try:
+        z = zipfile.ZipFile(source)
+    except zipfile.BadZipFile as e:
+        raise ValueError(f"Archive illisible : {e}")
+    with z:
+        names = set(z.namelist())
+        if MANIFEST not in names:
+            raise ValueError("manifest.json absent : ce zip n'est pas un projet exporté")
+        manifest = json_loads(z.read(MANIFEST))
+        if manifest.get("format") != BUNDLE_FORMAT:
+            raise ValueError("manifest.json ne décrit pas un projet de rapport")
+        if manifest.get("version", 0) > BUNDLE_VERSION:
+            raise ValueError(f"Projet au format {manifest['version']}, plus récent que celui de l'application")
+        report_entry = manifest.get("rapport") or REPORT_ENTRY
+        if report_entry not in names:
+            raise ValueError(f"{report_entry} absent du projet")
+
+        warnings: List[str] = []
+        stats = {"fichiers": 0, "deja_presents": 0, "extraits": 0, "octets_extraits": 0}
+        mapping: Dict[str, str] = {}
+        for entry in manifest.get("fichiers") or []:
+            digest, name, archive = entry.get("empreinte", ""), entry.get("nom") or "", entry.get("archive")
+            if not _DIGEST.match(str(digest)) or not archive:
+                warnings.append(f"Entrée du manifest ignorée : {name or archive}")
+                continue
+            stats["fichiers"] += 1
+            existing = object_path(digest, archive)
+            if os.path.exists(existing):
+                mapping[archive] = existing
+                stats["deja_presents"] += 1
+            elif archive in names:
+                try:
+                    with z.open(archive) as stream:
+                        mapping[archive] = store_stream(stream, name, namespace, digest, entry.get("taille"))
+                except UploadQuotaError as e:
+                    mapping[archive] = ""
+                    warnings.append(f"{name} : {e}")
+                    continue
+                stats["extraits"] += 1
+                stats["octets_extraits"] += entry.get("taille") or 0
+            else:
+                mapping[archive] = ""
+                warnings.append(f"Fichier absent du projet et de ce poste : {name}")
+
+        rapport = json_loads(z.read(report_entry))
+    if not isinstance(rapport, dict):
+        raise ValueError("rapport.json ne contient pas un objet JSON")
+    return _map_paths(rapport, mapping), warnings, stats
+
+
+def render_bundle_panel(rapport: dict) -> None:
+    """Onglet Export : projet portable, éventuellement différentiel, et inventaire de ce poste"""
+    with st.expander("📦 Projet portable (rapport + fichiers)"):
+        st.caption("Le rapport et tous les fichiers qu'il référence, chacun stocké une seule fois. "
+                   "Avec l'inventaire du destinataire, seuls les fichiers qu'il n'a pas encore sont inclus ; "
+                   "le projet s'importe depuis « 📤 Importer un rapport ».")
+        inventory = st.file_uploader(
+            "Inventaire du destinataire ou manifest d'un projet déjà envoyé (facultatif)",
+            type=["json"], key="bundle_inventaire"
+        )
+        col1, col2 = st.columns(2)
+        if col1.button("📦 Préparer le projet", key="bundle_preparer"):
+            try:
+                known = known_digests(inventory.getvalue()) if inventory is not None else set()
+            except ValueError as e:
+                st.error(f"❌ Inventaire illisible : {e}")
+                return
+            filename = f"projet_{datetime.now():%Y%m%d_%H%M%S}.zip"
+            path = os.path.join(Config.OUTPUT_DIR, filename)
+            with st.spinner("Préparation du projet..."):
+                stats = build_bundle(rapport, path, known)
+            st.session_state._bundle = (path, filename, stats)
+        col2.download_button(
+            "🧾 Inventaire de ce poste", local_inventory, file_name="inventaire.json",
+            mime="application/json", on_click="ignore",
+            help="À envoyer à l'expéditeur pour ne recevoir que les fichiers manquants"
+        )
+
+        bundle = st.session_state.get("_bundle")
+        if bundle and os.path.exists(bundle[0]):
+            path, filename, stats = bundle
+            st.success(f"✅ {stats['inclus']} fichier(s) inclus ({stats['octets_inclus'] / 1e6:.1f} Mo), "
+                       f"{stats['omis']} déjà chez le destinataire ({stats['octets_omis'] / 1e6:.1f} Mo évités)")
+            with open(path, "rb") as f:
+                st.download_button("📥 Télécharger le projet", f, file_name=filename,
+                                   mime="application/zip", key="bundle_telecharger")
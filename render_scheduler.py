@@ -0,0 +1,143 @@
+# =============================================================================
+# render_scheduler.py - Process-wide admission control for report generation
+# =============================================================================
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+from config import Config
+
+
+class _Ticket:
+    __slots__ = ("estimate", "enqueued", "wait", "ok")
+
+    def __init__(self, estimate: int):
+        self.estimate = estimate
+        self.enqueued = time.monotonic()
+        self.wait = 0.0
+        self.ok = True
+
+    def failed(self) -> None:
+        """Génération terminée sans exception mais sans résultat : comptée comme un échec"""
+        self.ok = False
+
+
+class RenderScheduler:
+    """
+    Limite le nombre de générations simultanées et la mémoire qu'elles réservent
+    (octets d'images décodées estimés). Les demandes sont servies dans l'ordre
+    d'arrivée : une génération n'en dépasse jamais une autre dans la file.
+    """
+
+    def __init__(self, max_concurrent: int, memory_budget: int):
+        self.max_concurrent = max_concurrent
+        self.memory_budget = memory_budget
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._running = 0
+        self._reserved = 0
+        self._waits = deque(maxlen=500)
+        self._durations = deque(maxlen=500)
+        self._max_depth = 0
+        self._admitted = 0
+        self._failed = 0
+
+    def _can_admit(self, ticket: _Ticket) -> bool:
+        if self._queue[0] is not ticket or self._running >= self.max_concurrent:
+            return False
+        # Une génération plus grosse que le budget passe seule plutôt que jamais
+        return self._running == 0 or self._reserved + ticket.estimate <= self.memory_budget
+
+    @contextmanager
+    def slot(self, estimate: int, on_wait: Optional[Callable[[int, int], None]] = None, poll: float = 0.5):
+        """
+        Attend son tour puis réserve une place et `estimate` octets pendant le bloc ; produit
+        le ticket, dont failed() signale un échec rapporté sans exception.
+        on_wait(position, longueur de file) est appelé pendant l'attente (hors verrou).
+        """
+        ticket = _Ticket(estimate)
+        with self._cond:
+            self._queue.append(ticket)
+            self._max_depth = max(self._max_depth, len(self._queue))
+
+        admitted = False
+        try:
+            while True:
+                with self._cond:
+                    if self._can_admit(ticket):
+                        self._queue.popleft()
+                        self._running += 1
+                        self._reserved += estimate
+                        self._admitted += 1
+                        ticket.wait = time.monotonic() - ticket.enqueued
+                        self._waits.append(ticket.wait)
+                        admitted = True
+                        self._cond.notify_all()  # le suivant tient peut-être aussi
+                        break
+                    position, depth = self._queue.index(ticket) + 1, len(self._queue)
+                if on_wait is not None:
+                    on_wait(position, depth)
+                with self._cond:
+                    self._cond.wait(timeout=poll)
+
+            started = time.monotonic()
+            ok = False
+            try:
+                yield ticket
+                ok = ticket.ok
+            finally:
+                duration = time.monotonic() - started
+                with self._cond:
+                    self._durations.append(duration)
+                    if not ok:
+                        self._failed += 1
+                self._log(ticket, duration, ok)
+        finally:
+            with self._cond:
+                if admitted:
+                    self._running -= 1
+                    self._reserved -= estimate
+                else:
+                    # Session fermée ou erreur pendant l'attente : on quitte la file
+                    self._queue.remove(ticket)
+                self._cond.notify_all()
+
+    def _log(self, ticket: _Ticket, duration: float, ok: bool) -> None:
+        """Une ligne JSON par génération, pour le dimensionnement du serveur"""
+        entry = {
+            "horodatage": time.time(),
+            "attente_s": round(ticket.wait, 3),
+            "duree_s": round(duration, 3),
+            "memoire_estimee": ticket.estimate,
+            "succes": ok,
+        }
+        os.makedirs(os.path.dirname(Config.RENDER_METRICS_LOG), exist_ok=True)
+        with open(Config.RENDER_METRICS_LOG, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry) + "\n")
+
+    def metrics(self) -> dict:
+        with self._cond:
+            waits = sorted(self._waits)
+            durations = list(self._durations)
+            return {
+                "en_cours": self._running,
+                "max_simultanes": self.max_concurrent,
+                "memoire_reservee": self._reserved,
+                "budget_memoire": self.memory_budget,
+                "file_attente": len(self._queue),
+                "file_attente_max": self._max_depth,
+                "generations": self._admitted,
+                "echecs": self._failed,
+                "attente_moyenne_s": round(sum(waits) / len(waits), 2) if waits else 0.0,
+                "attente_p95_s": round(waits[int(0.95 * (len(waits) - 1))], 2) if waits else 0.0,
+                "duree_moyenne_s": round(sum(durations) / len(durations), 2) if durations else 0.0,
+            }
+
+
+# Partagé par toutes les sessions Streamlit du processus
+RENDER_SCHEDULER = RenderScheduler(Config.RENDER_MAX_CONCURRENT, Config.RENDER_MEMORY_BUDGET)
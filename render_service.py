@@ -0,0 +1,371 @@
+# =============================================================================
+# render_service.py - Local HTTP service for report generation (warm render workers)
+# =============================================================================
+#
+# Usage : python render_service.py [--port 8765] [--workers 2]
+#
+#   POST /fichiers?nom=planche.png   corps : contenu du fichier (lu par blocs)
+#        -> {"chemin": "..."} à utiliser dans rapport.json (upload store, dédupliqué)
+#   POST /envois?nom=trajectoires.csv&taille=N[&empreinte=sha256]
+#        -> {"id": ..., "recu": 0}        envoi par morceaux des fichiers volumineux
+#        (507 dès l'ouverture si le fichier ne tient pas dans les quotas de stockage)
+#   PUT  /envois/<id>?position=P     corps : morceau suivant -> {"recu": ...}
+#        (409 avec "recu" si la position ne correspond pas : reprendre à cette position)
+#   GET  /envois/<id>                -> état de l'envoi (reprise après coupure)
+#   POST /envois/<id>/fin            -> {"chemin": ...} ; l'identifiant se colle dans le formulaire
+#   POST /rapports                   corps : rapport.json, ou {"rapport": {...},
+#        "template": "report_template.docx", "options": {...}, "taille_max": octets}
+#        -> le DOCX (en-têtes X-Duree-Rendu, X-Attente)
+#   GET  /sante                      -> état des processus, file d'attente, latences
+#   GET  /cache                      -> cache partagé : taux de succès par espace, occupation
+#
+# Les processus de rendu restent démarrés : templates nettoyés et compilés, index des
+# images et dérivés restent chauds d'une requête à l'autre ; dérivés et rendus sont aussi
+# repris du cache partagé entre répliques (shared_cache.py). Le service n'écoute que
+# sur l'interface locale ; les chemins d'images du rapport sont lus tels quels.
+
+import argparse
+import json
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+from jinja2.exceptions import TemplateError
+
+from config import Config
+from ingest import UploadOffsetError, append_chunk, finish_upload, start_upload, upload_status
+from shared_cache import shared_cache
+from upload_store import UploadQuotaError, store_stream
+
+DOCX_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+
+class RenderRequestError(ValueError):
+    """Requête de rendu invalide (rapport illisible, template inconnu...)"""
+
+
+class QueueFullError(Exception):
+    """File d'attente du service pleine"""
+
+
+class PayloadTooLargeError(Exception):
+    """Corps de requête au-delà de la taille acceptée"""
+
+
+def _warm_worker(templates) -> None:
+    """(processus de rendu) Importe la chaîne d'export et prépare les templates au démarrage"""
+    import report_import  # noqa: F401
+    import word_export  # noqa: F401
+    from template_index import warm_template
+
+    for template_path in templates:
+        warm_template(template_path)
+
+
+def _render_job(rapport, template_path: str, options: dict, max_size_bytes: Optional[int]):
+    """(processus de rendu) Prépare le contexte et rend le rapport ; retourne (docx, durée)"""
+    from report_import import migrate_report, validate_schema
+    from word_export import prepare_context_for_template, render_variant, replace_all_images
+
+    start = time.perf_counter()
+    # Mêmes contrôles qu'à l'import d'un rapport.json dans l'application
+    errors = validate_schema(rapport)
+    if not errors:
+        rapport, _ = migrate_report(rapport)
+        errors = validate_schema(rapport)
+    if errors:
+        raise RenderRequestError("Structure du rapport invalide : " + " ; ".join(errors))
+    try:
+        context = prepare_context_for_template(rapport)
+    except (AttributeError, KeyError, TypeError) as e:
+        raise RenderRequestError(f"Rapport incohérent : {type(e).__name__} {e}")
+    used_images = {}
+    context = replace_all_images(context, None, used_images=used_images)
+    try:
+        data, _ = render_variant(context, template_path, options, max_size_bytes, used_images)
+    except TemplateError as e:
+        # Rapport conforme au schéma mais incomplet pour le template (section absente...)
+        raise RenderRequestError(f"Rapport incomplet pour le template : {type(e).__name__} {e}")
+    return data, time.perf_counter() - start
+
+
+def template_path(name: Optional[str]) -> str:
+    """Template demandé, limité au dossier templates/"""
+    path = os.path.join(Config.SERVICE_TEMPLATES_DIR, os.path.basename(name or Config.SERVICE_DEFAULT_TEMPLATE))
+    if not os.path.isfile(path):
+        raise RenderRequestError(f"Template inconnu : {os.path.basename(path)}")
+    return path
+
+
+class RenderService:
+    """Pool de processus de rendu gardés chauds, avec file d'attente bornée et statistiques"""
+
+    def __init__(self, workers: int = Config.SERVICE_WORKERS, queue_max: int = Config.SERVICE_QUEUE_MAX,
+                 timeout: float = Config.SERVICE_TIMEOUT):
+        self.workers, self.queue_max, self.timeout = workers, queue_max, timeout
+        templates = [os.path.join(Config.SERVICE_TEMPLATES_DIR, Config.SERVICE_DEFAULT_TEMPLATE)]
+        self._pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                         initializer=_warm_worker, initargs=(templates,))
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._latencies = deque(maxlen=500)
+        self._waits = deque(maxlen=500)
+        self._counts = {"requetes": 0, "succes": 0, "erreurs": 0, "refusees": 0, "delais_depasses": 0}
+        self.started = time.time()
+        # Démarre tous les processus maintenant plutôt qu'à la première requête
+        for future in [self._pool.submit(int, 0) for _ in range(workers)]:
+            future.result()
+
+    def _count(self, key: str) -> None:
+        with self._lock:
+            self._counts[key] += 1
+
+    def render(self, rapport, template: str, options: dict, max_size_bytes: Optional[int]):
+        """
+        Rend un rapport ; retourne (docx, durée du rendu, attente en file).
+        Lève QueueFullError si la file est pleine, TimeoutError au-delà du délai.
+        """
+        with self._lock:
+            self._counts["requetes"] += 1
+            if self._in_flight >= self.workers + self.queue_max:
+                self._counts["refusees"] += 1
+                raise QueueFullError(f"File d'attente pleine ({self.queue_max} requêtes en attente)")
+            self._in_flight += 1
+        start = time.perf_counter()
+        try:
+            future = self._pool.submit(_render_job, rapport, template, options, max_size_bytes)
+        except BaseException:
+            self._release()
+            raise
+        # Un rendu n'est plus compté qu'une fois réellement terminé (ou retiré de la file) :
+        # après un délai dépassé, le processus qui le traite reste occupé
+        future.add_done_callback(lambda _: self._release())
+        try:
+            data, duration = future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            future.cancel()  # encore en file : retiré ; déjà en cours : son résultat sera ignoré
+            self._count("delais_depasses")
+            raise TimeoutError(f"Rendu non terminé après {self.timeout:g} s")
+        except Exception:
+            self._count("erreurs")
+            raise
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._counts["succes"] += 1
+            self._latencies.append(elapsed)
+            self._waits.append(max(0.0, elapsed - duration))
+        return data, duration, max(0.0, elapsed - duration)
+
+    def _release(self) -> None:
+        with self._lock:
+            self._in_flight -= 1
+
+    def health(self) -> dict:
+        with self._lock:
+            latencies = sorted(self._latencies)
+            waits = list(self._waits)
+
+            def percentile(q):
+                return round(latencies[int(q * (len(latencies) - 1))], 3) if latencies else 0.0
+
+            return {
+                "statut": "ok",
+                "demarre_depuis_s": round(time.time() - self.started),
+                "processus": self.workers,
+                "en_cours": min(self._in_flight, self.workers),
+                "en_attente": max(0, self._in_flight - self.workers),
+                "file_max": self.queue_max,
+                "delai_max_s": self.timeout,
+                **self._counts,
+                "latence_p50_s": percentile(0.5),
+                "latence_p95_s": percentile(0.95),
+                "attente_moyenne_s": round(sum(waits) / len(waits), 3) if waits else 0.0,
+            }
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(cancel_futures=True)
+
+
+class _BodyReader:
+    """Corps de requête lu par blocs, borné à Content-Length"""
+
+    def __init__(self, rfile, length: int):
+        self.rfile, self.remaining = rfile, length
+
+    def read(self, size: int = -1) -> bytes:
+        if self.remaining <= 0:
+            return b""
+        size = self.remaining if size < 0 else min(size, self.remaining)
+        data = self.rfile.read(size)
+        self.remaining -= len(data)
+        return data
+
+
+class _Handler(BaseHTTPRequestHandler):
+    service: RenderService = None
+
+    def _send(self, status: int, body: bytes, content_type: str, headers: Optional[dict] = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _json(self, status: int, payload: dict, headers: Optional[dict] = None) -> None:
+        self._send(status, json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+                   "application/json; charset=utf-8", headers)
+
+    def _body_reader(self, max_bytes: int) -> _BodyReader:
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > max_bytes:
+            raise PayloadTooLargeError(f"Corps de requête trop volumineux ({length} octets, max {max_bytes})")
+        return _BodyReader(self.rfile, length)
+
+    def _body(self, max_bytes: int) -> bytes:
+        return self._body_reader(max_bytes).read()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/sante":
+            self._json(200, self.service.health())
+        elif url.path == "/cache":
+            self._json(200, shared_cache().stats())
+        elif url.path.startswith("/envois/"):
+            self._dispatch(lambda: self._json(200, upload_status(url.path.split("/")[2])))
+        else:
+            self._json(404, {"erreur": "Ressource inconnue"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path == "/fichiers":
+            self._dispatch(lambda: self._post_file(query))
+        elif url.path == "/rapports":
+            self._dispatch(self._post_report)
+        elif url.path == "/envois":
+            self._dispatch(lambda: self._post_upload(query))
+        elif url.path.startswith("/envois/") and url.path.endswith("/fin"):
+            self._dispatch(lambda: self._json(200, finish_upload(url.path.split("/")[2])))
+        else:
+            self._json(404, {"erreur": "Ressource inconnue"})
+
+    def do_PUT(self):
+        url = urlparse(self.path)
+        if url.path.startswith("/envois/"):
+            self._dispatch(lambda: self._put_chunk(url.path.split("/")[2], parse_qs(url.query)))
+        else:
+            self._json(404, {"erreur": "Ressource inconnue"})
+
+    def _dispatch(self, handler) -> None:
+        try:
+            handler()
+        except UploadOffsetError as e:
+            self._json(409, {"erreur": str(e), "recu": e.received})
+        except (RenderRequestError, ValueError) as e:
+            self._json(400, {"erreur": str(e)})
+        except QueueFullError as e:
+            self._json(503, {"erreur": str(e)}, {"Retry-After": "5"})
+        except PayloadTooLargeError as e:
+            self._json(413, {"erreur": str(e)})
+        except UploadQuotaError as e:
+            self._json(507, {"erreur": str(e)})
+        except TimeoutError as e:
+            self._json(504, {"erreur": str(e)})
+        except Exception as e:
+            self._json(500, {"erreur": f"{type(e).__name__} : {e}"})
+
+    def _post_file(self, query: dict) -> None:
+        name = os.path.basename((query.get("nom") or [""])[0])
+        if not name:
+            raise RenderRequestError("Paramètre nom manquant")
+        length = int(self.headers.get("Content-Length") or 0)
+        path = store_stream(self._body_reader(Config.SERVICE_MAX_FILE_BYTES), name, Config.SERVICE_NAMESPACE,
+                            expected_size=length)
+        self._json(201, {"chemin": path})
+
+    def _post_upload(self, query: dict) -> None:
+        def param(name):
+            return (query.get(name) or [None])[0]
+        try:
+            size = int(param("taille") or 0)
+        except ValueError:
+            raise RenderRequestError("Paramètre taille invalide")
+        self._json(201, start_upload(param("nom"), size, param("empreinte")))
+
+    def _put_chunk(self, upload_id: str, query: dict) -> None:
+        try:
+            offset = int((query.get("position") or ["0"])[0])
+        except ValueError:
+            raise RenderRequestError("Paramètre position invalide")
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self._body_reader(Config.INGEST_CHUNK_MAX_BYTES)
+        try:
+            status = append_chunk(upload_id, offset, body, length)
+        except ValueError:
+            # Morceau refusé : il est lu et ignoré pour que le client reçoive la réponse
+            for _ in iter(lambda: body.read(1024 * 1024), b""):
+                pass
+            raise
+        self._json(200, status)
+
+    def _post_report(self) -> None:
+        try:
+            payload = json.loads(self._body(Config.SERVICE_MAX_REPORT_BYTES))
+        except ValueError as e:
+            raise RenderRequestError(f"JSON invalide : {e}")
+        if isinstance(payload, dict) and isinstance(payload.get("rapport"), dict):
+            rapport = payload["rapport"]
+            options = payload.get("options") or {}
+            template, max_size = payload.get("template"), payload.get("taille_max")
+        else:
+            rapport, options, template, max_size = payload, {}, None, None
+        if not isinstance(options, dict):
+            raise RenderRequestError("Paramètre options invalide (objet JSON attendu)")
+        if max_size is not None:
+            if isinstance(max_size, str) and max_size.strip().isdigit():
+                max_size = int(max_size)
+            if isinstance(max_size, bool) or not isinstance(max_size, int) or max_size <= 0:
+                raise RenderRequestError("Paramètre taille_max invalide (nombre entier d'octets positif attendu)")
+
+        data, duration, wait = self.service.render(rapport, template_path(template), options, max_size)
+        self._send(200, data, DOCX_MIME, {
+            "Content-Disposition": 'attachment; filename="rapport_manoeuvrabilite.docx"',
+            "X-Duree-Rendu": f"{duration:.3f}",
+            "X-Attente": f"{wait:.3f}",
+        })
+
+    def log_message(self, format, *args):
+        pass  # journal d'accès désactivé ; les statistiques sont sur /sante
+
+
+def serve(host: str = Config.SERVICE_HOST, port: int = Config.SERVICE_PORT,
+          workers: int = Config.SERVICE_WORKERS) -> None:
+    Config.setup_directories()
+    service = RenderService(workers)
+    handler = type("Handler", (_Handler,), {"service": service})
+    server = ThreadingHTTPServer((host, port), handler)
+    print(f"Service de rendu sur http://{host}:{port} ({workers} processus)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Service local de génération des rapports Word")
+    parser.add_argument("--host", default=Config.SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=Config.SERVICE_PORT)
+    parser.add_argument("--workers", type=int, default=Config.SERVICE_WORKERS)
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers)
@@ -0,0 +1,356 @@
+# =============================================================================
+# report_import.py - Import of a saved rapport.json (or project bundle) back into the session
+# =============================================================================
+
+import datetime
+import os
+from typing import Dict, List, Tuple
+
+import streamlit as st
+
+from config import Config
+from drafts import clear_report_state
+from forms import ETATS_CHARGE, EVENEMENTS_URGENCE
+from project_bundle import unpack_bundle
+from upload_store import UploadQuotaError, store_file
+from utils import json_loads, upload_namespace
+
+# Types attendus des sections (après migration) : {chemin: type}
+SCHEMA = {
+    "metadonnees": dict,
+    "metadonnees.historique_revisions": list,
+    "introduction": dict,
+    "donnees_entree": dict,
+    "donnees_entree.plan_de_masse.phases.phases": list,
+    "donnees_navires.navires.navires": list,
+    "donnees_navires.remorqueurs.remorqueurs": list,
+    "simulations.simulations": list,
+    "simulations.scenarios_urgence.scenarios": list,
+    "analyse_synthese": dict,
+    "recommandations": list,
+    "figures": list,
+    "tableaux": list,
+}
+
+
+def _get(data, path: str):
+    for segment in path.split("."):
+        if not isinstance(data, dict):
+            return None
+        data = data.get(segment)
+    return data
+
+
+def migrate_report(data: dict) -> Tuple[dict, List[str]]:
+    """Convertit un rapport d'une version antérieure du schéma ; retourne (rapport, notes)"""
+    notes = []
+    version = data.get("_schema", 1)
+    if version > Config.REPORT_SCHEMA_VERSION:
+        raise ValueError(f"Schéma {version} plus récent que celui de l'application ({Config.REPORT_SCHEMA_VERSION})")
+
+    if version < 2:
+        if "metadonnees_rapport" in data:
+            data["metadonnees"] = data.pop("metadonnees_rapport")
+            notes.append("metadonnees_rapport renommé en metadonnees")
+        metadata = data.get("metadonnees") or {}
+        code = metadata.pop("code_document", None)
+        if isinstance(code, dict):
+            metadata.update(code)
+            notes.append("code_document mis à plat dans metadonnees")
+        for old, new in (("type_doc", "type"), ("numero_doc", "numero"), ("annee_doc", "annee")):
+            if old in metadata:
+                metadata.setdefault(new, metadata.pop(old))
+        if isinstance(data.get("simulations"), list):
+            data["simulations"] = {"simulations": data["simulations"], "scenarios_urgence": {"scenarios": []}}
+            notes.append("liste de simulations convertie en section simulations")
+        navires = data.get("donnees_navires", {}).get("navires")
+        if isinstance(navires, list):
+            data["donnees_navires"]["navires"] = {"navires": navires}
+
+    data["_schema"] = Config.REPORT_SCHEMA_VERSION
+    return data, notes
+
+
+def validate_schema(data) -> List[str]:
+    """Erreurs de structure empêchant l'import (types des sections)"""
+    if not isinstance(data, dict):
+        return ["le fichier ne contient pas un objet JSON"]
+    errors = []
+    for path, expected in SCHEMA.items():
+        value = _get(data, path)
+        if value is not None and not isinstance(value, expected):
+            errors.append(f"{path} : {expected.__name__} attendu, {type(value).__name__} trouvé")
+    return errors
+
+
+class _FileResolver:
+    """Rattache les chemins d'images du rapport à l'upload store (une seule fois par fichier)"""
+
+    def __init__(self, namespace: str):
+        self.namespace = namespace
+        self.resolved: Dict[str, str] = {}
+        self.missing: List[str] = []
+        self.errors: List[str] = []
+
+    def __call__(self, path) -> str:
+        if not path:
+            return ""
+        if path in self.resolved:
+            return self.resolved[path]
+        candidates = [path, os.path.join(Config.UPLOAD_DIR, os.path.basename(path))]
+        stored = ""
+        for candidate in candidates:
+            if os.path.isfile(candidate):
+                try:
+                    stored = store_file(candidate, self.namespace)
+                except UploadQuotaError as e:
+                    self.errors.append(f"{path} : {e}")
+                break
+        else:
+            self.missing.append(path)
+        self.resolved[path] = stored
+        return stored
+
+    def files(self, path) -> List[dict]:
+        stored = self(path)
+        return [{"nom": os.path.basename(path), "chemin": stored}] if stored else []
+
+    def figures(self, state: dict, key: str, figures) -> None:
+        """Uploader multiple + légendes (handle_file_upload_with_legend)"""
+        stored = []
+        for fig in figures or []:
+            files = self.files(fig.get("chemin"))
+            if files:
+                state[f"{key}_legend_{len(stored)}"] = fig.get("legende", "")
+                stored.extend(files)
+        if stored:
+            state[f"{key}_path"] = stored
+
+
+def _comment(state: dict, prefix: str, text) -> None:
+    if text:
+        state[f"{prefix}_commentaire_actif"] = True
+        state[f"{prefix}_commentaire"] = text
+
+
+def _number(value) -> float:
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _date(value) -> datetime.date:
+    try:
+        return datetime.date.fromisoformat(str(value)[:10])
+    except ValueError:
+        return datetime.date.today()
+
+
+def report_to_state(data: dict, resolve: _FileResolver) -> dict:
+    """Clés de session (widgets, listes, chemins d'uploads) reproduisant le rapport dans les formulaires"""
+    state = {}
+
+    metadata = data.get("metadonnees") or {}
+    for key, field in (("meta_titre", "titre"), ("meta_projet", "projet"), ("meta_code_projet", "code_projet"),
+                       ("meta_type_etude", "type_etude"), ("meta_client", "client"), ("meta_type_doc", "type"),
+                       ("meta_numero_doc", "numero"), ("meta_annee_doc", "annee")):
+        if metadata.get(field) is not None:
+            state[key] = str(metadata[field])
+    for key, field in (("meta_image", "main_image"), ("meta_logo", "client_logo")):
+        files = resolve.files(metadata.get(field))
+        if files:
+            state[f"{key}_path"] = files
+    revisions = metadata.get("historique_revisions") or []
+    state["revisions"] = [{} for _ in revisions]
+    for i, rev in enumerate(revisions):
+        for field in ("version", "description", "auteur", "verificateur", "approbateur"):
+            state[f"rev_{field}_{i}"] = rev.get(field) or ""
+        state[f"rev_date_{i}"] = _date(rev.get("date"))
+
+    intro = data.get("introduction") or {}
+    state["intro_guidelines"] = intro.get("guidelines") or ""
+    state["intro_objectifs"] = intro.get("objectifs") or ""
+
+    entree = data.get("donnees_entree") or {}
+    masse = _get(entree, "plan_de_masse.phases") or {}
+    phases = masse.get("phases") or []
+    state["phases"] = [{} for _ in phases]
+    for i, phase in enumerate(phases):
+        state[f"phase_nom_{i}"] = phase.get("nom") or ""
+        state[f"phase_desc_{i}"] = phase.get("description") or ""
+        resolve.figures(state, f"phase_fig_{i}", phase.get("figures"))
+    _comment(state, "masse", masse.get("commentaire"))
+
+    bathy = entree.get("bathymetrie") or {}
+    state["bathy_source"] = bathy.get("source") or ""
+    state["bathy_date"] = bathy.get("date") or ""
+    state["bathy_notes"] = bathy.get("notes_profondeur") or ""
+    carte = (bathy.get("grille") or {}).get("carte")
+    resolve.figures(state, "bathy_fig", [f for f in bathy.get("figures") or [] if f.get("chemin") != carte])
+    _comment(state, "bathy", bathy.get("commentaire"))
+
+    conditions = entree.get("conditions_environnementales") or {}
+    state["conditions_vent"] = (conditions.get("vent") or [""])[0]
+    state["conditions_houle"] = (conditions.get("houle") or [""])[0]
+    state["conditions_maree"] = conditions.get("maree") or ""
+    _comment(state, "conditions", conditions.get("commentaire"))
+
+    agitation = entree.get("etude_agitation") or {}
+    if agitation.get("actif"):
+        state["agitation_actif"] = True
+        generated = {f.get("chemin") for f in (agitation.get("statistiques") or {}).get("figures", [])}
+        resolve.figures(state, "agitation_fig", [f for f in agitation.get("figures") or [] if f.get("chemin") not in generated])
+        tables = [f for path in agitation.get("tableaux") or [] for f in resolve.files(path)]
+        if tables:
+            state["agitation_tables_path"] = tables
+        _comment(state, "agitation", agitation.get("commentaire"))
+
+    ships = data.get("donnees_navires") or {}
+    navires = _get(ships, "navires.navires") or []
+    state["navires"] = [{} for _ in navires]
+    for i, nav in enumerate(navires):
+        for key, field in (("nom", "nom"), ("type", "type"), ("propulsion", "propulsion"),
+                           ("puissance", "puissance_machine"), ("remarque", "remarques")):
+            state[f"nav_{key}_{i}"] = str(nav.get(field) or "")
+        for key, field in (("longueur", "longueur"), ("largeur", "largeur"), ("tir_av", "tirant_eau_av"),
+                           ("tir_ar", "tirant_eau_ar"), ("deplacement", "deplacement")):
+            state[f"nav_{key}_{i}"] = _number(nav.get(field))
+        if nav.get("etat_de_charge") in ETATS_CHARGE:
+            state[f"nav_etat_{i}"] = nav["etat_de_charge"]
+        state[f"nav_role_{i}"] = "actif" if nav.get("est_actif", True) else "passif"
+        files = resolve.files(nav.get("figure"))
+        if files:
+            state[f"nav_img_{i}_path"] = files
+    _comment(state, "nav", _get(ships, "navires.commentaire"))
+
+    remorqueurs = _get(ships, "remorqueurs.remorqueurs") or []
+    state["remorqueurs"] = [{} for _ in remorqueurs]
+    for i, rem in enumerate(remorqueurs):
+        for key, field in (("nom", "nom"), ("type", "type"), ("remarque", "remarques")):
+            state[f"rem_{key}_{i}"] = str(rem.get(field) or "")
+        for key, field in (("longueur", "longueur"), ("lbp", "lbp"), ("largeur", "largeur"), ("tirant", "tirant_eau"),
+                           ("vitesse", "vitesse"), ("traction", "traction")):
+            state[f"rem_{key}_{i}"] = _number(rem.get(field))
+        files = resolve.files(rem.get("figure"))
+        if files:
+            state[f"rem_img_{i}_path"] = files
+    _comment(state, "rem", _get(ships, "remorqueurs.commentaire"))
+
+    sims = data.get("simulations") or {}
+    simulations = sims.get("simulations") or []
+    state["simulations"] = [{} for _ in simulations]
+    for i, sim in enumerate(simulations):
+        state[f"sim_navire_{i}"] = str(sim.get("navire") or "")
+        state[f"sim_manoeuvre_{i}"] = str(sim.get("manoeuvre") or "")
+        state[f"sim_vent_{i}"] = str((sim.get("conditions_env") or {}).get("vent") or "")
+        state[f"sim_success_{i}"] = sim.get("resultat") == "Réussite"
+        state[f"sim_comment_{i}"] = sim.get("commentaire_pilote") or ""
+        files = resolve.files((sim.get("images") or {}).get("planche"))
+        if files:
+            state[f"sim_img_{i}_path"] = files
+
+    urgence = sims.get("scenarios_urgence") or {}
+    scenarios = urgence.get("scenarios") or []
+    state["scenarios"] = [{} for _ in scenarios]
+    for i, scen in enumerate(scenarios):
+        if scen.get("evenement") in EVENEMENTS_URGENCE:
+            state[f"evenement_{i}"] = scen["evenement"]
+        state[f"analyse_scenario_{i}"] = scen.get("analyse") or ""
+        files = resolve.files(scen.get("figure"))
+        if files:
+            state[f"scen_img_{i}_path"] = files
+    _comment(state, "scen", urgence.get("commentaire"))
+
+    analyse = data.get("analyse_synthese") or {}
+    state["analyse_conditions"] = "\n".join(analyse.get("conditions_critiques") or [])
+    state["analyse_distances"] = analyse.get("distances_trajectoires") or ""
+    _comment(state, "analyse", analyse.get("commentaire"))
+
+    state["conclusion_synthese"] = data.get("synthese_redigee") or ""
+    state["conclusion_texte"] = data.get("conclusion") or ""
+    state["conclusion_recommandations"] = "\n".join(data.get("recommandations") or [])
+
+    resolve.figures(state, "annexes_fig", data.get("figures"))
+    tableaux = data.get("tableaux") or []
+    state["tableaux"] = ["" for _ in tableaux]
+    for i, path in enumerate(tableaux):
+        files = resolve.files(path)
+        if files:
+            state[f"table_file_{i}_path"] = files
+
+    return state
+
+
+def import_report(raw, namespace: str) -> Tuple[dict, List[str]]:
+    """
+    Analyse, valide et migre un rapport.json (contenu brut ou déjà décodé), puis calcule
+    l'état de session correspondant.
+    Retourne (état, avertissements) ; lève ValueError si la structure est invalide.
+    """
+    try:
+        data = raw if isinstance(raw, dict) else json_loads(raw)
+    except ValueError as e:
+        raise ValueError(f"JSON illisible : {e}")
+    errors = validate_schema(data)
+    if errors:
+        raise ValueError("Structure du rapport invalide : " + " ; ".join(errors))
+    data, notes = migrate_report(data)
+    errors = validate_schema(data)
+    if errors:
+        raise ValueError("Structure du rapport invalide : " + " ; ".join(errors))
+
+    resolve = _FileResolver(namespace)
+    state = report_to_state(data, resolve)
+    warnings = notes + [f"Fichier introuvable : {path}" for path in resolve.missing] + resolve.errors
+    if (data.get("donnees_entree") or {}).get("bathymetrie", {}).get("grille"):
+        warnings.append("La grille bathymétrique doit être rechargée (fichier de sondes non inclus dans le JSON)")
+    if (data.get("donnees_entree") or {}).get("etude_agitation", {}).get("statistiques"):
+        warnings.append("Les séries Hs/Tp de l'étude d'agitation doivent être rechargées")
+    return state, warnings
+
+
+def _import_callback() -> None:
+    uploaded = st.session_state.get("_import_json")
+    if uploaded is None:
+        return
+    # Nouveau brouillon (créé à la prochaine sauvegarde) : fichiers rattachés à la session
+    st.session_state.draft_id = None
+    bundle_stats = None
+    try:
+        if uploaded.name.lower().endswith(".zip"):
+            # Projet exporté : fichiers déjà présents sur ce poste ni extraits ni relus
+            data, bundle_warnings, bundle_stats = unpack_bundle(uploaded, upload_namespace())
+            state, warnings = import_report(data, upload_namespace())
+            warnings = bundle_warnings + warnings
+        else:
+            state, warnings = import_report(uploaded.getvalue(), upload_namespace())
+    except ValueError as e:
+        st.session_state._import_result = ("error", str(e), [])
+        return
+    clear_report_state()
+    st.query_params.pop("brouillon", None)
+    st.session_state.update(state)
+    counts = f"{len(state['navires'])} navire(s), {len(state['simulations'])} simulation(s)"
+    if bundle_stats:
+        counts += (f" ; {bundle_stats['extraits']} fichier(s) extrait(s) "
+                   f"({bundle_stats['octets_extraits'] / 1e6:.1f} Mo), {bundle_stats['deja_presents']} déjà présent(s)")
+    st.session_state._import_result = ("success", f"Rapport importé : {counts}", warnings)
+
+
+def render_import_sidebar() -> None:
+    """Barre latérale : import d'un rapport.json"""
+    with st.sidebar:
+        st.subheader("📤 Importer un rapport", divider=True)
+        st.file_uploader("Fichier rapport.json ou projet (.zip)", type=["json", "zip"], key="_import_json")
+        st.button("📥 Charger dans le formulaire", on_click=_import_callback,
+                  disabled=st.session_state.get("_import_json") is None)
+
+        result = st.session_state.pop("_import_result", None)
+        if result:
+            level, message, warnings = result
+            getattr(st, level)(message)
+            if warnings:
+                with st.expander(f"⚠️ {len(warnings)} avertissement(s)"):
+                    for warning in warnings:
+                        st.write(f"- {warning}")
@@ -0,0 +1,247 @@
+# =============================================================================
+# revision_diff.py - Changes since the last exported revision (section fingerprints)
+# =============================================================================
+#
+# À chaque export, l'empreinte de chaque section du rapport, de chaque navire, remorqueur,
+# simulation et scénario est enregistrée. Le rapport en cours est comparé à la dernière
+# version exportée du même document : les changements sont listés et résumés pour la
+# description de la nouvelle révision. Les lots de simulations inchangés sont repris
+# du cache de rendu à l'export suivant (voir sharded_render).
+
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import List, Optional
+
+import streamlit as st
+
+from config import Config
+from upload_store import referenced_digests
+from utils import json_dumps
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS exports (
+    projet TEXT,
+    exporte_le REAL,
+    version TEXT,
+    fichier TEXT,
+    empreintes TEXT,
+    fichiers TEXT,
+    PRIMARY KEY (projet, exporte_le)
+);
+"""
+
+SECTION_LABELS = {
+    "metadonnees": "Métadonnées",
+    "introduction": "Introduction",
+    "donnees_entree": "Données d'entrée",
+    "donnees_navires": "Commentaires navires et remorqueurs",
+    "simulations": "Commentaire des scénarios d'urgence",
+    "analyse_synthese": "Analyse",
+    "synthese_redigee": "Synthèse rédigée",
+    "conclusion": "Conclusion",
+    "recommandations": "Recommandations",
+    "figures": "Figures annexes",
+    "tableaux": "Tableaux annexes",
+}
+
+# Listes suivies élément par élément : (nom, chemin dans le rapport, libellé au singulier)
+ITEM_LISTS = (
+    ("navires", ("donnees_navires", "navires", "navires"), "navire"),
+    ("remorqueurs", ("donnees_navires", "remorqueurs", "remorqueurs"), "remorqueur"),
+    ("simulations", ("simulations", "simulations"), "simulation"),
+    ("scenarios", ("simulations", "scenarios_urgence", "scenarios"), "scénario"),
+)
+
+
+def _digest(value) -> str:
+    return hashlib.sha1(json_dumps(value, compact=True)).hexdigest()
+
+
+def _item_label(kind: str, index: int, item) -> str:
+    item = item if isinstance(item, dict) else {}
+    if kind in ("navires", "remorqueurs") and str(item.get("nom") or "").strip():
+        return str(item["nom"]).strip()
+    if kind == "simulations":
+        return f"n° {item.get('id') or index + 1}"
+    if kind == "scenarios" and item.get("evenement"):
+        return f"n° {index + 1} ({item['evenement']})"
+    return f"n° {index + 1}"
+
+
+def _without(value, path):
+    """Copie de value sans la liste au bout de path (comptée à part, élément par élément)"""
+    if not path or not isinstance(value, dict) or path[0] not in value:
+        return value
+    if len(path) == 1:
+        return {k: v for k, v in value.items() if k != path[0]}
+    return {**value, path[0]: _without(value[path[0]], path[1:])}
+
+
+def report_fingerprint(rapport: dict) -> dict:
+    """
+    Empreintes du rapport : une par section (hors listes suivies et historique des
+    révisions) et une par navire, remorqueur, simulation et scénario
+    """
+    sections = {}
+    for name in SECTION_LABELS:
+        value = rapport.get(name)
+        if name == "metadonnees" and isinstance(value, dict):
+            value = {k: v for k, v in value.items() if k != "historique_revisions"}
+        for _, path, _ in ITEM_LISTS:
+            if path[0] == name:
+                value = _without(value, path[1:])
+        sections[name] = _digest(value)
+
+    fingerprint = {"sections": sections}
+    for kind, path, _ in ITEM_LISTS:
+        items = rapport
+        for key in path:
+            items = items.get(key) if isinstance(items, dict) else None
+        fingerprint[kind] = {}
+        for i, item in enumerate(items if isinstance(items, list) else []):
+            label = _item_label(kind, i, item)
+            if label in fingerprint[kind]:
+                label = f"{label} ({i + 1})"  # homonymes
+            fingerprint[kind][label] = _digest(item)
+    return fingerprint
+
+
+def diff_fingerprints(previous: dict, current: dict) -> dict:
+    """Sections modifiées et, par liste suivie, éléments ajoutés, supprimés ou modifiés"""
+    diff = {"sections": [name for name, digest in current["sections"].items()
+                         if previous.get("sections", {}).get(name) != digest]}
+    for kind, _, _ in ITEM_LISTS:
+        old, new = previous.get(kind, {}), current.get(kind, {})
+        diff[kind] = {
+            "ajoutes": [label for label in new if label not in old],
+            "supprimes": [label for label in old if label not in new],
+            "modifies": [label for label, digest in new.items() if label in old and old[label] != digest],
+        }
+    diff["inchange"] = not diff["sections"] and not any(
+        changes for kind, _, _ in ITEM_LISTS for changes in diff[kind].values())
+    return diff
+
+
+def describe_changes(diff: dict, version: str = "") -> str:
+    """Description de révision tirée des changements, ex. « Simulations n° 3 et n° 7 modifiées ; ... »"""
+    if diff["inchange"]:
+        return ""
+
+    def enumerate_labels(labels: List[str]) -> str:
+        return labels[0] if len(labels) == 1 else ", ".join(labels[:-1]) + " et " + labels[-1]
+
+    parts = []
+    for kind, _, singular in ITEM_LISTS:
+        for change, verb in (("modifies", "modifié"), ("ajoutes", "ajouté"), ("supprimes", "supprimé")):
+            labels = diff[kind][change]
+            if labels:
+                plural = "s" if len(labels) > 1 else ""
+                feminine = "e" if kind == "simulations" else ""
+                parts.append(f"{singular.capitalize()}{plural} {enumerate_labels(labels)} "
+                             f"{verb}{feminine}{plural}")
+    if diff["sections"]:
+        parts.append("mise à jour : " + ", ".join(SECTION_LABELS[name] for name in diff["sections"]))
+    text = " ; ".join(parts)
+    return (f"Depuis la version {version} : " if version else "") + text[0].upper() + text[1:]
+
+
+def project_key(rapport: dict) -> str:
+    """Identité du document : code projet et numéro, à défaut le titre"""
+    meta = rapport.get("metadonnees") or {}
+    parts = [str(meta.get(k) or "").strip() for k in ("code_projet", "numero")]
+    return "/".join(parts) if any(parts) else str(meta.get("titre") or "").strip()
+
+
+def _current_version(rapport: dict) -> str:
+    revisions = (rapport.get("metadonnees") or {}).get("historique_revisions") or []
+    return str(revisions[-1].get("version") or "") if revisions else ""
+
+
+@contextmanager
+def _connect():
+    os.makedirs(os.path.dirname(Config.REVISIONS_DB), exist_ok=True)
+    conn = sqlite3.connect(Config.REVISIONS_DB, timeout=10)
+    try:
+        conn.executescript(SCHEMA)
+        if "fichiers" not in {row[1] for row in conn.execute("PRAGMA table_info(exports)")}:
+            conn.execute("ALTER TABLE exports ADD COLUMN fichiers TEXT")  # base créée avant ce champ
+        yield conn
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def record_export(rapport: dict, fichier: str, fingerprint: Optional[dict] = None) -> None:
+    """
+    Enregistre les empreintes de la révision exportée (fingerprint : calculée avant l'export)
+    et les fichiers du store qu'elle cite, protégés de l'éviction (upload_store)
+    """
+    projet = project_key(rapport)
+    if not projet:
+        return
+    fingerprint = fingerprint or report_fingerprint(rapport)
+    with _connect() as conn:
+        conn.execute("INSERT OR REPLACE INTO exports VALUES (?, ?, ?, ?, ?, ?)",
+                     (projet, time.time(), _current_version(rapport), fichier, json.dumps(fingerprint),
+                      json.dumps(referenced_digests(rapport))))
+
+
+def last_export(rapport: dict) -> Optional[dict]:
+    """Dernière révision exportée du même document : {version, exporte_le, fichier, empreintes}"""
+    projet = project_key(rapport)
+    if not projet:
+        return None
+    with _connect() as conn:
+        row = conn.execute(
+            "SELECT version, exporte_le, fichier, empreintes FROM exports WHERE projet = ? "
+            "ORDER BY exporte_le DESC LIMIT 1", (projet,)
+        ).fetchone()
+    if row is None:
+        return None
+    return {"version": row[0], "exporte_le": row[1], "fichier": row[2], "empreintes": json.loads(row[3])}
+
+
+def _prefill_description(description: str, exported_version: str) -> None:
+    """(callback) Description de la révision en cours, ou d'une nouvelle si la dernière est déjà exportée"""
+    revisions = st.session_state.setdefault("revisions", [])
+    if not revisions or st.session_state.get(f"rev_version_{len(revisions) - 1}", "") == exported_version:
+        revisions.append({})
+    st.session_state[f"rev_description_{len(revisions) - 1}"] = description
+
+
+def render_revision_diff(rapport: dict) -> None:
+    """Changements depuis le dernier export du document et pré-remplissage de la révision"""
+    previous = last_export(rapport)
+    if previous is None:
+        return
+    current = report_fingerprint(rapport)
+    diff = diff_fingerprints(previous["empreintes"], current)
+    date = time.strftime("%d/%m/%Y %H:%M", time.localtime(previous["exporte_le"]))
+    version = previous["version"]
+    title = f"🔍 Changements depuis le dernier export ({f'version {version}, ' if version else ''}{date})"
+    with st.expander(title, expanded=not diff["inchange"]):
+        if diff["inchange"]:
+            st.info("Aucun changement depuis le dernier export.")
+            return
+        for kind, _, singular in ITEM_LISTS:
+            changes = diff[kind]
+            lines = [f"{label} : {change}" for change, labels in
+                     (("modifié", changes["modifies"]), ("ajouté", changes["ajoutes"]), ("supprimé", changes["supprimes"]))
+                     for label in labels]
+            if lines:
+                st.markdown(f"**{kind.capitalize()}** — " + " · ".join(lines))
+        if diff["sections"]:
+            st.markdown("**Sections** — " + ", ".join(SECTION_LABELS[name] for name in diff["sections"]))
+        description = describe_changes(diff, version)
+        st.caption(description)
+        st.button("✍️ Pré-remplir la description de la révision", key="_revision_preremplir",
+                  on_click=_prefill_description, args=(description, version),
+                  help="Remplit la description de la révision en cours (onglet Métadonnées), "
+                       "ou en ajoute une si la dernière révision est celle déjà exportée")
+        if len(current["simulations"]) >= Config.RENDER_SHARD_MIN_ITEMS:
+            st.caption("Rendu parallèle : les lots de simulations et de scénarios inchangés "
+                       "seront repris du cache de rendu.")
@@ -0,0 +1,273 @@
+# =============================================================================
+# sharded_render.py - Parallel rendering of the large template loops (simulations, scenarios)
+# =============================================================================
+
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+from docx.image.image import Image as DocxImage
+from docx.oxml.shape import CT_Inline
+from docxtpl import InlineImage
+from jinja2 import Environment, meta
+from lxml import etree
+
+from config import Config
+from images import content_digest
+from shared_cache import lookup_file, publish_bytes
+from template_index import CachedDocxTemplate
+from utils import file_sha256
+
+FOR_TAG = re.compile(r"\{%\s*for\s+(\w+)\s+in\s+([\w.]+)\s*%\}")
+LOOP_TAG = re.compile(r"\{%\s*(for|endfor)\b[^%]*%\}")
+# Le {% for %} est seul en fin de paragraphe : chaque itération commence par fermer ce paragraphe
+FOR_TAIL = "</w:t></w:r></w:p>"
+# ... et le {% endfor %} en début du sien : chaque itération se termine en ouvrant ce paragraphe
+ENDFOR_HEAD = re.compile(r"<w:p[ >](?:(?!<w:p[ >]).)*$", re.DOTALL)
+
+SHARD_TOKEN = "__RAPPORT_SHARD_{}__"
+IMAGE_RID = "__RAPPORT_SHARD_IMG_{}__"
+SPLICE_MARKERS = re.compile(r"__RAPPORT_SHARD_IMG_(\d+)__|(?<=<wp:docPr id=\")\d+")
+IMAGE_MARKER = re.compile(r"__RAPPORT_SHARD_IMG_(\d+)__")
+
+# Modules et réglages dont dépend le contenu rendu : un changement invalide les rendus en cache
+RENDER_CODE_FILES = ("word_export.py", "template_index.py", "docx_package.py", "sharded_render.py", "images.py",
+                     "image_index.py")
+RENDER_CONFIG_KEYS = ("DOCX_COMPRESSLEVEL", "IMAGE_MAX_DECODE_PIXELS", "IMAGE_MAX_PIXELS", "IMAGE_PREVIEW_PIXELS",
+                      "RENDER_SHARD_LISTS", "RENDER_SHARD_MIN_ITEMS", "RENDER_SHARD_SIZE")
+_RENDER_CODE_DIGEST: List[str] = []
+
+_POOL: Optional[ProcessPoolExecutor] = None
+_POOL_LOCK = threading.Lock()
+
+
+def render_pool() -> ProcessPoolExecutor:
+    """Processus de rendu partagés par toutes les générations (démarrés au premier usage)"""
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            # spawn : pas de fork d'un processus Streamlit multi-thread
+            _POOL = ProcessPoolExecutor(max_workers=Config.RENDER_SHARD_WORKERS,
+                                        mp_context=multiprocessing.get_context("spawn"))
+        return _POOL
+
+
+class ShardImage:
+    """
+    Image d'un sous-document : même balise <w:drawing> qu'une InlineImage, mais la
+    relation (rId) est un marqueur résolu à l'assemblage, dans le processus principal
+    """
+
+    def __init__(self, index: int, filename: str, cx: int, cy: int):
+        self.index, self.filename, self.cx, self.cy = index, filename, cx, cy
+
+    def _insert_image(self):
+        pic = CT_Inline.new_pic_inline(0, IMAGE_RID.format(self.index), self.filename, self.cx, self.cy).xml
+        return (
+            "</w:t></w:r><w:r><w:drawing>%s</w:drawing></w:r><w:r>"
+            '<w:t xml:space="preserve">' % pic
+        )
+
+    __str__ = __unicode__ = __html__ = _insert_image
+
+
+def _to_shard_value(value, images: List[str]):
+    """Copie transmissible aux processus : les InlineImage deviennent des ShardImage"""
+    if isinstance(value, dict):
+        return {k: _to_shard_value(v, images) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_to_shard_value(v, images) for v in value]
+    if isinstance(value, InlineImage):
+        cx, cy = value.width, value.height
+        if cx is None or cy is None:
+            cx, cy = DocxImage.from_file(value.image_descriptor).scaled_dimensions(cx, cy)
+        images.append(value.image_descriptor)
+        return ShardImage(len(images) - 1, os.path.basename(value.image_descriptor), int(cx), int(cy))
+    return value
+
+
+def render_code_digest() -> str:
+    """Empreinte du code et des réglages de rendu (Config), partie des clés des rendus mis en cache"""
+    if not _RENDER_CODE_DIGEST:
+        here = os.path.dirname(os.path.abspath(__file__))
+        _RENDER_CODE_DIGEST.append("".join(file_sha256(os.path.join(here, name)) for name in RENDER_CODE_FILES))
+    settings = json.dumps({name: getattr(Config, name) for name in RENDER_CONFIG_KEYS}, sort_keys=True)
+    return hashlib.sha256((_RENDER_CODE_DIGEST[0] + settings).encode()).hexdigest()
+
+
+def _signature_default(value):
+    if isinstance(value, ShardImage):
+        return ["image", value.index, value.filename, value.cx, value.cy]
+    if callable(value):
+        return f"{getattr(value, '__module__', '')}.{getattr(value, '__qualname__', type(value).__name__)}"
+    return str(value)
+
+
+def _shard_key(source: str, nsdecl: str, shared: dict, items: list, images: List[str]) -> str:
+    """Clé d'un lot : XML de la boucle, valeurs rendues, contenu des images et code de rendu"""
+    payload = json.dumps([render_code_digest(), source, nsdecl, shared, items,
+                          [content_digest(path) for path in images]],
+                         sort_keys=True, ensure_ascii=False, default=_signature_default)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _lookup(context: dict, path: str):
+    value = context
+    for key in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def _render_shard(source: str, items: list, context: dict, nsdecl: str) -> str:
+    """
+    (processus de rendu) Rend un lot d'itérations d'une boucle du template et applique
+    les corrections de docxtpl (listings, tableaux) sur ce fragment seul
+    """
+    tpl = CachedDocxTemplate(None)
+    xml = tpl.render_xml_part(source, None, dict(context, __shard_items=items), None)
+    tree = tpl.fix_tables(f"<w:body {nsdecl}>{xml}</w:body>")
+    xml = etree.tostring(tree, encoding="unicode")
+    return xml[xml.index(">") + 1:-len("</w:body>")]
+
+
+class ShardedDocxTemplate(CachedDocxTemplate):
+    """
+    CachedDocxTemplate dont les grandes boucles (Config.RENDER_SHARD_LISTS) sont rendues par lots
+    dans des processus séparés pendant le rendu du reste du document. Chaque lot est
+    rendu à partir du même XML de template (styles et numérotation identiques) ; le
+    résultat est inséré à la sérialisation, sans passer par l'arbre XML du document.
+    """
+
+    def __init__(self, template_file, min_items: Optional[int] = None, shard_size: Optional[int] = None):
+        super().__init__(template_file)
+        self.min_items = Config.RENDER_SHARD_MIN_ITEMS if min_items is None else min_items
+        self.shard_size = shard_size or Config.RENDER_SHARD_SIZE
+        self.registry = None       # ImageRegistry de word_export, si fourni
+        self.shard_stats: Dict[str, int] = {}  # liste -> éléments rendus en parallèle
+        self.reused_shards = 0     # lots repris du cache de rendu (inchangés depuis un rendu précédent)
+        self._shards = {}          # jeton -> (lots, entre deux lots)
+        self._spliced: Dict[bytes, bytes] = {}
+        self._images: List[str] = []  # chemins des images des lots (indice = marqueur, à l'assemblage)
+
+    def _shardable_loops(self, xml: str, context: dict):
+        """Boucles de premier niveau sur une liste à répartir, de forme compatible"""
+        depth, start = 0, None
+        for match in LOOP_TAG.finditer(xml):
+            if match.group(1) == "for":
+                if depth == 0:
+                    start = match
+                depth += 1
+                continue
+            depth -= 1
+            if depth != 0 or start is None:
+                continue
+            tag = FOR_TAG.fullmatch(start.group(0))
+            if not tag or tag.group(2) not in Config.RENDER_SHARD_LISTS:
+                continue
+            items = _lookup(context, tag.group(2))
+            body = xml[start.end():match.start()]
+            head = ENDFOR_HEAD.search(body)
+            if (not isinstance(items, list) or len(items) < self.min_items or "loop." in body
+                    or not body.startswith(FOR_TAIL) or head is None
+                    or "</w:t>" in head.group(0) or "{" in head.group(0)):
+                continue
+            yield start.start(), match.end(), tag.group(2), tag.group(1), items, body[len(FOR_TAIL):head.start()], head.group(0)
+
+    def _submit(self, inner: str, head: str, variable: str, items: list, context: dict) -> list:
+        """
+        Lance le rendu des lots ; un lot déjà rendu à l'identique (même XML, mêmes valeurs,
+        mêmes images) est repris du cache partagé. Retourne [(future, clé, à publier, images)].
+        """
+        # Entre deux itérations : le paragraphe du {% endfor %} suivi de la fin de celui du {% for %}
+        source = (f"{{% for {variable} in __shard_items %}}{{% if not loop.first %}}{head}{FOR_TAIL}"
+                  f"{{% endif %}}{inner}{{% endfor %}}")
+        names = meta.find_undeclared_variables(Environment().parse(source)) - {"__shard_items"}
+        nsdecl = " ".join(f'xmlns:{prefix}="{uri}"' for prefix, uri in self.docx._element.nsmap.items() if prefix)
+        pool = render_pool()
+        shards = []
+        for i in range(0, len(items), self.shard_size):
+            # Marqueurs d'images propres au lot : son XML ne dépend pas des autres lots
+            images: List[str] = []
+            shared = {name: _to_shard_value(context[name], images) for name in names if name in context}
+            batch = _to_shard_value(items[i:i + self.shard_size], images)
+            key = _shard_key(source, nsdecl, shared, batch, images)
+            cached = lookup_file("lots", key, ".xml")
+            if cached is not None:
+                future = Future()
+                with open(cached, encoding="utf-8") as f:
+                    future.set_result(f.read())
+                self.reused_shards += 1
+            else:
+                future = pool.submit(_render_shard, source, batch, shared, nsdecl)
+            shards.append((future, key, cached is None, images))
+        return shards
+
+    def build_xml(self, context, jinja_env=None):
+        xml = self.patch_xml(self.get_xml())
+        self._shards, self._spliced, self._images = {}, {}, []
+        self.reused_shards = 0
+        if jinja_env is None:  # environnement Jinja spécifique : non transmissible aux processus
+            pieces, last = [], 0
+            for start, end, path, variable, items, inner, head in self._shardable_loops(xml, context):
+                token = SHARD_TOKEN.format(len(self._shards))
+                self._shards[token] = (self._submit(inner, head, variable, items, context), head)
+                self.shard_stats[path] = self.shard_stats.get(path, 0) + len(items)
+                pieces += [xml[last:start], token]
+                last = end
+            xml = "".join(pieces) + xml[last:]
+        # Le reste du document est rendu pendant que les processus traitent les boucles
+        return self.render_xml_part(xml, self.docx._part, context, jinja_env)
+
+    def render(self, context, jinja_env=None, autoescape=False):
+        self.shard_stats = {}
+        super().render(context, jinja_env, autoescape)
+        self._assemble()
+
+    def _assemble(self):
+        part = self.docx._part
+        rids: Dict[str, str] = {}
+
+        def resolve(match):
+            if match.group(1) is None:
+                self.docx_ids_index += 1
+                return str(self.docx_ids_index)
+            path = self._images[int(match.group(1))]
+            if path not in rids:
+                if self.registry is not None:
+                    rids[path] = self.registry.image_for_part(part, path)[0]
+                else:
+                    rids[path] = part.get_or_add_image(path)[0]
+            return rids[path]
+
+        for token, (shards, head) in self._shards.items():
+            pieces = []
+            for future, key, fresh, images in shards:
+                xml = future.result()
+                if fresh:
+                    publish_bytes("lots", key, ".xml", xml.encode("utf-8"))
+                # Marqueurs du lot -> indices dans la liste des images du document
+                offset = len(self._images)
+                self._images.extend(images)
+                pieces.append(IMAGE_MARKER.sub(lambda m: IMAGE_RID.format(int(m.group(1)) + offset), xml))
+            xml = (head + FOR_TAIL).join(pieces)
+            self._spliced[token.encode("utf-8")] = SPLICE_MARKERS.sub(resolve, FOR_TAIL + xml + head).encode("utf-8")
+        self._shards = {}
+
+    def splice_part(self, part, blob: bytes) -> bytes:
+        """Insère les lots rendus à la place de leurs jetons (appelé à la sérialisation)"""
+        if part is not self.docx._part:
+            return blob
+        for token, xml in self._spliced.items():
+            blob = blob.replace(token, xml, 1)
+        return blob
+
+    def save(self, filename, *args, **kwargs):
+        from docx_package import save_document
+        save_document(self, filename)
@@ -0,0 +1,500 @@
+# =============================================================================
+# shared_cache.py - Cache tier shared by app replicas (derivatives, renders)
+# =============================================================================
+#
+# Entrées immuables nommées par (espace, clé, suffixe) : la clé dérive du contenu
+# (empreinte du fichier source, du template, du contexte de rendu...), deux répliques
+# qui calculent la même chose écrivent donc la même entrée. Écritures atomiques
+# (fichier temporaire puis renommage, ou transaction SQLite), éviction LRU au-delà de
+# Config.SHARED_CACHE_MAX_BYTES, compteurs succès / échecs par espace et par réplique.
+#
+# Backends (Config.SHARED_CACHE_BACKEND) :
+#   - "dossier" : répertoire partagé (Config.SHARED_CACHE_DIR, partage réseau ou disque local) ;
+#   - "sqlite"  : base commune (Config.SHARED_CACHE_DB), copies locales pour les fichiers.
+# Un autre backend s'ajoute à BACKENDS en implémentant les méthodes abstraites de CacheBackend.
+
+import argparse
+import json
+import os
+import shutil
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+from config import Config
+
+TMP_DIR = "_tmp"
+METRICS_DIR = "_metriques"
+TOUCH_INTERVAL = 60          # date d'utilisation rafraîchie au plus une fois par minute (s)
+EVICT_CHECK_INTERVAL = 60    # éviction vérifiée au plus une fois par minute par processus (s)
+METRICS_TTL = 30 * 24 * 3600  # compteurs d'une réplique disparue gardés ce délai (s)
+
+
+def _replica_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def _trim_directory(root: str, max_bytes: int, min_age: float, skip=(TMP_DIR, METRICS_DIR)) -> int:
+    """
+    Supprime les fichiers les moins récemment utilisés (date de modification) jusqu'à
+    revenir à 90 % de max_bytes ; les fichiers utilisés depuis moins de min_age restent.
+    Retourne le nombre de fichiers supprimés.
+    """
+    files, total = [], 0
+    for dirpath, dirnames, filenames in os.walk(root):
+        if dirpath == root:
+            dirnames[:] = [d for d in dirnames if d not in skip]
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue  # évincé entre-temps par une autre réplique
+            files.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+    if total <= max_bytes:
+        return 0
+    limit, target, removed = time.time() - min_age, 0.9 * max_bytes, 0
+    for mtime, size, path in sorted(files):
+        if total <= target or mtime > limit:
+            break
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+        total -= size
+    return removed
+
+
+class CacheBackend(ABC):
+    """
+    Interface d'un tier de cache partagé. fetch retourne un chemin local lisible (ou None),
+    publish y range un fichier produit localement ; les compteurs et le déclenchement de
+    l'éviction (en arrière-plan) sont tenus ici.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset_counters()
+
+    def _reset_counters(self) -> None:
+        self._pid = os.getpid()
+        self._counters: Dict[str, Dict[str, int]] = {}
+        self._dirty = False
+        self._flushed_at = time.time()
+        self._evict_checked_at = 0.0
+        self._evicting = False
+
+    # --- à implémenter par les backends ---
+
+    @abstractmethod
+    def fetch(self, namespace: str, key: str, suffix: str = "") -> Optional[str]:
+        """Chemin local lisible de l'entrée, ou None si absente"""
+
+    @abstractmethod
+    def publish(self, namespace: str, key: str, suffix: str, tmp_path: str) -> str:
+        """Range le fichier tmp_path (déplacé) sous la clé ; retourne son chemin lisible"""
+
+    @abstractmethod
+    def evict(self) -> int:
+        """Éviction LRU jusqu'à repasser sous le budget ; retourne le nombre d'entrées supprimées"""
+
+    @abstractmethod
+    def usage(self) -> dict:
+        """{"entrees", "octets"} occupés dans le tier partagé"""
+
+    @abstractmethod
+    def temp_path(self, suffix: str = "") -> str:
+        """Fichier temporaire sur le même système de fichiers que les entrées (renommage atomique)"""
+
+    @abstractmethod
+    def _save_counters(self, counters: Dict[str, Dict[str, int]]) -> None:
+        """Écrit les compteurs de la réplique dans le tier partagé"""
+
+    @abstractmethod
+    def _load_counters(self) -> Dict[str, Dict[str, Dict[str, int]]]:
+        """Compteurs de toutes les répliques : {réplique: {espace: {succes, echecs, ecrits, octets_ecrits}}}"""
+
+    # --- compteurs ---
+
+    def count(self, namespace: str, event: str, amount: int = 1) -> None:
+        with self._lock:
+            if os.getpid() != self._pid:
+                self._reset_counters()  # processus enfant : compteurs propres
+            counters = self._counters.setdefault(
+                namespace, {"succes": 0, "echecs": 0, "ecrits": 0, "octets_ecrits": 0})
+            counters[event] += amount
+            self._dirty = True
+            due = time.time() - self._flushed_at >= Config.SHARED_CACHE_METRICS_INTERVAL
+        if due:
+            self.flush()
+
+    def flush(self) -> None:
+        """Écrit les compteurs de la réplique dans le tier partagé"""
+        with self._lock:
+            if not self._dirty:
+                return
+            snapshot = json.loads(json.dumps(self._counters))
+            self._dirty = False
+            self._flushed_at = time.time()
+        try:
+            self._save_counters(snapshot)
+        except (OSError, sqlite3.Error):
+            with self._lock:
+                self._dirty = True  # tier indisponible ou verrouillé : nouvelle tentative au prochain intervalle
+
+    def maybe_evict(self) -> None:
+        """Lance l'éviction dans un fil d'arrière-plan (parcours du tier hors du chemin de la requête)"""
+        now = time.time()
+        with self._lock:
+            if self._evicting or now - self._evict_checked_at < EVICT_CHECK_INTERVAL:
+                return
+            self._evict_checked_at = now
+            self._evicting = True
+        threading.Thread(target=self._evict_in_background, daemon=True, name="cache-eviction").start()
+
+    def _evict_in_background(self) -> None:
+        try:
+            self.evict()
+        except (OSError, sqlite3.Error):
+            pass  # tier indisponible : nouvelle tentative au prochain intervalle
+        finally:
+            self._evicting = False
+
+    def stats(self, with_usage: bool = True) -> dict:
+        """Taux de succès par espace (toutes répliques) et, si with_usage, occupation du tier"""
+        self.flush()
+        espaces: Dict[str, Dict[str, int]] = {}
+        replicas = self._load_counters()
+        for counters in replicas.values():
+            for namespace, values in counters.items():
+                total = espaces.setdefault(namespace, {"succes": 0, "echecs": 0, "ecrits": 0, "octets_ecrits": 0})
+                for name, value in values.items():
+                    total[name] = total.get(name, 0) + value
+        for values in espaces.values():
+            lookups = values["succes"] + values["echecs"]
+            values["taux_succes"] = round(values["succes"] / lookups, 3) if lookups else None
+        hits = sum(v["succes"] for v in espaces.values())
+        lookups = hits + sum(v["echecs"] for v in espaces.values())
+        return {
+            "backend": type(self).__name__,
+            "repliques": len(replicas),
+            "taux_succes": round(hits / lookups, 3) if lookups else None,
+            "espaces": espaces,
+            **(self.usage() if with_usage else {}),
+            "budget_octets": Config.SHARED_CACHE_MAX_BYTES,
+        }
+
+
+class DirectoryCache(CacheBackend):
+    """Entrées dans un répertoire partagé : <racine>/<espace>/<clé[:2]>/<clé><suffixe>"""
+
+    def __init__(self, root: Optional[str] = None):
+        super().__init__()
+        self.root = root or Config.SHARED_CACHE_DIR
+        os.makedirs(os.path.join(self.root, TMP_DIR), exist_ok=True)
+        os.makedirs(os.path.join(self.root, METRICS_DIR), exist_ok=True)
+
+    def _path(self, namespace: str, key: str, suffix: str) -> str:
+        return os.path.join(self.root, namespace, key[:2], f"{key}{suffix}")
+
+    def fetch(self, namespace: str, key: str, suffix: str = "") -> Optional[str]:
+        path = self._path(namespace, key, suffix)
+        try:
+            if time.time() - os.stat(path).st_mtime > TOUCH_INTERVAL:
+                os.utime(path)  # utilisation récente : protège de l'éviction
+        except FileNotFoundError:
+            return None
+        return path
+
+    def temp_path(self, suffix: str = "") -> str:
+        return os.path.join(self.root, TMP_DIR, f"{uuid.uuid4().hex}{suffix}")
+
+    def publish(self, namespace: str, key: str, suffix: str, tmp_path: str) -> str:
+        path = self._path(namespace, key, suffix)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)  # même contenu si une autre réplique l'a écrit entre-temps
+        return path
+
+    def evict(self) -> int:
+        removed = _trim_directory(self.root, Config.SHARED_CACHE_MAX_BYTES, Config.SHARED_CACHE_MIN_AGE)
+        # Fichiers temporaires et compteurs abandonnés (processus interrompus, répliques disparues)
+        for subdir, ttl in ((TMP_DIR, 24 * 3600), (METRICS_DIR, METRICS_TTL)):
+            for entry in os.scandir(os.path.join(self.root, subdir)):
+                try:
+                    if entry.stat().st_mtime < time.time() - ttl:
+                        os.remove(entry.path)
+                except FileNotFoundError:
+                    pass
+        return removed
+
+    def usage(self) -> dict:
+        entries, size = 0, 0
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            if dirpath == self.root:
+                dirnames[:] = [d for d in dirnames if d not in (TMP_DIR, METRICS_DIR)]
+            for name in filenames:
+                try:
+                    size += os.path.getsize(os.path.join(dirpath, name))
+                    entries += 1
+                except FileNotFoundError:
+                    pass
+        return {"entrees": entries, "octets": size}
+
+    def _save_counters(self, counters: Dict[str, Dict[str, int]]) -> None:
+        path = os.path.join(self.root, METRICS_DIR, f"{_replica_id()}.json")
+        tmp_path = self.temp_path(".json")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(counters, f)
+        os.replace(tmp_path, path)
+
+    def _load_counters(self) -> Dict[str, Dict[str, Dict[str, int]]]:
+        replicas = {}
+        for entry in os.scandir(os.path.join(self.root, METRICS_DIR)):
+            try:
+                with open(entry.path, encoding="utf-8") as f:
+                    replicas[os.path.splitext(entry.name)[0]] = json.load(f)
+            except (OSError, ValueError):
+                pass
+        return replicas
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entrees (
+    espace TEXT,
+    cle TEXT,
+    taille INTEGER,
+    donnees BLOB,
+    utilise_le REAL,
+    PRIMARY KEY (espace, cle)
+);
+CREATE INDEX IF NOT EXISTS entrees_utilisation ON entrees (utilise_le);
+CREATE TABLE IF NOT EXISTS metriques (
+    replique TEXT,
+    espace TEXT,
+    compteurs TEXT,
+    modifie_le REAL,
+    PRIMARY KEY (replique, espace)
+);
+"""
+
+
+class SQLiteCache(CacheBackend):
+    """
+    Entrées dans une base SQLite commune ; fetch les recopie une fois dans un répertoire
+    local (Config.SHARED_CACHE_LOCAL_DIR) pour les lecteurs qui attendent un chemin.
+    Les entrées de plus de Config.SHARED_CACHE_SQLITE_MAX_ENTRY restent locales.
+    """
+
+    def __init__(self, path: Optional[str] = None, local_dir: Optional[str] = None):
+        super().__init__()
+        self.path = path or Config.SHARED_CACHE_DB
+        self.local_dir = local_dir or Config.SHARED_CACHE_LOCAL_DIR
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        os.makedirs(os.path.join(self.local_dir, TMP_DIR), exist_ok=True)
+        with self._connect() as conn:
+            conn.executescript(SQLITE_SCHEMA)
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _local_path(self, namespace: str, key: str, suffix: str) -> str:
+        return os.path.join(self.local_dir, namespace, key[:2], f"{key}{suffix}")
+
+    def fetch(self, namespace: str, key: str, suffix: str = "") -> Optional[str]:
+        local = self._local_path(namespace, key, suffix)
+        try:
+            with self._connect() as conn:
+                row = conn.execute("SELECT utilise_le FROM entrees WHERE espace = ? AND cle = ?",
+                                   (namespace, key + suffix)).fetchone()
+                if row is None:
+                    if os.path.exists(local):
+                        os.utime(local)
+                        return local  # entrée trop volumineuse pour la base, gardée localement
+                    return None
+                if time.time() - row[0] > TOUCH_INTERVAL:
+                    conn.execute("UPDATE entrees SET utilise_le = ? WHERE espace = ? AND cle = ?",
+                                 (time.time(), namespace, key + suffix))
+                if not os.path.exists(local):
+                    data = conn.execute("SELECT donnees FROM entrees WHERE espace = ? AND cle = ?",
+                                        (namespace, key + suffix)).fetchone()[0]
+                    tmp_path = self.temp_path(suffix)
+                    with open(tmp_path, "wb") as f:
+                        f.write(data)
+                    os.makedirs(os.path.dirname(local), exist_ok=True)
+                    os.replace(tmp_path, local)
+        except sqlite3.Error:
+            # Base verrouillée par une autre réplique : copie locale si elle existe, sinon échec
+            return local if os.path.exists(local) else None
+        return local
+
+    def temp_path(self, suffix: str = "") -> str:
+        return os.path.join(self.local_dir, TMP_DIR, f"{uuid.uuid4().hex}{suffix}")
+
+    def publish(self, namespace: str, key: str, suffix: str, tmp_path: str) -> str:
+        size = os.path.getsize(tmp_path)
+        if size <= Config.SHARED_CACHE_SQLITE_MAX_ENTRY:
+            with open(tmp_path, "rb") as f:
+                data = f.read()
+            try:
+                with self._connect() as conn:
+                    conn.execute("INSERT OR REPLACE INTO entrees VALUES (?, ?, ?, ?, ?)",
+                                 (namespace, key + suffix, size, data, time.time()))
+            except sqlite3.Error:
+                pass  # base verrouillée : l'entrée ne reste que dans la copie locale, retournée quand même
+        local = self._local_path(namespace, key, suffix)
+        os.makedirs(os.path.dirname(local), exist_ok=True)
+        os.replace(tmp_path, local)
+        return local
+
+    def evict(self) -> int:
+        removed = 0
+        with self._connect() as conn:
+            total = conn.execute("SELECT COALESCE(SUM(taille), 0) FROM entrees").fetchone()[0]
+            if total > Config.SHARED_CACHE_MAX_BYTES:
+                # Les moins récemment utilisées jusqu'à revenir à 90 % du budget
+                excess = total - 0.9 * Config.SHARED_CACHE_MAX_BYTES
+                rows = conn.execute(
+                    "SELECT espace, cle FROM (SELECT espace, cle, utilise_le, "
+                    "SUM(taille) OVER (ORDER BY utilise_le ROWS UNBOUNDED PRECEDING) - taille AS avant "
+                    "FROM entrees WHERE utilise_le < ?) WHERE avant < ?",
+                    (time.time() - Config.SHARED_CACHE_MIN_AGE, excess)
+                ).fetchall()
+                conn.executemany("DELETE FROM entrees WHERE espace = ? AND cle = ?", rows)
+                removed = len(rows)
+            conn.execute("DELETE FROM metriques WHERE modifie_le < ?", (time.time() - METRICS_TTL,))
+        # Copies locales : même budget, même règle
+        removed += _trim_directory(self.local_dir, Config.SHARED_CACHE_MAX_BYTES, Config.SHARED_CACHE_MIN_AGE)
+        return removed
+
+    def usage(self) -> dict:
+        with self._connect() as conn:
+            entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(taille), 0) FROM entrees").fetchone()
+        return {"entrees": entries, "octets": size}
+
+    def _save_counters(self, counters: Dict[str, Dict[str, int]]) -> None:
+        # sqlite3.Error (base verrouillée) remonte à flush, qui réessaiera au prochain intervalle
+        replica, now = _replica_id(), time.time()
+        with self._connect() as conn:
+            conn.executemany("INSERT OR REPLACE INTO metriques VALUES (?, ?, ?, ?)",
+                             [(replica, ns, json.dumps(values), now) for ns, values in counters.items()])
+
+    def _load_counters(self) -> Dict[str, Dict[str, Dict[str, int]]]:
+        replicas: Dict[str, Dict[str, Dict[str, int]]] = {}
+        with self._connect() as conn:
+            for replica, namespace, values in conn.execute("SELECT replique, espace, compteurs FROM metriques"):
+                replicas.setdefault(replica, {})[namespace] = json.loads(values)
+        return replicas
+
+
+BACKENDS = {"dossier": DirectoryCache, "sqlite": SQLiteCache}
+
+_CACHE: Optional[CacheBackend] = None
+_CACHE_LOCK = threading.Lock()
+
+
+def shared_cache() -> CacheBackend:
+    """Backend du processus, choisi par Config.SHARED_CACHE_BACKEND"""
+    global _CACHE
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            try:
+                backend = BACKENDS[Config.SHARED_CACHE_BACKEND]
+            except KeyError:
+                raise ValueError(f"Backend de cache inconnu : {Config.SHARED_CACHE_BACKEND} "
+                                 f"(disponibles : {', '.join(BACKENDS)})")
+            _CACHE = backend()
+        return _CACHE
+
+
+def _publish(cache: CacheBackend, namespace: str, key: str, suffix: str, write: Callable[[str], None]) -> str:
+    tmp_path = cache.temp_path(suffix)
+    try:
+        write(tmp_path)
+        size = os.path.getsize(tmp_path)
+        path = cache.publish(namespace, key, suffix, tmp_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    cache.count(namespace, "ecrits")
+    cache.count(namespace, "octets_ecrits", size)
+    cache.maybe_evict()
+    return path
+
+
+def lookup_file(namespace: str, key: str, suffix: str = "") -> Optional[str]:
+    """Chemin de l'entrée si elle existe (compte un succès ou un échec), sans la produire"""
+    cache = shared_cache()
+    path = cache.fetch(namespace, key, suffix)
+    cache.count(namespace, "succes" if path else "echecs")
+    return path
+
+
+def cached_file(namespace: str, key: str, suffix: str, produce: Callable[[str], None]) -> str:
+    """
+    Chemin de l'entrée (espace, clé) ; absente, elle est produite par produce(chemin
+    temporaire) puis publiée atomiquement pour toutes les répliques
+    """
+    return lookup_file(namespace, key, suffix) or _publish(shared_cache(), namespace, key, suffix, produce)
+
+
+def cached_bytes(namespace: str, key: str, suffix: str, produce: Callable[[], bytes]) -> bytes:
+    """Contenu de l'entrée (espace, clé), produit par produce() si absent"""
+    def write(tmp_path):
+        with open(tmp_path, "wb") as f:
+            f.write(produce())
+
+    with open(cached_file(namespace, key, suffix, write), "rb") as f:
+        return f.read()
+
+
+def cached_json(namespace: str, key: str, produce: Callable[[], object]):
+    """Valeur JSON de l'entrée (espace, clé), calculée par produce() si absente"""
+    return json.loads(cached_bytes(namespace, key, ".json",
+                                   lambda: json.dumps(produce(), ensure_ascii=False).encode("utf-8")))
+
+
+def publish_file(namespace: str, key: str, suffix: str, source: str) -> str:
+    """Publie une copie d'un fichier déjà produit sous la clé ; retourne le chemin de l'entrée"""
+    return _publish(shared_cache(), namespace, key, suffix, lambda tmp_path: shutil.copyfile(source, tmp_path))
+
+
+def publish_bytes(namespace: str, key: str, suffix: str, data: bytes) -> str:
+    """Publie un contenu déjà produit sous la clé"""
+    def write(tmp_path):
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+
+    return _publish(shared_cache(), namespace, key, suffix, write)
+
+
+def publish_json(namespace: str, key: str, value) -> str:
+    """Publie une valeur JSON déjà calculée sous la clé"""
+    def write(tmp_path):
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(value, f, ensure_ascii=False)
+
+    return _publish(shared_cache(), namespace, key, ".json", write)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cache partagé entre répliques : statistiques et éviction")
+    parser.add_argument("action", choices=("stats", "evict"))
+    args = parser.parse_args()
+    cache = shared_cache()
+    if args.action == "evict":
+        print(f"{cache.evict()} entrée(s) évincée(s)")
+    print(json.dumps(cache.stats(), ensure_ascii=False, indent=2))
@@ -0,0 +1,283 @@
+# =============================================================================
+# template_index.py - Static analysis of the Word template (variables, loops)
+# =============================================================================
+
+import hashlib
+import re
+from typing import Dict, List, Optional
+
+from docx.oxml import parse_xml
+from docxtpl import DocxTemplate
+from jinja2 import Environment, Template, nodes
+
+from config import Config
+from shared_cache import cached_json
+from utils import file_sha256
+
+LOOP_ITEM = "[]"  # segment de chemin désignant un élément de liste parcourue par une boucle
+
+# Index d'utilisation par empreinte de template, partagé par toutes les sessions
+_USAGE_CACHE: Dict[str, dict] = {}
+
+# XML nettoyé (patch_xml) et templates Jinja compilés, par empreinte du XML source
+_PATCHED_CACHE: Dict[str, str] = {}
+_COMPILED_CACHE: Dict[str, Template] = {}
+
+
+def _template_source(template_path: str) -> str:
+    """Texte Jinja du corps, des en-têtes et des pieds de page (tel que docxtpl le rend)"""
+    tpl = DocxTemplate(template_path)
+    tpl.init_docx()
+    xml = tpl.patch_xml(tpl.xml_to_string(tpl.docx._element.body))
+    for uri in (tpl.HEADER_URI, tpl.FOOTER_URI):
+        for _, part in tpl.get_headers_footers(uri):
+            xml += tpl.patch_xml(tpl.xml_to_string(parse_xml(part.blob)))
+    return xml
+
+
+class _UsageVisitor:
+    """Parcourt l'AST Jinja et collecte les chemins de contexte utilisés"""
+
+    def __init__(self):
+        self.paths = set()
+        self.structural = set()  # chemins dont seule la présence compte (boucles, tests)
+        self.loops = set()
+        self.conditions = set()
+
+    @staticmethod
+    def _chain(node) -> Optional[List[str]]:
+        """Chemin brut d'une expression a.b["c"], ou None si ce n'est pas un simple accès"""
+        if isinstance(node, nodes.Name):
+            return [node.name]
+        if isinstance(node, nodes.Getattr):
+            base = _UsageVisitor._chain(node.node)
+            return base + [node.attr] if base is not None else None
+        if isinstance(node, nodes.Getitem) and isinstance(node.arg, nodes.Const):
+            base = _UsageVisitor._chain(node.node)
+            return base + [str(node.arg.value)] if base is not None else None
+        return None
+
+    def _resolve(self, chain: List[str], scope: Dict[str, Optional[List[str]]]) -> Optional[List[str]]:
+        head = chain[0]
+        if head == "loop":
+            return None
+        if head in scope:
+            base = scope[head]
+            return base + chain[1:] if base is not None else None
+        return chain
+
+    def _record(self, chain, scope) -> Optional[List[str]]:
+        path = self._resolve(chain, scope) if chain else None
+        if path:
+            self.paths.add(tuple(path))
+        return path
+
+    def visit(self, node, scope):
+        if isinstance(node, nodes.For):
+            self._visit_for(node, scope)
+            return
+        if isinstance(node, nodes.If):
+            chain = self._chain(node.test)
+            path = self._resolve(chain, scope) if chain else None
+            if path:
+                self.conditions.add(format_path(path))
+                self.structural.add(tuple(path))
+            elif chain is None:
+                self.visit(node.test, scope)
+            for child in node.body + node.elif_ + node.else_:
+                self.visit(child, scope)
+            return
+        if isinstance(node, (nodes.Assign, nodes.AssignBlock)):
+            # {% set x = ... %} : x devient une variable locale, non résolue dans le contexte
+            for target in node.target.find_all(nodes.Name):
+                scope[target.name] = None
+        if isinstance(node, nodes.Call):
+            # Appel de méthode x.items() / x.values() : x est utilisé en entier
+            chain = self._chain(node.node)
+            if chain and len(chain) > 1:
+                self._record(chain[:-1], scope)
+                for child in list(node.args) + list(node.kwargs):
+                    self.visit(child, scope)
+                return
+        chain = self._chain(node) if isinstance(node, nodes.Expr) else None
+        if chain is not None:
+            self._record(chain, scope)
+            return
+        for child in node.iter_child_nodes():
+            self.visit(child, scope)
+
+    def _visit_for(self, node: nodes.For, scope):
+        inner = dict(scope)
+        chain = self._chain(node.iter)
+        iter_path = self._resolve(chain, scope) if chain is not None else None
+        if iter_path is not None and isinstance(node.target, nodes.Name):
+            # Seuls les champs des éléments utilisés dans le corps de la boucle sont retenus
+            self.loops.add(format_path(iter_path))
+            self.structural.add(tuple(iter_path) + (LOOP_ITEM,))
+            inner[node.target.name] = list(iter_path) + [LOOP_ITEM]
+        else:
+            # Dépaquetage (k, v) ou itérable calculé : l'itérable est utilisé en entier
+            self.visit(node.iter, scope)
+            for target in node.target.find_all(nodes.Name):
+                inner[target.name] = None
+
+        for child in node.body + node.else_:
+            self.visit(child, inner)
+        if node.test is not None:
+            self.visit(node.test, inner)
+
+
+def format_path(path) -> str:
+    return ".".join(path).replace("." + LOOP_ITEM, LOOP_ITEM)
+
+
+def _analyse(template_path: str, digest: str) -> dict:
+    ast = Environment().parse(_template_source(template_path))
+    visitor = _UsageVisitor()
+    for child in ast.body:
+        visitor.visit(child, {})
+    return {
+        "template": template_path,
+        "sha256": digest,
+        "variables": sorted({path[0] for path in visitor.paths}),
+        "chemins": sorted(format_path(path) for path in visitor.paths),
+        "boucles": sorted(visitor.loops),
+        "conditions": sorted(visitor.conditions),
+        "_arbre": _build_tree(visitor.paths, visitor.structural),
+    }
+
+
+def _build_tree(paths, structural=()) -> dict:
+    """
+    Arbre des chemins utilisés ; un noeud marqué None est utilisé en entier,
+    les éléments de boucle ne gardent que les champs lus dans le corps de la boucle
+    """
+    tree: dict = {}
+    entries = [(path, True) for path in paths] + [(path, False) for path in structural]
+    for path, whole in sorted(entries, key=lambda entry: len(entry[0])):
+        node = tree
+        for i, segment in enumerate(path):
+            if node.get(segment, {}) is None:
+                break  # un préfixe est déjà utilisé en entier
+            if i == len(path) - 1 and whole:
+                node[segment] = None
+            else:
+                node = node.setdefault(segment, {})
+    return tree
+
+
+def template_usage(template_path: str) -> dict:
+    """
+    Index des variables, boucles et conditions utilisées par le template,
+    calculé une fois puis mis en cache (mémoire et cache partagé) par empreinte du fichier.
+    """
+    digest = file_sha256(template_path)
+    if digest in _USAGE_CACHE:
+        return _USAGE_CACHE[digest]
+
+    usage = cached_json("templates", digest[:20], lambda: _analyse(template_path, digest))
+    _USAGE_CACHE[digest] = usage
+    return usage
+
+
+def prune_context(value, tree):
+    """Ne conserve du contexte que les sous-arbres référencés par le template"""
+    if not tree:
+        # Utilisé en entier, ou seulement testé / parcouru : valeur conservée telle quelle
+        return value
+    if isinstance(value, dict):
+        return {k: prune_context(value[k], tree[k]) for k in tree if k in value}
+    if isinstance(value, list):
+        if LOOP_ITEM in tree:
+            return [prune_context(item, tree[LOOP_ITEM]) for item in value]
+        return value
+    return value
+
+
+def merge_trees(*trees):
+    """Union d'arbres d'utilisation (plusieurs templates rendus à partir d'un même contexte)"""
+    merged = {}
+    for tree in trees:
+        if not tree:
+            return None  # utilisé en entier par l'un des templates
+        for key, sub in tree.items():
+            merged[key] = merge_trees(merged[key], sub) if key in merged else sub
+    return merged
+
+
+def unused_context_keys(value, tree, prefix="") -> List[str]:
+    """Chemins du contexte que le template n'utilise jamais (dédupliqués sur les listes)"""
+    if not tree:
+        return []
+    unused = []
+    if isinstance(value, dict):
+        for k, v in value.items():
+            path = f"{prefix}.{k}" if prefix else k
+            if k not in tree:
+                unused.append(path)
+            else:
+                unused.extend(unused_context_keys(v, tree[k], path))
+    elif isinstance(value, list) and LOOP_ITEM in tree:
+        seen = set()
+        for item in value:
+            for path in unused_context_keys(item, tree[LOOP_ITEM], prefix + LOOP_ITEM):
+                if path not in seen:
+                    seen.add(path)
+                    unused.append(path)
+    return unused
+
+
+def _remember(cache: dict, key: str, value):
+    if len(cache) >= Config.TEMPLATE_CACHE_SIZE:
+        cache.pop(next(iter(cache)))  # le plus ancien
+    cache[key] = value
+    return value
+
+
+def _xml_key(xml: str) -> str:
+    return hashlib.sha1(xml.encode("utf-8")).hexdigest()
+
+
+class _CompilingEnvironment(Environment):
+    """Environnement Jinja par défaut dont from_string réutilise les templates déjà compilés"""
+
+    def from_string(self, source, globals=None, template_class=None):
+        if globals or template_class or not isinstance(source, str):
+            return super().from_string(source, globals, template_class)
+        key = _xml_key(source)
+        template = _COMPILED_CACHE.get(key)
+        return template if template is not None else _remember(_COMPILED_CACHE, key, super().from_string(source))
+
+
+_JINJA_ENV = _CompilingEnvironment()
+
+
+class CachedDocxTemplate(DocxTemplate):
+    """
+    DocxTemplate dont le nettoyage du XML et la compilation Jinja de chaque partie (corps,
+    en-têtes, pieds de page) ne sont faits qu'une fois par processus : les rendus suivants
+    du même template ne paient que le rendu lui-même
+    """
+
+    def patch_xml(self, src_xml):
+        key = _xml_key(src_xml)
+        patched = _PATCHED_CACHE.get(key)
+        return patched if patched is not None else _remember(_PATCHED_CACHE, key, super().patch_xml(src_xml))
+
+    def render_xml_part(self, src_xml, part, context, jinja_env=None):
+        return super().render_xml_part(src_xml, part, context, jinja_env or _JINJA_ENV)
+
+
+def warm_template(template_path: str) -> None:
+    """Analyse, nettoie et compile d'avance un template (démarrage des processus de rendu)"""
+    template_usage(template_path)
+    tpl = CachedDocxTemplate(template_path)
+    tpl.init_docx()
+    sources = [tpl.get_xml()] + [
+        tpl.get_part_xml(part)
+        for uri in (tpl.HEADER_URI, tpl.FOOTER_URI)
+        for _, part in tpl.get_headers_footers(uri)
+    ]
+    for xml in sources:
+        # Même transformation que DocxTemplate.render_xml_part avant la compilation
+        _JINJA_ENV.from_string(re.sub(r"<w:p([ >])", r"\n<w:p\1", tpl.patch_xml(xml)))
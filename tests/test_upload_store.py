@@ -0,0 +1,48 @@
+# =============================================================================
+# test_upload_store.py - Eviction of the upload store
+# =============================================================================
+
+import os
+import time
+
+import pytest
+
+from config import Config
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """Store vide dans un dossier temporaire, sessions considérées comme expirées"""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(Config, "UPLOAD_SESSION_TTL", 0)
+    import upload_store
+    return upload_store
+
+
+def _expire(store, namespace):
+    with store._index() as conn:
+        conn.execute("UPDATE refs SET dernier_acces = ? WHERE espace = ?", (time.time() - 3600, namespace))
+
+
+def test_exported_asset_survives_eviction(store):
+    from revision_diff import record_export
+
+    exported = store.store_bytes(b"planche exportee", "planche.png", "session_a")
+    orphan = store.store_bytes(b"planche abandonnee", "brouillon.png", "session_b")
+    rapport = {"metadonnees": {"code_projet": "P01", "numero": "1"},
+               "simulations": {"simulations": [{"id": "S1", "images": {"planche": exported}}]}}
+    record_export(rapport, "rapport.docx")
+    _expire(store, "session_a")
+    _expire(store, "session_b")
+
+    store.evict_unreferenced()
+
+    assert os.path.exists(exported)
+    assert not os.path.exists(orphan)
+
+
+def test_referenced_digests_finds_nested_store_paths(store):
+    path = store.store_bytes(b"contenu", "figure.png", "session")
+    digest = os.path.splitext(os.path.basename(path))[0]
+    data = {"a": [{"chemin": path}, {"chemin": "ailleurs/figure.png"}], "b": path}
+    assert store.referenced_digests(data) == [digest]
@@ -0,0 +1,408 @@
+# =============================================================================
+# upload_store.py - Content-addressed storage of uploaded files
+# =============================================================================
+
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional
+
+from config import Config
+
+OBJECTS_DIR = "objets"
+INCOMING_DIR = "entrants"    # fichiers en cours de réception, avant vérification
+
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    digest TEXT PRIMARY KEY,
+    chemin TEXT,
+    taille INTEGER,
+    dernier_acces REAL
+);
+CREATE TABLE IF NOT EXISTS refs (
+    espace TEXT,
+    digest TEXT,
+    dernier_acces REAL,
+    PRIMARY KEY (espace, digest)
+);
+"""
+
+
+# Index dont le schéma est déjà créé dans ce processus
+_SCHEMA_READY = set()
+_SCHEMA_LOCK = threading.Lock()
+
+
+class UploadQuotaError(Exception):
+    """Quota disque dépassé (espace du projet ou stockage global)"""
+
+
+def object_path(digest: str, name: str) -> str:
+    """Chemin d'un fichier stocké : uploads/objets/ab/abcdef....ext"""
+    ext = os.path.splitext(name)[1].lower()
+    return os.path.join(Config.UPLOAD_DIR, OBJECTS_DIR, digest[:2], digest + ext)
+
+
+def is_stored(path: str) -> bool:
+    return os.path.abspath(path).startswith(os.path.abspath(os.path.join(Config.UPLOAD_DIR, OBJECTS_DIR)) + os.sep)
+
+
+def _ensure_schema() -> None:
+    """Crée l'index (mode WAL, tables) une fois par processus"""
+    index = os.path.abspath(Config.UPLOAD_INDEX)
+    with _SCHEMA_LOCK:
+        if index in _SCHEMA_READY:
+            return
+        os.makedirs(Config.UPLOAD_DIR, exist_ok=True)
+        conn = sqlite3.connect(Config.UPLOAD_INDEX, timeout=30, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(INDEX_SCHEMA)
+        finally:
+            conn.close()
+        _SCHEMA_READY.add(index)
+
+
+@contextmanager
+def _index(write: bool = True):
+    """
+    Connexion à l'index des fichiers. En écriture, BEGIN IMMEDIATE pose le verrou d'écriture :
+    les contrôles de quota et les enregistrements de sessions concurrentes sont sérialisés.
+    En lecture (write=False), une transaction différée lit un instantané sans bloquer les envois.
+    """
+    _ensure_schema()
+    conn = sqlite3.connect(Config.UPLOAD_INDEX, timeout=30, isolation_level=None)
+    try:
+        conn.execute("BEGIN IMMEDIATE" if write else "BEGIN")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        conn.close()
+
+
+def _draft_ids() -> set:
+    if not os.path.exists(Config.DRAFTS_DB):
+        return set()
+    conn = sqlite3.connect(Config.DRAFTS_DB, timeout=10)
+    try:
+        return {row[0] for row in conn.execute("SELECT id FROM brouillons")}
+    except sqlite3.OperationalError:
+        return set()
+    finally:
+        conn.close()
+
+
+def referenced_digests(data) -> List[str]:
+    """Empreintes des fichiers du store cités par une valeur du rapport (chemins imbriqués)"""
+    found: Dict[str, None] = {}
+
+    def walk(value):
+        if isinstance(value, dict):
+            for v in value.values():
+                walk(v)
+        elif isinstance(value, list):
+            for v in value:
+                walk(v)
+        elif isinstance(value, str) and value and is_stored(value):
+            found.setdefault(os.path.splitext(os.path.basename(value))[0])
+
+    walk(data)
+    return list(found)
+
+
+def _exported_digests() -> set:
+    """Fichiers cités par une révision exportée (revision_diff.record_export)"""
+    if not os.path.exists(Config.REVISIONS_DB):
+        return set()
+    conn = sqlite3.connect(Config.REVISIONS_DB, timeout=10)
+    try:
+        rows = conn.execute("SELECT fichiers FROM exports WHERE fichiers IS NOT NULL").fetchall()
+    except sqlite3.OperationalError:
+        return set()
+    finally:
+        conn.close()
+    return {digest for (fichiers,) in rows for digest in json.loads(fichiers)}
+
+
+def _pinned_digests(conn) -> set:
+    """
+    Fichiers référencés par un brouillon existant, le catalogue, une révision exportée
+    ou une session active récemment
+    """
+    drafts = _draft_ids() | {Config.CATALOG_NAMESPACE}
+    since = time.time() - Config.UPLOAD_SESSION_TTL
+    rows = conn.execute("SELECT espace, digest, dernier_acces FROM refs").fetchall()
+    return {digest for espace, digest, last in rows if espace in drafts or last >= since} | _exported_digests()
+
+
+def _evict(conn, needed: int) -> int:
+    """Supprime les fichiers non référencés, du moins récemment utilisé au plus récent"""
+    pinned = _pinned_digests(conn)
+    freed = 0
+    for digest, path, size in conn.execute(
+        "SELECT digest, chemin, taille FROM blobs ORDER BY dernier_acces"
+    ).fetchall():
+        if freed >= needed:
+            break
+        if digest in pinned:
+            continue
+        if os.path.exists(path):
+            os.remove(path)
+        conn.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+        conn.execute("DELETE FROM refs WHERE digest = ?", (digest,))
+        freed += size
+    return freed
+
+
+def _namespace_usage(conn, namespace: str) -> int:
+    row = conn.execute(
+        "SELECT COALESCE(SUM(b.taille), 0) FROM refs r JOIN blobs b ON b.digest = r.digest WHERE r.espace = ?",
+        (namespace,)
+    ).fetchone()
+    return row[0]
+
+
+def check_quota(size: int, namespace: Optional[str] = None) -> None:
+    """
+    Contrôle préalable (avant de recevoir ou hacher un gros fichier) : lève UploadQuotaError
+    si `size` octets ne tiendraient pas dans le quota de l'espace ou, même après éviction
+    des fichiers non référencés, dans le stockage global
+    """
+    if namespace is not None and size > Config.UPLOAD_QUOTA_NAMESPACE:
+        raise UploadQuotaError(f"Fichier plus gros que le quota d'un projet ({Config.UPLOAD_QUOTA_NAMESPACE / 1e9:.1f} Go)")
+    with _index(write=False) as conn:
+        if namespace is not None and _namespace_usage(conn, namespace) + size > Config.UPLOAD_QUOTA_NAMESPACE:
+            raise UploadQuotaError(f"Quota du projet dépassé ({Config.UPLOAD_QUOTA_NAMESPACE / 1e9:.1f} Go)")
+        total = conn.execute("SELECT COALESCE(SUM(taille), 0) FROM blobs").fetchone()[0]
+        if total + size > Config.UPLOAD_QUOTA_TOTAL:
+            pinned = _pinned_digests(conn)
+            kept = sum(taille for digest, taille in conn.execute("SELECT digest, taille FROM blobs")
+                       if digest in pinned)
+            if kept + size > Config.UPLOAD_QUOTA_TOTAL:
+                raise UploadQuotaError(f"Stockage global plein ({Config.UPLOAD_QUOTA_TOTAL / 1e9:.1f} Go)")
+
+
+def _register(digest: str, path: str, size: int, namespace: str, tmp_path: Optional[str],
+              produce: Optional[Callable[[str], None]] = None) -> str:
+    """
+    Enregistre un fichier (déjà écrit dans tmp_path s'il est nouveau) sous quota et verrou.
+    produce(tmp) réécrit le contenu si le fichier, présent avant le verrou, a été évincé entre-temps.
+    """
+    now = time.time()
+    try:
+        with _index() as conn:
+            known = conn.execute("SELECT 1 FROM blobs WHERE digest = ?", (digest,)).fetchone() is not None
+            is_new = not (known and os.path.exists(path))
+            has_ref = conn.execute(
+                "SELECT 1 FROM refs WHERE espace = ? AND digest = ?", (namespace, digest)
+            ).fetchone() is not None
+
+            if not has_ref and _namespace_usage(conn, namespace) + size > Config.UPLOAD_QUOTA_NAMESPACE:
+                raise UploadQuotaError(
+                    f"Quota du projet dépassé ({Config.UPLOAD_QUOTA_NAMESPACE / 1e9:.1f} Go)"
+                )
+            if is_new and not os.path.exists(path):
+                total = conn.execute("SELECT COALESCE(SUM(taille), 0) FROM blobs").fetchone()[0]
+                excess = total + size - Config.UPLOAD_QUOTA_TOTAL
+                if excess > 0 and _evict(conn, excess) < excess:
+                    raise UploadQuotaError(
+                        f"Stockage global plein ({Config.UPLOAD_QUOTA_TOTAL / 1e9:.1f} Go)"
+                    )
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                if tmp_path is None:
+                    if produce is None:
+                        raise FileNotFoundError(f"{path} : fichier retiré du stockage")
+                    tmp_path = _tmp_path(path)
+                    produce(tmp_path)
+                if tmp_path is not None:
+                    os.replace(tmp_path, path)
+                    tmp_path = None
+
+            conn.execute("INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?)", (digest, path, size, now))
+            conn.execute("INSERT OR REPLACE INTO refs VALUES (?, ?, ?)", (namespace, digest, now))
+    finally:
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
+
+
+def _tmp_path(path: str) -> str:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return f"{path}.{os.getpid()}.{time.monotonic_ns()}.tmp"
+
+
+def store_bytes(data, name: str, namespace: str) -> str:
+    """
+    Enregistre un contenu sous son empreinte SHA-256 et le rattache à l'espace
+    (brouillon ou session) ; un contenu déjà présent n'est pas réécrit.
+    Retourne le chemin du fichier stocké ; lève UploadQuotaError si un quota est dépassé.
+    """
+    digest = hashlib.sha256(data).hexdigest()
+    path = object_path(digest, name)
+
+    def write(tmp_path):
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+
+    tmp_path = None
+    if not os.path.exists(path):
+        tmp_path = _tmp_path(path)
+        write(tmp_path)
+    return _register(digest, path, len(data), namespace, tmp_path, write)
+
+
+def store_upload(uploaded_file, namespace: str) -> str:
+    """Enregistre un fichier chargé via Streamlit (UploadedFile)"""
+    return store_bytes(uploaded_file.getbuffer(), uploaded_file.name, namespace)
+
+
+def store_file(path: str, namespace: str, chunk_size: int = 1024 * 1024) -> str:
+    """Enregistre un fichier du disque (lu par blocs) ; un fichier déjà dans le store est seulement référencé"""
+    size = os.path.getsize(path)
+    if is_stored(path):
+        digest = os.path.splitext(os.path.basename(path))[0]
+        return _register(digest, path, size, namespace, None)
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    stored = object_path(digest.hexdigest(), path)
+    tmp_path = None
+    if not os.path.exists(stored):
+        tmp_path = _tmp_path(stored)
+        shutil.copyfile(path, tmp_path)
+    return _register(digest.hexdigest(), stored, size, namespace, tmp_path,
+                     lambda tmp: shutil.copyfile(path, tmp))
+
+
+def store_stream(stream, name: str, namespace: str, expected_digest: Optional[str] = None,
+                 expected_size: Optional[int] = None, chunk_size: int = 1024 * 1024) -> str:
+    """
+    Enregistre un flux (fichier d'archive, corps de requête...) lu par blocs : mémoire constante.
+    Si l'empreinte ou la taille attendues ne correspondent pas, rien n'est enregistré (ValueError).
+    """
+    digest = hashlib.sha256()
+    size = 0
+    tmp_path = _tmp_path(os.path.join(Config.UPLOAD_DIR, INCOMING_DIR, os.path.basename(name)))
+    try:
+        with open(tmp_path, "wb") as f:
+            for chunk in iter(lambda: stream.read(chunk_size), b""):
+                digest.update(chunk)
+                size += len(chunk)
+                if expected_size is not None and size > expected_size:
+                    raise ValueError(f"{name} : taille supérieure aux {expected_size} octets annoncés")
+                f.write(chunk)
+        if expected_size is not None and size != expected_size:
+            raise ValueError(f"{name} : {size} octets reçus, {expected_size} annoncés")
+        if expected_digest is not None and digest.hexdigest() != expected_digest:
+            raise ValueError(f"{name} : empreinte différente de celle annoncée (fichier altéré)")
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    # Le fichier reçu est gardé jusqu'à l'enregistrement (retiré par _register s'il est inutile) :
+    # le flux ne peut pas être relu si le contenu est évincé avant la prise du verrou
+    return _register(digest.hexdigest(), object_path(digest.hexdigest(), name), size, namespace, tmp_path)
+
+
+def store_moved_file(path: str, namespace: str, expected_digest: Optional[str] = None,
+                     expected_size: Optional[int] = None, name: Optional[str] = None,
+                     chunk_size: int = 1024 * 1024) -> str:
+    """
+    Enregistre un fichier en le déplaçant dans le store (dossier de dépôt, envoi par morceaux) :
+    haché par blocs, lié plutôt que copié s'il est sur le même disque. Le fichier source
+    n'est supprimé qu'une fois l'enregistrement réussi (ValueError si taille ou empreinte
+    ne correspondent pas à celles annoncées). name : nom d'origine, pour l'extension.
+    """
+    size = os.path.getsize(path)
+    if expected_size is not None and size != expected_size:
+        raise ValueError(f"{os.path.basename(path)} : {size} octets, {expected_size} annoncés")
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    digest = digest.hexdigest()
+    if expected_digest is not None and digest != expected_digest:
+        raise ValueError(f"{os.path.basename(path)} : empreinte différente de celle annoncée (fichier altéré)")
+
+    stored = object_path(digest, name or path)
+
+    def link(tmp_path):
+        try:
+            os.link(path, tmp_path)
+        except OSError:  # autre disque ou liens non supportés
+            shutil.copyfile(path, tmp_path)
+
+    tmp_path = None
+    if not os.path.exists(stored):
+        tmp_path = _tmp_path(stored)
+        link(tmp_path)
+    result = _register(digest, stored, size, namespace, tmp_path, link)
+    os.remove(path)
+    return result
+
+
+def touch(paths: Iterable[str], namespace: str) -> None:
+    """Marque des fichiers comme utilisés (réouverture d'un brouillon) pour l'éviction LRU"""
+    digests = [os.path.splitext(os.path.basename(p))[0] for p in paths if is_stored(p)]
+    if not digests:
+        return
+    now = time.time()
+    with _index() as conn:
+        conn.executemany("UPDATE blobs SET dernier_acces = ? WHERE digest = ?", [(now, d) for d in digests])
+        conn.executemany("UPDATE refs SET dernier_acces = ? WHERE espace = ? AND digest = ?",
+                         [(now, namespace, d) for d in digests])
+
+
+def rename_namespace(old: str, new: str) -> None:
+    """Rattache les fichiers d'une session au brouillon créé pour elle"""
+    with _index() as conn:
+        conn.execute("UPDATE OR IGNORE refs SET espace = ? WHERE espace = ?", (new, old))
+        conn.execute("DELETE FROM refs WHERE espace = ?", (old,))
+
+
+def release_namespace(namespace: str) -> None:
+    """Retire les références d'un espace de transit (envoi rattaché depuis à un projet)"""
+    with _index() as conn:
+        conn.execute("DELETE FROM refs WHERE espace = ?", (namespace,))
+
+
+def usage_report() -> dict:
+    """Occupation disque globale et par espace (un fichier partagé compte dans chaque espace)"""
+    with _index(write=False) as conn:
+        total, count = conn.execute("SELECT COALESCE(SUM(taille), 0), COUNT(*) FROM blobs").fetchone()
+        rows = conn.execute(
+            "SELECT r.espace, COUNT(*), SUM(b.taille), MAX(r.dernier_acces) "
+            "FROM refs r JOIN blobs b ON b.digest = r.digest GROUP BY r.espace ORDER BY SUM(b.taille) DESC"
+        ).fetchall()
+    return {
+        "taille_totale": total,
+        "nb_fichiers": count,
+        "quota_total": Config.UPLOAD_QUOTA_TOTAL,
+        "quota_espace": Config.UPLOAD_QUOTA_NAMESPACE,
+        "espaces": [
+            {"espace": espace, "nb_fichiers": n, "taille": size, "dernier_acces": last}
+            for espace, n, size, last in rows
+        ],
+    }
+
+
+def stored_digests() -> List[str]:
+    """Empreintes des fichiers présents dans le store (inventaire pour un projet différentiel)"""
+    with _index(write=False) as conn:
+        rows = conn.execute("SELECT digest, chemin FROM blobs").fetchall()
+    return [digest for digest, path in rows if os.path.exists(path)]
+
+
+def evict_unreferenced() -> int:
+    """Supprime tous les fichiers qu'aucun brouillon ni session active ne référence ; retourne les octets libérés"""
+    with _index() as conn:
+        return _evict(conn, float("inf"))
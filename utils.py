@@ -3,78 +3,185 @@
 # =============================================================================
 
 import streamlit as st
+import hashlib
 import json
 import os
 from io import BytesIO
 from typing import Any, List
 from config import Config
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from upload_store import UploadQuotaError, store_upload
+from images import ImageTooLargeError, check_pixel_budget, is_image_file
+from image_index import lookup, submit
+
+try:
+    import orjson
+except ImportError:  # encodeur standard en repli
+    orjson = None
+
+def upload_namespace() -> str:
+    """Upload namespace of the session: its draft, or the session itself until a draft exists"""
+    draft_id = st.session_state.get("draft_id")
+    if draft_id:
+        return draft_id
+    ctx = get_script_run_ctx()
+    return f"session-{ctx.session_id if ctx else 'local'}"
 
 def save_uploaded_file(uploaded_file) -> str:
-    """Save uploaded file and return path"""
+    """Save uploaded file in the content-addressed store and return path"""
     if uploaded_file is None:
         return ""
     
+    # Un même fichier n'est haché et écrit qu'une fois par session
+    cache = st.session_state.setdefault("_upload_paths", {})
+    file_id = getattr(uploaded_file, "file_id", None)
+    if file_id in cache:
+        return cache[file_id]
+    
     Config.setup_directories()
-    file_path = os.path.join(Config.UPLOAD_DIR, uploaded_file.name)
-    with open(file_path, "wb") as f:
-        f.write(uploaded_file.getbuffer())
+    file_path = store_upload(uploaded_file, upload_namespace())
+    if file_id is not None:
+        cache[file_id] = file_path
     return file_path
 
+def uploaded_files(key: str, files) -> List[dict]:
+    """
+    Files of an uploader as [{"nom", "chemin"}]: those uploaded in this session,
+    otherwise those restored from a draft (stored under "<key>_path")
+    """
+    seen = st.session_state.setdefault("_uploads_seen", set())
+    if files is not None and not isinstance(files, list):
+        files = [files]
+    if files:
+        seen.add(key)
+        stored = []
+        for f in files:
+            try:
+                path = save_uploaded_file(f)
+                if is_image_file(path):
+                    check_pixel_budget(path)
+                    submit(path)  # analyse et dérivés en arrière-plan
+                stored.append({"nom": f.name, "chemin": path})
+            except (UploadQuotaError, ImageTooLargeError) as e:
+                st.error(f"⚠️ {f.name} non enregistré : {e}")
+        st.session_state[f"{key}_path"] = stored
+    elif key in seen:
+        # Fichier retiré de l'uploader par l'utilisateur
+        seen.discard(key)
+        st.session_state.pop(f"{key}_path", None)
+    return st.session_state.get(f"{key}_path", [])
+
+def uploaded_file_path(key: str, file) -> str:
+    """Single-file variant of uploaded_files: path of the file, or an empty string"""
+    stored = uploaded_files(key, file)
+    return stored[0]["chemin"] if stored else ""
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Hash a file by chunks, without loading it fully in memory"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
 def is_filled(value: Any) -> bool:
     """Check if value is not empty"""
     return value is not None and value != ""
 
 def validate_report(data: dict) -> bool:
-    """Validate if report has all required fields"""
-    # Check metadata - NOUVELLE STRUCTURE
-    metadata = data.get("metadonnees", {})  # Changé de "metadonnees_rapport" à "metadonnees"
-    if not all(is_filled(metadata.get(field)) for field in ["titre", "projet"]):
-        return False
-    
-    # Pas de code_document imbriqué - les champs sont maintenant directement dans metadonnees
-    if not all(is_filled(metadata.get(field)) for field in ["code_projet", "client", "type", "numero", "annee"]):
-        return False
-    
-    # Check introduction
-    intro = data.get("introduction", {})
-    if not all(is_filled(intro.get(field)) for field in ["guidelines", "objectifs"]):
-        return False
-    
-    # Check has ships and simulations - STRUCTURE CORRIGÉE
-    navires_data = data.get("donnees_navires", {}).get("navires", {}).get("navires", [])
-    if not navires_data:
-        return False
-        
-    simulations_data = data.get("simulations", {}).get("simulations", [])
-    if not simulations_data:
-        return False
-    
-    # Check conclusion
-    if not all(is_filled(data.get(field)) for field in ["synthese_redigee", "conclusion"]):
-        return False
-    
-    recommandations = data.get("recommandations", [])
-    if not recommandations or not any(is_filled(r) for r in recommandations):
-        return False
-    
-    return True
-
-def create_json_download(data: dict) -> BytesIO:
-    """Create downloadable JSON"""
+    """Validate if report has all required fields (see Config.VALIDATION_RULES)"""
+    from validation import ReportValidator
+    return not ReportValidator().validate(data)
+
+def json_dumps(data: Any, compact: bool = False) -> bytes:
+    """Serialize to UTF-8 JSON, with orjson when available"""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (0 if compact else orjson.OPT_INDENT_2)
+        return orjson.dumps(data, default=str, option=option)
+    if compact:
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=str).encode()
+    return json.dumps(data, indent=2, ensure_ascii=False, default=str).encode()
+
+def json_loads(data) -> Any:
+    """Parse JSON (bytes or str), with orjson when available"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def create_json_download(data: dict, compact: bool = False) -> BytesIO:
+    """Create downloadable JSON (stamped with the schema version for re-import)"""
     buffer = BytesIO()
-    buffer.write(json.dumps(data, indent=2, ensure_ascii=False).encode())
+    buffer.write(json_dumps({**data, "_schema": Config.REPORT_SCHEMA_VERSION}, compact))
     buffer.seek(0)
     return buffer
 
+def _json_pages(value: Any, max_bytes: int) -> List[Any]:
+    """Split a section into pages (subsets of its keys or items) under max_bytes each"""
+    if isinstance(value, dict):
+        items, rebuild = list(value.items()), dict
+    elif isinstance(value, list):
+        items, rebuild = list(value), list
+    else:
+        return [value]
+    
+    pages, current, size = [], [], 0
+    for item in items:
+        item_size = len(json_dumps(item, compact=True))
+        if rebuild is dict and item_size > max_bytes and isinstance(item[1], (dict, list)):
+            # Grosse sous-section (ex. liste des simulations) : paginée à part
+            if current:
+                pages.append(rebuild(current))
+                current, size = [], 0
+            pages.extend({item[0]: page} for page in _json_pages(item[1], max_bytes))
+            continue
+        if current and size + item_size > max_bytes:
+            pages.append(rebuild(current))
+            current, size = [], 0
+        current.append(item)
+        size += item_size
+    if current or not pages:
+        pages.append(rebuild(current))
+    return pages
+
+def render_json_preview(data: dict, key: str = "json_preview"):
+    """Paginated, collapsible JSON preview with per-section byte sizes"""
+    sizes = {section: len(json_dumps(value, compact=True)) for section, value in data.items()}
+    st.caption(f"Taille totale : {sum(sizes.values()) / 1024:.1f} Ko")
+    
+    section = st.selectbox(
+        "Section",
+        list(data),
+        format_func=lambda s: f"{s} ({sizes[s] / 1024:.1f} Ko)",
+        key=f"{key}_section"
+    )
+    if section is None:
+        return
+    
+    pages = _json_pages(data[section], Config.JSON_PREVIEW_MAX_BYTES)
+    page = 1
+    if len(pages) > 1:
+        page = st.number_input(f"Page (sur {len(pages)})", min_value=1, max_value=len(pages), key=f"{key}_page_{section}")
+    st.json(pages[page - 1], expanded=False)
+
+def show_image(path: str, caption: str = None, width: int = 200):
+    """Preview of an uploaded image from the metadata index; unreadable files are flagged"""
+    meta = lookup(path, wait=Config.IMAGE_INDEX_WAIT)
+    if meta is None:
+        st.caption(f"⏳ Analyse de l'image en cours... {caption or ''}")
+    elif not meta["decodable"]:
+        st.error(f"⚠️ Image illisible ({os.path.basename(path)}) : {meta['erreur']}")
+    else:
+        st.image(meta["apercu"], caption=caption, width=width)
+
 def handle_file_upload_with_legend(label: str, file_types: List[str], key: str) -> List[dict]:
     """Handle file upload with legends"""
-    uploaded_files = st.file_uploader(label, type=file_types, accept_multiple_files=True, key=key)
+    uploaded = st.file_uploader(label, type=file_types, accept_multiple_files=True, key=key)
     
     figures = []
-    for i, file in enumerate(uploaded_files or []):
-        path = save_uploaded_file(file)
-        legend = st.text_input(f"Légende pour {file.name}", key=f"{key}_legend_{i}")
-        st.image(path, caption=legend, width=200)
+    for i, file in enumerate(uploaded_files(key, uploaded)):
+        path = file["chemin"]
+        legend = st.text_input(f"Légende pour {file['nom']}", key=f"{key}_legend_{i}")
+        show_image(path, caption=legend, width=200)
         figures.append({"chemin": path, "legende": legend})
     
     return figures
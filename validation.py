@@ -0,0 +1,105 @@
+# =============================================================================
+# validation.py - Incremental report validation driven by Config.VALIDATION_RULES
+# =============================================================================
+
+import re
+from typing import Any, Dict, Iterable, List, Optional
+
+from config import Config
+from utils import is_filled
+
+RULE_MESSAGES = {
+    "rempli": "champ obligatoire non renseigné",
+    "non_vide": "au moins un élément est requis",
+    "un_rempli": "au moins une entrée non vide est requise",
+    "annee": "année attendue au format AAAA",
+}
+
+# Sections du rapport remplies par les widgets d'une autre section de brouillon (Config.DRAFT_SECTIONS)
+DRAFT_SECTION_OF = {
+    "synthese_redigee": "conclusion",
+    "recommandations": "conclusion",
+}
+
+
+def _check(rule: str, value: Any) -> bool:
+    if rule == "rempli":
+        return is_filled(value)
+    if rule == "non_vide":
+        return bool(value)
+    if rule == "un_rempli":
+        return bool(value) and any(is_filled(v) for v in value)
+    if rule == "annee":
+        return not is_filled(value) or re.fullmatch(r"\d{4}", str(value).strip()) is not None
+    raise ValueError(f"Règle de validation inconnue : {rule}")
+
+
+def _resolve(value: Any, segments: List[str], prefix: str):
+    """Itère sur (chemin concret, valeur) ; '[]' déplie les éléments d'une liste"""
+    if not segments:
+        yield prefix, value
+        return
+    head, rest = segments[0], segments[1:]
+    if head.endswith("[]"):
+        items = value.get(head[:-2], []) if isinstance(value, dict) else []
+        for i, item in enumerate(items or []):
+            yield from _resolve(item, rest, f"{prefix}.{head[:-2]}[{i}]")
+    else:
+        child = value.get(head) if isinstance(value, dict) else None
+        yield from _resolve(child, rest, f"{prefix}.{head}" if prefix else head)
+
+
+def _split_path(path: str) -> List[str]:
+    """'a.b[].c' -> ['a', 'b[]', 'c']"""
+    return path.split(".")
+
+
+def validate_section(section: str, value: Any) -> List[Dict[str, str]]:
+    """Applique les règles d'une section et retourne la liste des anomalies"""
+    issues = []
+    for path, label, rule in Config.VALIDATION_RULES:
+        segments = _split_path(path)
+        if segments[0].rstrip("[]") != section:
+            continue
+        for concrete, field_value in _resolve({section: value}, segments, ""):
+            if not _check(rule, field_value):
+                issues.append({
+                    "onglet": Config.SECTION_TABS.get(section, section),
+                    "section": section,
+                    "champ": concrete,
+                    "libelle": label,
+                    "message": RULE_MESSAGES[rule],
+                })
+    return issues
+
+
+class ReportValidator:
+    """
+    Valide le rapport section par section et garde le résultat de chacune : seules les
+    sections dont les clés de session ont changé (sections de brouillon signalées par
+    l'enregistrement automatique) sont revalidées.
+    """
+
+    def __init__(self):
+        self._cache: Dict[str, List[Dict[str, str]]] = {}
+        self.revalidated: List[str] = []
+
+    @staticmethod
+    def sections() -> List[str]:
+        return list(dict.fromkeys(_split_path(path)[0].rstrip("[]") for path, _, _ in Config.VALIDATION_RULES))
+
+    def validate(self, data: dict, changed: Optional[Iterable[str]] = None) -> List[Dict[str, str]]:
+        """
+        changed : sections de brouillon modifiées depuis l'appel précédent (retour de
+        drafts.autosave) ; None si le suivi n'est pas disponible : tout est revalidé
+        """
+        changed = None if changed is None else set(changed)
+        issues = []
+        self.revalidated = []
+        for section in self.sections():
+            draft_section = DRAFT_SECTION_OF.get(section, section)
+            if section not in self._cache or changed is None or draft_section in changed:
+                self._cache[section] = validate_section(section, data.get(section))
+                self.revalidated.append(section)
+            issues.extend(self._cache[section])
+        return issues
@@ -0,0 +1,150 @@
+# =============================================================================
+# watch_render.py - Watch mode: re-render the report when its data, assets or template change
+# =============================================================================
+#
+# Usage : python watch_render.py rapport.json [--template templates/report_template.docx]
+#                                [--sortie exports/apercu.docx] [--delai 0.3]
+#
+# Surveille le rapport.json, les images qu'il référence et le template ; après chaque
+# série de modifications (regroupées pendant --delai secondes), le DOCX est régénéré
+# dans ce même processus : templates compilés, index et dérivés des images restent
+# chauds. Une modification du seul template réutilise le contexte déjà préparé.
+
+import argparse
+import os
+import time
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from config import Config
+
+Signature = Tuple[int, int]  # (date de modification en ns, taille)
+
+
+def _signature(path: str) -> Optional[Signature]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _image_paths(data, found=None) -> set:
+    from word_export import is_image_path
+
+    found = set() if found is None else found
+    if isinstance(data, dict):
+        for value in data.values():
+            _image_paths(value, found)
+    elif isinstance(data, list):
+        for value in data:
+            _image_paths(value, found)
+    elif is_image_path(data):
+        found.add(data)
+    return found
+
+
+class ReportWatcher:
+    """Régénère un rapport à chaque modification de ses sources, avec des caches gardés chauds"""
+
+    def __init__(self, report_path: str, template_path: str, output_path: str,
+                 debounce: float = Config.WATCH_DEBOUNCE, poll: float = Config.WATCH_POLL):
+        self.report_path, self.template_path, self.output_path = report_path, template_path, output_path
+        self.debounce, self.poll = debounce, poll
+        self.assets = set()
+        self._context = None       # contexte préparé (images converties et mesurées)
+        self._used_images = {}
+        self.renders = 0
+
+    def _watched(self) -> Dict[str, Optional[Signature]]:
+        paths = {self.report_path, self.template_path} | self.assets
+        return {path: _signature(path) for path in paths}
+
+    def _prepare(self) -> None:
+        from report_import import migrate_report, validate_schema
+        from utils import json_loads
+        from word_export import prepare_context_for_template, replace_all_images
+
+        with open(self.report_path, "rb") as f:
+            data = json_loads(f.read())
+        errors = validate_schema(data)
+        if errors:
+            raise ValueError("Structure du rapport invalide : " + " ; ".join(errors))
+        data, _ = migrate_report(data)
+        self.assets = _image_paths(data)
+        self._used_images = {}
+        self._context = replace_all_images(prepare_context_for_template(data), None,
+                                           used_images=self._used_images)
+
+    def _write(self, data: bytes) -> str:
+        """Écriture atomique ; si le fichier est verrouillé (ouvert dans Word), écrit à côté"""
+        os.makedirs(os.path.dirname(self.output_path) or ".", exist_ok=True)
+        tmp_path = f"{self.output_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        try:
+            os.replace(tmp_path, self.output_path)
+            return self.output_path
+        except PermissionError:
+            base, ext = os.path.splitext(self.output_path)
+            fallback = f"{base}_{self.renders}{ext}"
+            os.replace(tmp_path, fallback)
+            return fallback
+
+    def render(self, changed=()) -> None:
+        from word_export import render_variant
+
+        start = time.perf_counter()
+        # Template seul modifié : le contexte préparé reste valable
+        if self._context is None or set(changed) - {self.template_path}:
+            self._prepare()
+        prepared = time.perf_counter()
+        data, _ = render_variant(self._context, self.template_path, {}, None, self._used_images)
+        rendered = time.perf_counter()
+        path = self._write(data)
+        end = time.perf_counter()
+        self.renders += 1
+
+        sources = ", ".join(os.path.basename(p) for p in sorted(changed)) or "démarrage"
+        print(f"[{datetime.now():%H:%M:%S}] {sources} -> {path} en {end - start:.2f} s "
+              f"(préparation {prepared - start:.2f} s, rendu {rendered - prepared:.2f} s, "
+              f"écriture {end - rendered:.2f} s, {len(data) / 1e6:.2f} Mo)", flush=True)
+
+    def _safe_render(self, changed=()) -> None:
+        try:
+            self.render(changed)
+        except Exception as e:
+            # Fichier en cours d'enregistrement, JSON ou template invalide : on attend la suite
+            self._context = None
+            print(f"[{datetime.now():%H:%M:%S}] ❌ {type(e).__name__} : {e}", flush=True)
+
+    def run(self) -> None:
+        print(f"Surveillance de {self.report_path} et {self.template_path} (Ctrl+C pour arrêter)", flush=True)
+        self._safe_render()
+        last = self._watched()
+        changed, last_change = set(), None
+        while True:
+            time.sleep(self.poll)
+            current = self._watched()
+            modified = {path for path in current.keys() | last.keys() if current.get(path) != last.get(path)}
+            last = current
+            if modified:
+                changed |= modified
+                last_change = time.monotonic()
+            elif changed and time.monotonic() - last_change >= self.debounce:
+                self._safe_render(changed)
+                changed, last = set(), self._watched()  # les images référencées ont pu changer
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Régénère le rapport Word à chaque modification")
+    parser.add_argument("rapport", help="rapport.json à surveiller")
+    parser.add_argument("--template", default=os.path.join("templates", "report_template.docx"))
+    parser.add_argument("--sortie", default=os.path.join(Config.OUTPUT_DIR, "apercu.docx"))
+    parser.add_argument("--delai", type=float, default=Config.WATCH_DEBOUNCE,
+                        help="regroupement des modifications (s)")
+    args = parser.parse_args()
+    try:
+        ReportWatcher(args.rapport, args.template, args.sortie, debounce=args.delai).run()
+    except KeyboardInterrupt:
+        pass
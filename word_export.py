@@ -2,10 +2,24 @@ import streamlit as st
 from datetime import datetime
 import os
 import json
-from docxtpl import DocxTemplate, InlineImage
+from docxtpl import InlineImage
 from docx.shared import Inches, Mm
+from docx.oxml.shape import CT_Inline
 from io import BytesIO
 import base64
+import hashlib
+import zipfile
+from docx_package import fit_to_budget, save_document
+from template_index import CachedDocxTemplate, merge_trees, template_usage, prune_context, unused_context_keys
+from render_scheduler import RENDER_SCHEDULER
+from sharded_render import ShardedDocxTemplate, render_code_digest, render_pool
+from images import IMAGE_EXTENSIONS, content_digest, image_header
+from image_index import image_metadata
+from memory_profile import MemoryProfiler, profile_stage
+from revision_diff import record_export, report_fingerprint
+from shared_cache import lookup_file, publish_bytes, publish_file, publish_json, shared_cache
+from utils import file_sha256
+from config import Config
 
 def prepare_context_for_template(rapport_data, doc_template=None):
     """
@@ -168,15 +182,105 @@ def is_image_path(value):
     
     # Vérifier l'extension
     ext = os.path.splitext(value)[1].lower()
-    is_img = ext in [".png", ".jpg", ".jpeg", ".bmp", ".gif"]
+    is_img = ext in IMAGE_EXTENSIONS
     
     return is_img
 
-def context_aware_image(doc, path, key_context=None):
-    """Crée une InlineImage avec taille adaptée selon le contexte"""
-    from PIL import Image
-    from docx.shared import Mm
+def estimate_decoded_image_bytes(data, seen=None):
+    """
+    Mémoire des images du rapport une fois décodées (largeur x hauteur x canaux, plafonnée
+    au budget d'une image embarquée), lue dans les seuls en-têtes ; chaque fichier
+    distinct n'est compté qu'une fois
+    """
+    seen = set() if seen is None else seen
+    if isinstance(data, dict):
+        return sum(estimate_decoded_image_bytes(v, seen) for v in data.values())
+    if isinstance(data, list):
+        return sum(estimate_decoded_image_bytes(v, seen) for v in data)
+    if not is_image_path(data) or data in seen or not os.path.exists(data):
+        return 0
+    seen.add(data)
+    try:
+        width, height, bands, _ = image_header(data)
+        return min(width * height, Config.IMAGE_MAX_PIXELS) * bands
+    except Exception:
+        return os.path.getsize(data)
+
+class ImageRegistry:
+    """
+    Registre des images d'un rendu : chaque contenu distinct est haché et
+    embarqué une seule fois, puis référencé partout où il apparaît (logo en
+    couverture et en en-tête, profil de navire réutilisé dans plusieurs simulations...)
+    """
+
+    def __init__(self):
+        self._digests = {}     # (chemin, taille, mtime) -> empreinte du contenu
+        self._canonical = {}   # empreinte -> premier chemin rencontré
+        self._parts = {}       # (partie du document, empreinte) -> (rId, image)
+        self.occurrences = 0
+        self.profiler = None   # MemoryProfiler éventuel (profil mémoire de l'export)
+
+    def digest(self, path):
+        stat = os.stat(path)
+        key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        if key not in self._digests:
+            self._digests[key] = content_digest(path)
+            self._canonical.setdefault(self._digests[key], path)
+        return self._digests[key]
 
+    def canonical_path(self, path):
+        return self._canonical[self.digest(path)]
+
+    def image_for_part(self, part, path):
+        """Ajoute l'image à la partie (document, en-tête...) une seule fois par contenu"""
+        key = (id(part), self.digest(path))
+        if key not in self._parts:
+            with profile_stage(self.profiler, "embarquement image", fichier=path):
+                self._parts[key] = part.get_or_add_image(self.canonical_path(path))
+        return self._parts[key]
+
+    @property
+    def unique_images(self):
+        return len(self._canonical)
+
+
+class SharedInlineImage(InlineImage):
+    """InlineImage qui réutilise la partie image déjà embarquée pour un même contenu"""
+
+    def __init__(self, tpl, image_descriptor, registry, width=None, height=None):
+        super().__init__(tpl, image_descriptor, width=width, height=height)
+        self.registry = registry
+
+    def _insert_image(self):
+        part = self.tpl.current_rendering_part
+        rId, image = self.registry.image_for_part(part, self.image_descriptor)
+        cx, cy = image.scaled_dimensions(self.width, self.height)
+        pic = CT_Inline.new_pic_inline(part.next_id, rId, image.filename, cx, cy).xml
+        return (
+            "</w:t></w:r><w:r><w:drawing>%s</w:drawing></w:r><w:r>"
+            '<w:t xml:space="preserve">' % pic
+        )
+
+class PreparedImage:
+    """
+    Image préparée une fois pour toutes (version Word, taille en mm selon le contexte),
+    indépendante de tout document : elle est liée à un template au moment du rendu
+    et peut être transmise aux processus de rendu
+    """
+
+    def __init__(self, image_descriptor, width_mm, height_mm):
+        self.image_descriptor = image_descriptor
+        self.width_mm, self.height_mm = width_mm, height_mm
+
+    def bind(self, doc, registry=None):
+        if registry is None:
+            return InlineImage(doc, self.image_descriptor, width=Mm(self.width_mm), height=Mm(self.height_mm))
+        registry.occurrences += 1
+        return SharedInlineImage(doc, self.image_descriptor, registry,
+                                 width=Mm(self.width_mm), height=Mm(self.height_mm))
+
+def prepare_image(path, key_context=None):
+    """Version Word de l'image et taille adaptée selon le contexte"""
     # Règles de taille par mot-clé (comme dans votre notebook)
     image_rules = {
         "logo": (30, 30),
@@ -199,40 +303,72 @@ def context_aware_image(doc, path, key_context=None):
     else:
         max_width, max_height = image_rules["default"]
 
-    try:
-        img = Image.open(path)
-        dpi = 96  # DPI par défaut
-        width_px, height_px = img.size
-        width_mm = width_px * 25.4 / dpi
-        height_mm = height_px * 25.4 / dpi
+    # Métadonnées indexées à l'upload : version Word (TIFF converti, grande image réduite) et dimensions
+    meta = image_metadata(path)
+    if not meta["decodable"]:
+        raise ValueError(meta["erreur"])
 
-        # Redimensionner si nécessaire
-        if width_mm > max_width or height_mm > max_height:
-            scale = min(max_width / width_mm, max_height / height_mm)
-            width_mm *= scale
-            height_mm *= scale
+    width_px, height_px = meta["derive_largeur"], meta["derive_hauteur"]
+    dpi = 96  # DPI par défaut
+    width_mm = width_px * 25.4 / dpi
+    height_mm = height_px * 25.4 / dpi
 
-        return InlineImage(doc, path, width=Mm(width_mm), height=Mm(height_mm))
+    # Redimensionner si nécessaire
+    if width_mm > max_width or height_mm > max_height:
+        scale = min(max_width / width_mm, max_height / height_mm)
+        width_mm *= scale
+        height_mm *= scale
+    return PreparedImage(meta["derive"], width_mm, height_mm)
+
+def context_aware_image(doc, path, key_context=None, registry=None):
+    """
+    Crée une InlineImage avec taille adaptée selon le contexte
+    (doc None : image seulement préparée, à lier plus tard avec bind_images)
+    """
+    try:
+        prepared = prepare_image(path, key_context)
+        return prepared if doc is None else prepared.bind(doc, registry)
 
     except Exception as e:
         st.error(f"⚠️ Erreur image {path} (contexte: {key_context}): {e}")
         return f"[Image non disponible: {os.path.basename(path)}]"
 
-def replace_all_images(data, doc, key_context=None):
+def bind_images(data, doc, registry=None):
+    """Lie les images préparées (PreparedImage) d'un contexte au document à rendre"""
+    if isinstance(data, dict):
+        return {k: bind_images(v, doc, registry) for k, v in data.items()}
+    if isinstance(data, list):
+        return [bind_images(item, doc, registry) for item in data]
+    if isinstance(data, PreparedImage):
+        return data.bind(doc, registry)
+    return data
+
+def replace_all_images(data, doc, key_context=None, section=None, used_images=None, registry=None,
+                       profiler=None):
     """
     Remplace récursivement tous les chemins d'images par des InlineImage
+    (doc None : par des PreparedImage, voir bind_images)
     Basé sur votre code qui marchait dans le notebook
+    used_images (optionnel) collecte {chemin: sections du rapport qui l'utilisent}
+    registry (optionnel) partage un même média entre toutes les occurrences d'un contenu
+    profiler (optionnel) mesure la mémoire de la préparation de chaque image
     """
     if isinstance(data, dict):
         result = {}
         for k, v in data.items():
-            new_value = replace_all_images(v, doc, key_context=k)
+            new_value = replace_all_images(v, doc, key_context=k, section=section or k,
+                                           used_images=used_images, registry=registry, profiler=profiler)
             result[k] = new_value
         return result
     elif isinstance(data, list):
-        return [replace_all_images(item, doc, key_context=key_context) for item in data]
+        return [replace_all_images(item, doc, key_context=key_context, section=section,
+                                   used_images=used_images, registry=registry, profiler=profiler) for item in data]
     elif is_image_path(data) and os.path.exists(data):
-        inline_img = context_aware_image(doc, data, key_context)
+        with profile_stage(profiler, "image", section=section, fichier=data):
+            inline_img = context_aware_image(doc, data, key_context, registry=registry)
+        if used_images is not None:
+            # Chemin réellement embarqué (éventuellement la version convertie)
+            used_images.setdefault(getattr(inline_img, "image_descriptor", data), set()).add(section or "")
         return inline_img
     else:
         return data
@@ -290,29 +426,124 @@ def replace_all_images(data, doc, key_context=None):
     remove_inline_images(clean_context)
     return clean_context
 
-def generate_word_report_with_template(rapport_data, template_path="templates/report_template.docx"):
+def _render_signature(value):
+    """Contexte réduit à une forme JSON stable, images remplacées par l'empreinte de leur contenu"""
+    if isinstance(value, dict):
+        return {str(k): _render_signature(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_render_signature(item) for item in value]
+    if isinstance(value, PreparedImage):
+        return ["image", content_digest(value.image_descriptor), round(value.width_mm, 2), round(value.height_mm, 2)]
+    if is_image_path(value) and os.path.isfile(value):
+        return ["image", content_digest(value)]
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    return repr(value)
+
+def render_cache_key(context, template_path, options=None, max_size_bytes=None):
+    """
+    Clé du rendu dans le cache partagé : contexte (images par contenu), template,
+    options d'édition, budget de taille et code de rendu. Un même rapport rendu par
+    n'importe quelle réplique donne la même clé.
+    """
+    payload = json.dumps([render_code_digest(), file_sha256(template_path), _render_signature(context),
+                          options or {}, max_size_bytes], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def cached_render(key, max_size_bytes=None):
+    """(contenu du DOCX, rapport de taille) déjà rendus sous cette clé, ou None"""
+    size_report = None
+    if max_size_bytes:
+        # Publié avant le DOCX : présent dès que le DOCX l'est
+        report_path = lookup_file("rendus", f"{key}_taille", ".json")
+        if report_path is None:
+            return None
+        with open(report_path, encoding="utf-8") as f:
+            size_report = json.load(f)
+    path = lookup_file("rendus", key, ".docx")
+    if path is None:
+        return None
+    with open(path, "rb") as f:
+        return f.read(), size_report
+
+def publish_render(key, data, size_report=None):
+    """Range un rendu dans le cache partagé pour toutes les répliques"""
+    if size_report is not None:
+        publish_json("rendus", f"{key}_taille", size_report)
+    publish_bytes("rendus", key, ".docx", data)
+
+def generate_word_report_with_template(rapport_data, template_path="templates/report_template.docx", max_size_bytes=None,
+                                       parallel=True, profile=False):
    """
    Génère un fichier Word en utilisant l'approche qui marchait dans votre notebook
+   max_size_bytes : taille maximale du fichier ; les images embarquées sont réduites
+   après le rendu (sans re-rendre le texte) jusqu'à tenir dans ce budget
+   parallel : les grandes boucles (simulations, scénarios) sont rendues par lots
+   dans des processus séparés (voir sharded_render)
+   profile : profil mémoire par étape (tracemalloc), enregistré en JSON dans
+   Config.PROFILE_DIR ; le rendu se fait alors dans ce processus pour tout mesurer
    """
+   profiler = None
+   if profile:
+       profiler = MemoryProfiler()
+       profiler.start()
+       parallel = False
+   statut = "erreur"
    try:
        # Vérifier que le template existe
        if not os.path.exists(template_path):
            raise FileNotFoundError(f"Template non trouvé : {template_path}")
        
        # Charger le template
-       doc = DocxTemplate(template_path)
+       doc = ShardedDocxTemplate(template_path) if parallel else CachedDocxTemplate(template_path)
        
-       # Préparer le contexte (SANS créer les InlineImage)
-       context = prepare_context_for_template(rapport_data)
+       with profile_stage(profiler, "preparation du contexte", allocations=True):
+           # Préparer le contexte (SANS créer les InlineImage)
+           context = prepare_context_for_template(rapport_data)
+           
+           # Ne garder que ce que le template utilise réellement
+           usage = template_usage(template_path)
+           unused = unused_context_keys(context, usage["_arbre"])
+           if unused:
+               with st.expander(f"⚠️ {len(unused)} champ(s) du rapport non utilisé(s) par le template"):
+                   st.write("\n".join(f"- `{path}`" for path in unused))
+           context = prune_context(context, usage["_arbre"])
        
        st.write("🔍 **Debug:** Préparation du contexte terminée")
        
+       # Même rapport déjà rendu (par cette réplique ou une autre) : rendu repris tel quel
+       cache_key = None
+       if profiler is None:
+           cache_key = render_cache_key(context, template_path, None, max_size_bytes)
+           cached = cached_render(cache_key, max_size_bytes)
+           if cached is not None:
+               data, size_report = cached
+               timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+               filename = f"rapport_manoeuvrabilite_{timestamp}.docx"
+               output_path = os.path.join("exports", filename)
+               os.makedirs("exports", exist_ok=True)
+               with open(output_path, "wb") as f:
+                   f.write(data)
+               st.write("♻️ **Rapport identique déjà généré : rendu repris du cache partagé**")
+               if size_report:
+                   show_size_report(size_report)
+               statut = "succes"
+               return output_path, filename
+       
        # MAINTENANT on remplace toutes les images par des InlineImage
        # (comme dans votre notebook qui marchait)
        st.write("🖼️ **Traitement des images...**")
-       context = replace_all_images(context, doc)
+       used_images = {}
+       registry = ImageRegistry()
+       registry.profiler = profiler
+       if parallel:
+           doc.registry = registry
+       with profile_stage(profiler, "images", allocations=True):
+           context = replace_all_images(context, doc, used_images=used_images, registry=registry,
+                                        profiler=profiler)
        
-       st.write("✅ **Images traitées avec succès**")
+       st.write(f"✅ **Images traitées avec succès** ({registry.unique_images} image(s) distincte(s) "
+                f"pour {registry.occurrences} occurrence(s))")
        
        # Ajouter des fonctions utilitaires au contexte
        context["format_success_rate"] = format_success_rate
@@ -320,7 +551,14 @@ def generate_word_report_with_template(rapport_data, template_path="templates/re
        
        # Rendre le document
        st.write("📝 **Génération du document...**")
-       doc.render(context)
+       with profile_stage(profiler, "rendu", allocations=True):
+           doc.render(context)
+       if profiler is not None:
+           profiler.tag_sections(used_images)
+       if parallel and doc.shard_stats:
+           st.write("⚡ **Rendu parallèle :** " + ", ".join(
+               f"{nb} élément(s) de `{liste}`" for liste, nb in doc.shard_stats.items())
+               + (f" ; {doc.reused_shards} lot(s) inchangé(s) repris du cache" if doc.reused_shards else ""))
        
        # Sauvegarder
        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
@@ -330,8 +568,23 @@ def generate_word_report_with_template(rapport_data, template_path="templates/re
        # Créer le dossier si nécessaire
        os.makedirs("exports", exist_ok=True)
        
-       doc.save(output_path)
+       with profile_stage(profiler, "enregistrement", allocations=True):
+           if max_size_bytes:
+               buffer = BytesIO()
+               save_document(doc, buffer)
+               data, size_report = fit_to_budget(buffer.getvalue(), max_size_bytes, used_images)
+               with open(output_path, "wb") as f:
+                   f.write(data)
+           else:
+               save_document(doc, output_path)
+       if max_size_bytes:
+           show_size_report(size_report)
+       if cache_key is not None:
+           if max_size_bytes:
+               publish_json("rendus", f"{cache_key}_taille", size_report)
+           publish_file("rendus", cache_key, ".docx", output_path)
        
+       statut = "succes"
        return output_path, filename
        
    except Exception as e:
@@ -339,6 +592,158 @@ def generate_word_report_with_template(rapport_data, template_path="templates/re
        import traceback
        st.error(f"Détails de l'erreur : {traceback.format_exc()}")
        return None, None
+   
+   finally:
+       if profiler is not None:
+           profiler.stop()
+           show_memory_profile(profiler.save(template=template_path, statut=statut,
+                                             taille_max_octets=max_size_bytes))
+
+def show_memory_profile(profile_path):
+    """Résumé du profil mémoire d'un export et téléchargement du fichier complet"""
+    with open(profile_path, encoding="utf-8") as f:
+        profile = json.load(f)
+    
+    with st.expander("🧠 Profil mémoire de l'export", expanded=True):
+        rss = profile.get("rss_pic_octets")
+        st.caption(f"Pic total : {profile['pic_total_octets'] / 1e6:.1f} Mo (mémoire Python tracée)"
+                   + (f", {rss / 1e6:.0f} Mo de mémoire résidente (images décodées comprises)" if rss else "")
+                   + f" · `{profile_path}`")
+        st.table([
+            {
+                "Étape": etape["etape"],
+                "Pic (Mo)": round(etape["pic_octets"] / 1e6, 1),
+                "Retenu (Mo)": round(etape["retenu_octets"] / 1e6, 1),
+                "RSS pic (Mo)": round(etape["rss_pic_octets"] / 1e6, 1) if "rss_pic_octets" in etape else None,
+                "RSS retenu (Mo)": round(etape["rss_delta_octets"] / 1e6, 1) if "rss_delta_octets" in etape else None,
+                "Durée (s)": etape["duree_s"],
+            }
+            for etape in profile["etapes"] if etape["niveau"] == 0 and "pic_octets" in etape
+        ])
+        if profile["par_section"]:
+            st.write("**Images par section**")
+            st.table([
+                {"Section": section, "Pic max (Mo)": round(v["pic_max_octets"] / 1e6, 1),
+                 "RSS pic max (Mo)": round(v["rss_pic_max_octets"] / 1e6, 1),
+                 "Retenu (Mo)": round(v["retenu_octets"] / 1e6, 1), "Images": v["etapes"]}
+                for section, v in profile["par_section"].items()
+            ])
+        st.download_button(
+            label="📥 Télécharger le profil (JSON)",
+            data=json.dumps(profile, ensure_ascii=False, indent=2),
+            file_name=os.path.basename(profile_path),
+            mime="application/json",
+        )
+
+def apply_variant_options(context, options):
+    """Contexte propre à une édition ; le contexte préparé, partagé entre éditions, n'est pas modifié"""
+    if options.get("commentaires_pilote", True):
+        return context
+    context = dict(context)
+    simulations = context.get("simulations")
+    if isinstance(simulations, dict) and isinstance(simulations.get("simulations"), list):
+        context["simulations"] = dict(simulations, simulations=[
+            dict(sim, commentaire_pilote="") for sim in simulations["simulations"]
+        ])
+    return context
+
+def render_variant(context, template_path, options, max_size_bytes=None, used_images=None):
+    """
+    (processus de rendu) Rend une édition à partir du contexte préparé : images déjà
+    converties et mesurées, seules leurs parties sont ajoutées au document.
+    Un rendu identique déjà fait par une réplique est repris du cache partagé.
+    Retourne (contenu du DOCX, rapport de taille ou None).
+    """
+    context = prune_context(apply_variant_options(context, options), template_usage(template_path)["_arbre"])
+    key = render_cache_key(context, template_path, options, max_size_bytes)
+    cached = cached_render(key, max_size_bytes)
+    if cached is not None:
+        return cached
+
+    doc = CachedDocxTemplate(template_path)
+    context = bind_images(context, doc, ImageRegistry())
+    context["format_success_rate"] = format_success_rate
+    context["format_date"] = format_date
+    doc.render(context)
+
+    buffer = BytesIO()
+    save_document(doc, buffer)
+    data, size_report = buffer.getvalue(), None
+    if max_size_bytes:
+        data, size_report = fit_to_budget(data, max_size_bytes, used_images)
+    publish_render(key, data, size_report)
+    return data, size_report
+
+def generate_report_variants(rapport_data, variants, max_size_bytes=None):
+    """
+    Génère plusieurs éditions du rapport en un seul passage : le contexte et les images
+    (conversion, mesure) sont préparés une fois, puis les éditions sont rendues en
+    parallèle dans les processus de rendu et réunies dans un zip.
+    variants : liste de (chemin du template, options) ; options["nom"] nomme l'édition,
+    options["commentaires_pilote"] (défaut True) garde les commentaires des pilotes
+    """
+    try:
+        for template_path, _ in variants:
+            if not os.path.exists(template_path):
+                raise FileNotFoundError(f"Template non trouvé : {template_path}")
+
+        # Seules les données lues par l'un des templates sont gardées : images converties
+        # et contexte transmis aux processus de rendu limités à ce qui sert
+        context = prepare_context_for_template(rapport_data)
+        context = prune_context(context, merge_trees(
+            *(template_usage(template_path)["_arbre"] for template_path, _ in variants)))
+        st.write("🖼️ **Préparation des images (une fois pour toutes les éditions)...**")
+        used_images = {}
+        context = replace_all_images(context, None, used_images=used_images)
+
+        st.write(f"📝 **Génération de {len(variants)} édition(s) en parallèle...**")
+        pool = render_pool()
+        futures = [
+            (options["nom"], pool.submit(render_variant, context, template_path, options, max_size_bytes, used_images))
+            for template_path, options in variants
+        ]
+
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        filename = f"rapport_manoeuvrabilite_{timestamp}_editions.zip"
+        output_path = os.path.join("exports", filename)
+        os.makedirs("exports", exist_ok=True)
+
+        # Les DOCX sont déjà compressés : stockés tels quels dans le zip
+        with zipfile.ZipFile(output_path, "w", zipfile.ZIP_STORED) as z:
+            for nom, future in futures:
+                data, size_report = future.result()
+                z.writestr(f"rapport_manoeuvrabilite_{timestamp}_{nom.lower().replace(' ', '_')}.docx", data)
+                st.write(f"✅ Édition **{nom}** : {len(data) / (1024 * 1024):.2f} Mo")
+                if size_report:
+                    show_size_report(size_report)
+
+        return output_path, filename
+
+    except Exception as e:
+        st.error(f"Erreur lors de la génération des éditions : {str(e)}")
+        import traceback
+        st.error(f"Détails de l'erreur : {traceback.format_exc()}")
+        return None, None
+
+def show_size_report(size_report):
+    """
+    Affiche la taille finale du document et le poids des médias par section
+    """
+    taille = size_report["taille_finale"] / (1024 * 1024)
+    if size_report["budget_respecte"]:
+        st.success(f"📦 Taille finale : {taille:.2f} Mo")
+    else:
+        st.warning(f"📦 Taille finale : {taille:.2f} Mo - budget de {size_report['taille_max'] / (1024 * 1024):.2f} Mo non atteint")
+    if size_report["reduction"]:
+        st.caption(
+            f"Images réduites à {size_report['reduction']['echelle']:.0%} "
+            f"(qualité {size_report['reduction']['qualite']}) en {size_report['iterations']} itération(s), "
+            f"{size_report['doublons_retires']} doublon(s) retiré(s)"
+        )
+    st.table([
+        {"Section": section or "-", "Médias (Ko)": round(poids / 1024, 1)}
+        for section, poids in size_report["poids_medias_par_section"].items()
+    ])
 
 def export_word_ui(rapport_data):
     """
@@ -361,12 +766,43 @@ def export_word_ui(rapport_data):
     
     with col2:
         st.info("Le rapport sera généré en utilisant le template de l'entreprise")
+        taille_max_mo = st.number_input(
+            "Taille maximale du fichier (Mo, 0 = sans limite)",
+            min_value=0.0, step=1.0, key="export_taille_max"
+        )
+        parallel = st.checkbox(
+            "⚡ Rendu parallèle des simulations et scénarios", value=True, key="export_parallele",
+            help=f"Boucles de plus de {Config.RENDER_SHARD_MIN_ITEMS} éléments rendues par lots "
+                 f"de {Config.RENDER_SHARD_SIZE} dans {Config.RENDER_SHARD_WORKERS} processus"
+        )
+        profile = st.checkbox(
+            "🧠 Profil mémoire (diagnostic)", value=False, key="export_profil_memoire",
+            help="Mesure la mémoire de chaque étape (contexte, chaque image, rendu, enregistrement) "
+                 "et produit un fichier JSON à joindre aux tickets d'incident. Export plus lent, "
+                 "rendu sans parallélisme."
+        )
     
     if st.button("🔄 Générer le rapport", type="primary"):
             with st.spinner("Génération du rapport en cours..."):
-                output_path, filename = generate_word_report_with_template(rapport_data, template_path)
+                max_size_bytes = int(taille_max_mo * 1024 * 1024) or None
+                
+                # File d'attente partagée : nombre de générations et mémoire image limités
+                queue_status = st.empty()
+                def show_position(position, depth):
+                    queue_status.info(f"⏳ En file d'attente : position {position} sur {depth}")
+                
+                # Empreintes relevées avant l'export (la préparation du contexte modifie le rapport)
+                fingerprint = report_fingerprint(rapport_data)
+                estimate = estimate_decoded_image_bytes(rapport_data)
+                with RENDER_SCHEDULER.slot(estimate, on_wait=show_position) as ticket:
+                    queue_status.empty()
+                    output_path, filename = generate_word_report_with_template(
+                        rapport_data, template_path, max_size_bytes, parallel, profile)
+                    if not output_path:
+                        ticket.failed()  # erreur déjà affichée par la génération
                 
                 if output_path and os.path.exists(output_path):
+                    record_export(rapport_data, filename, fingerprint)
                     # Bouton de téléchargement
                     with open(output_path, "rb") as file:
                         st.download_button(
@@ -378,13 +814,67 @@ def export_word_ui(rapport_data):
                         )
                     
                     st.success(f"✅ Rapport généré avec succès : {filename}")
-                    
-                    # Afficher un aperçu des données utilisées
-                    with st.expander("👁️ Aperçu des données du contexte en JSON"):
-                        # Créer un aperçu simplifié pour l'affichage
-                        context_preview = prepare_context_for_template(rapport_data)
-                        st.json(context_preview)
+                    st.caption("Les données utilisées sont visibles via « 👁️ Aperçu JSON » et « 🖥️ Aperçu HTML ».")
                         
                 else:
                     st.error("❌ Erreur lors de la génération du rapport")
-    
\ No newline at end of file
+    
+    with st.expander("🗂️ Plusieurs éditions en un passage"):
+        available = {nom: v for nom, v in Config.EXPORT_VARIANTS.items() if os.path.exists(v["template"])}
+        editions = st.multiselect(
+            "Éditions à générer", list(available), default=list(available)[:2], key="export_editions",
+            help="Contexte et images préparés une seule fois, éditions rendues en parallèle et livrées dans un zip"
+        )
+        absent = [nom for nom in Config.EXPORT_VARIANTS if nom not in available]
+        if absent:
+            st.caption("Template absent pour : " + ", ".join(
+                f"{nom} (`{Config.EXPORT_VARIANTS[nom]['template']}`)" for nom in absent))
+        
+        if st.button("🗂️ Générer les éditions", disabled=not editions):
+            with st.spinner("Génération des éditions en cours..."):
+                max_size_bytes = int(taille_max_mo * 1024 * 1024) or None
+                variants = [(available[nom]["template"], dict(available[nom], nom=nom)) for nom in editions]
+                
+                queue_status = st.empty()
+                def show_position(position, depth):
+                    queue_status.info(f"⏳ En file d'attente : position {position} sur {depth}")
+                
+                fingerprint = report_fingerprint(rapport_data)
+                estimate = estimate_decoded_image_bytes(rapport_data)
+                with RENDER_SCHEDULER.slot(estimate, on_wait=show_position) as ticket:
+                    queue_status.empty()
+                    zip_path, zip_name = generate_report_variants(rapport_data, variants, max_size_bytes)
+                    if not zip_path:
+                        ticket.failed()
+                
+                if zip_path and os.path.exists(zip_path):
+                    record_export(rapport_data, zip_name, fingerprint)
+                    with open(zip_path, "rb") as file:
+                        st.download_button(
+                            label=f"📥 Télécharger les {len(variants)} édition(s) (zip)",
+                            data=file.read(),
+                            file_name=zip_name,
+                            mime="application/zip",
+                            type="primary"
+                        )
+                else:
+                    st.error("❌ Erreur lors de la génération des éditions")
+    
+    with st.expander("📊 Charge de la génération"):
+        metrics = RENDER_SCHEDULER.metrics()
+        col1, col2, col3 = st.columns(3)
+        col1.metric("En cours", f"{metrics['en_cours']} / {metrics['max_simultanes']}")
+        col2.metric("En attente", metrics["file_attente"], help=f"Maximum observé : {metrics['file_attente_max']}")
+        col3.metric("Attente p95", f"{metrics['attente_p95_s']} s", help=f"Moyenne : {metrics['attente_moyenne_s']} s")
+        st.caption(
+            f"Mémoire image réservée : {metrics['memoire_reservee'] / 1e6:.0f} / {metrics['budget_memoire'] / 1e6:.0f} Mo · "
+            f"{metrics['generations']} génération(s), {metrics['echecs']} échec(s), durée moyenne {metrics['duree_moyenne_s']} s"
+        )
+        cache = shared_cache().stats(with_usage=False)
+        if cache["espaces"]:
+            st.caption(
+                f"♻️ Cache partagé ({cache['repliques']} processus) : taux de succès "
+                f"{100 * (cache['taux_succes'] or 0):.0f} % · " + ", ".join(
+                    f"{espace} {100 * (v['taux_succes'] or 0):.0f} % ({v['succes']} / {v['succes'] + v['echecs']})"
+                    for espace, v in sorted(cache["espaces"].items()))
+            )